@@ -7,12 +7,21 @@ logfile="$cwd/pt-vis.log"
 dbconfigdir="$cwd/conf"
 dbconfig="$dbconfigdir/db_config"
 backenddir="$cwd/pt-visualizer/backend"
+# Production server settings, can be overridden from the environment
+bind="${PT_VIS_BIND:-127.0.0.1:5005}"
+workers="${PT_VIS_WORKERS:-$(nproc)}"
+threads="${PT_VIS_THREADS:-4}"
+timeout="${PT_VIS_TIMEOUT:-600}"
+# RQ workers computing heavy results in the background (see jobs.py)
+rqworkers="${PT_VIS_RQ_WORKERS:-$(nproc)}"
 
 function show_help {
     echo "Usage $(basename -- $0) [command1] [command2] ..."
     echo "Available commands: "
     echo " -v/--venv : Installs Python VirtualEnv"
-    echo " -s/--serv : Start Flask web app"
+    echo " -s/--serv : Start web app (gunicorn, PT_VIS_WORKERS x PT_VIS_THREADS)"
+    echo " --serv-dev : Start web app on the Flask debug server"
+    echo "              (both also start PT_VIS_RQ_WORKERS background workers)"
     echo " -k/--kill : Kill Flask web app"
     echo " -b/--build : Build web app"
     echo " -c/--clean : Clean web app"
@@ -35,8 +44,8 @@ function venv {
 function killserv {
     echo "Killing Python processes"
     if [ -f "$pidfile" ]; then
-        pypid=`cat "$pidfile"`
-        pypid="$pypid `ps -o pid= --ppid $pypid`"
+        pypid=`cat "$pidfile" | xargs`
+        pypid="$pypid `ps -o pid= --ppid "${pypid// /,}"`"
         echo "Killing $pypid"
         kill -9 $pypid
         rm "$pidfile"
@@ -62,8 +71,20 @@ function startserv {
     echo "Server started at `date`">> "$logfile"
     echo "----------------------------------------------">> "$logfile"
     source "$venvdir/bin/activate"
-    python "$backenddir/sat-backend.py" >> "$logfile" 2>&1 &
+    if [ "$1" == "dev" ]; then
+        python "$backenddir/sat-backend.py" >> "$logfile" 2>&1 &
+    else
+        # Pre-fork server: heatmap builds are CPU bound, so they need
+        # processes to run in parallel, threads keep small requests flowing
+        gunicorn --chdir "$backenddir" --bind "$bind" \
+                 --workers "$workers" --threads "$threads" \
+                 --timeout "$timeout" wsgi:application >> "$logfile" 2>&1 &
+    fi
     echo $! > "$pidfile"
+    for ((idx = 0; idx < rqworkers; idx++)); do
+        rq worker --path "$backenddir" >> "$logfile" 2>&1 &
+        echo $! >> "$pidfile"
+    done
     echo "Running server"
 }
 
@@ -111,6 +132,8 @@ function dbsetup {
         if [ -z $founduname ]; then
             sudo -u postgres psql -q --command "CREATE USER $dbuser WITH PASSWORD '$dbpassword';"
             sudo -u postgres psql -q --command "CREATE DATABASE $dbname OWNER $dbuser;"
+            # Trigram indexes of the symbol search
+            sudo -u postgres psql -q -d "$dbname" --command "CREATE EXTENSION IF NOT EXISTS pg_trgm;"
         else
             echo "User $dbuser already present in the database"
         fi
@@ -137,6 +160,9 @@ do
     -s|--serv)
         startserv
     ;;
+    --serv-dev)
+        startserv dev
+    ;;
     -k|--kill)
         killserv
     ;;
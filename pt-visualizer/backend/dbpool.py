@@ -0,0 +1,105 @@
+'''
+// Copyright (c) 2015-2019 Intel Corporation
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//      http://www.apache.org/licenses/LICENSE-2.0
+//
+// Unless required by applicable law or agreed to in writing, software
+// distributed under the License is distributed on an "AS IS" BASIS,
+// WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+// See the License for the specific language governing permissions and
+// limitations under the License.
+'''
+# Bounded, thread-safe pool of database connections for the Flask backend.
+#
+# psycopg2's ThreadedConnectionPool raises PoolError as soon as all maxconn
+# connections are checked out. Bursts of small UI requests should queue for a
+# connection instead, so getconn() waits up to 'timeout' seconds for one to
+# be returned before failing. Up to minconn connections are kept open while
+# idle, the others are closed when they are returned.
+
+import time
+import threading
+import psycopg2
+import psycopg2.pool
+
+DEFAULT_MIN = 4
+DEFAULT_MAX = 16
+# Seconds a request waits for a free connection before giving up
+DEFAULT_TIMEOUT = 30
+
+
+class PoolTimeout(psycopg2.pool.PoolError):
+    pass
+
+
+class ConnectionPool(object):
+    def __init__(self, minconn=DEFAULT_MIN, maxconn=DEFAULT_MAX,
+                 timeout=DEFAULT_TIMEOUT, **connect_args):
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.pool = psycopg2.pool.ThreadedConnectionPool(minconn, maxconn,
+                                                         **connect_args)
+        self.cond = threading.Condition()
+        self.in_use = 0
+        self.max_in_use = 0
+        self.checkouts = 0
+        self.waits = 0
+        self.timeouts = 0
+        self.discarded = 0
+
+    def getconn(self):
+        with self.cond:
+            if self.in_use >= self.maxconn:
+                self.waits += 1
+                deadline = time.time() + self.timeout
+                while self.in_use >= self.maxconn:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        self.timeouts += 1
+                        raise PoolTimeout("no database connection available "
+                                          "after %d seconds" % self.timeout)
+                    self.cond.wait(remaining)
+            self.in_use += 1
+            self.checkouts += 1
+            self.max_in_use = max(self.max_in_use, self.in_use)
+        try:
+            return self.pool.getconn()
+        except Exception:
+            self._release(False)
+            raise
+
+    def putconn(self, conn):
+        """ Returns a connection; broken ones are closed, not reused """
+        close = bool(conn.closed)
+        try:
+            self.pool.putconn(conn, close=close)
+        finally:
+            self._release(close)
+
+    def _release(self, discarded):
+        with self.cond:
+            self.in_use -= 1
+            if discarded:
+                self.discarded += 1
+            self.cond.notify()
+
+    def closeall(self):
+        self.pool.closeall()
+
+    def stats(self):
+        with self.cond:
+            return {"min": self.minconn,
+                    "max": self.maxconn,
+                    "open": len(self.pool._pool) + len(self.pool._used),
+                    "idle": len(self.pool._pool),
+                    "inUse": self.in_use,
+                    "maxInUse": self.max_in_use,
+                    "checkouts": self.checkouts,
+                    "waits": self.waits,
+                    "timeouts": self.timeouts,
+                    "discarded": self.discarded}
@@ -0,0 +1,158 @@
+'''
+// Copyright (c) 2015-2019 Intel Corporation
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//      http://www.apache.org/licenses/LICENSE-2.0
+//
+// Unless required by applicable law or agreed to in writing, software
+// distributed under the License is distributed on an "AS IS" BASIS,
+// WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+// See the License for the specific language governing permissions and
+// limitations under the License.
+'''
+# Batch disassembly through Intel XED.
+#
+# Instead of one 'xed -d' process per instruction, all opcodes that are not
+# cached yet are concatenated into a raw buffer and decoded by a single
+# 'xed -ir' run. Every instruction's offset in the buffer is known, so the
+# XDIS lines are matched back by address, which also keeps the mapping right
+# when xed has to skip over bytes it cannot decode.
+
+import os
+import re
+import threading
+import subprocess
+import tempfile
+from collections import OrderedDict
+import psycopg2
+import psycopg2.extras
+
+XED = os.environ.get('XED', 'xed')
+DEFAULT_MODE = '64'
+CACHE_SIZE = 64 * 1024
+UNKNOWN = "unknown"
+
+# Per-trace table with the decoded text of every distinct opcode
+DISASM_TABLE = "disasm"
+# Opcodes decoded per xed run when filling DISASM_TABLE
+STORE_BATCH = 100 * 1024
+
+xdis_extr = re.compile('XDIS ([0-9a-fA-F]+): +\S+ +\S+ +[0-9a-fA-F]+ +(.*)')
+
+
+class Disassembler(object):
+    def __init__(self, mode=DEFAULT_MODE, cache_size=CACHE_SIZE, xed=XED):
+        self.mode = mode
+        self.cache_size = cache_size
+        self.xed = xed
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _cache_get(self, key):
+        text = self.cache.pop(key, None)
+        if text is not None:
+            self.cache[key] = text
+        return text
+
+    def _cache_put(self, key, text):
+        self.cache.pop(key, None)
+        self.cache[key] = text
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def _run_xed(self, opcodes):
+        """ Decodes a list of distinct opcodes with one xed process """
+        offsets = []
+        offset = 0
+        for opcode in opcodes:
+            offsets.append(offset)
+            offset += len(opcode)
+        raw_file = tempfile.NamedTemporaryFile(prefix='pt-vis-disasm-',
+                                               suffix='.bin')
+        try:
+            raw_file.write(b''.join(opcodes))
+            raw_file.flush()
+            result = subprocess.check_output(
+                            [self.xed, "-" + self.mode, "-ir", raw_file.name],
+                            stderr=subprocess.STDOUT)
+        finally:
+            raw_file.close()
+        decoded = {}
+        for line in result.decode('ascii', 'replace').splitlines():
+            res = xdis_extr.match(line)
+            if res:
+                decoded[int(res.group(1), 16)] = res.group(2).strip()
+        return [decoded.get(off, UNKNOWN) for off in offsets]
+
+    def decode_many(self, opcodes):
+        """ Returns the decoded text of each opcode (a bytes-like object) """
+        keys = [(bytes(opcode), self.mode) for opcode in opcodes]
+        texts = {}
+        missing = []
+        with self.lock:
+            for key in keys:
+                if key in texts:
+                    continue
+                text = self._cache_get(key)
+                if text is None:
+                    texts[key] = None
+                    missing.append(key)
+                else:
+                    texts[key] = text
+            # Once per distinct opcode, as each is looked up only once
+            self.hits += len(texts) - len(missing)
+            self.misses += len(missing)
+        if missing:
+            decoded = self._run_xed([key[0] for key in missing])
+            with self.lock:
+                for key, text in zip(missing, decoded):
+                    texts[key] = text
+                    self._cache_put(key, text)
+        return [texts[key] for key in keys]
+
+    def decode(self, opcode):
+        return self.decode_many([opcode])[0]
+
+    def stats(self):
+        with self.lock:
+            return {"entries": len(self.cache),
+                    "capacity": self.cache_size,
+                    "hits": self.hits,
+                    "misses": self.misses}
+
+
+def store_disasm_table(cur, schema, mode=DEFAULT_MODE):
+    """ Decodes every distinct opcode of a trace once and stores the text in
+        the trace's DISASM_TABLE, keyed by the opcode bytes.
+    """
+    table = schema + "." + DISASM_TABLE
+    cur.execute("DROP TABLE IF EXISTS " + table)
+    cur.execute("CREATE TABLE " + table + " ("
+                "opcode  bytea  NOT NULL,"
+                "instr   text,"
+                "PRIMARY KEY (opcode))")
+    cur.execute("select distinct opcode from " + schema + ".instructions "
+                "where opcode is not null")
+    opcodes = [row[0] for row in cur.fetchall()]
+    disassembler = Disassembler(mode=mode, cache_size=0)
+    for start in range(0, len(opcodes), STORE_BATCH):
+        batch = opcodes[start:start + STORE_BATCH]
+        decoded = disassembler.decode_many(batch)
+        psycopg2.extras.execute_values(cur,
+            "INSERT INTO " + table + " (opcode, instr) VALUES %s",
+            [(psycopg2.Binary(bytes(opcode)), text)
+             for opcode, text in zip(batch, decoded)])
+
+
+#Singleton
+ins = None
+def getDisassembler():
+    global ins
+    if not ins:
+        ins = Disassembler()
+    return ins
@@ -0,0 +1,801 @@
+'''
+// Copyright (c) 2015-2019 Intel Corporation
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//      http://www.apache.org/licenses/LICENSE-2.0
+//
+// Unless required by applicable law or agreed to in writing, software
+// distributed under the License is distributed on an "AS IS" BASIS,
+// WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+// See the License for the specific language governing permissions and
+// limitations under the License.
+'''
+import math
+import json
+import uuid
+import struct
+import contextlib
+import numpy as np
+import psycopg2
+
+DEBUG = False
+
+# Instructions further apart than this inside the same DSO go to a new slice
+MAX_RANGE_GAP = 128 * 1024 * 1024
+# Normalized values are scaled to [0, NORMALIZED_MAX]
+NORMALIZED_MAX = 2047.0
+
+LOG2 = math.log(2)
+
+# bytes_per_sample levels precomputed for every trace (see store_pyramid), the
+# ones the UI offers unless [Heatmap] pyramid_levels is set in conf/db_config
+PYRAMID_LEVELS = [64, 2048]
+PYRAMID_TABLE = "heatmap_pyramid"
+
+# Rows fetched at a time from the server-side cursor when streaming
+STREAM_CHUNK = 256 * 1024
+
+# Packed little-endian layouts of the sparse pixel columns
+PIXEL_DTYPE = np.dtype('<u4')
+NORMALIZED_DTYPE = np.dtype('<u2')
+RAW_DTYPE = np.dtype('<i8')
+
+
+# Gets the smallest value >= val which is a multiple of 'to'
+def alignValueTo(val, to):
+    if val == 0:
+        return to
+    md = val % to
+    return int(val if md == 0 else val + (to - md))
+
+# Gets the largest value <= val which is a multiple of 'to'
+def closestAlignedValueTo(val, to):
+    return val - (val % to)
+
+
+class MemoryRange(object):
+    def __init__(self, start_address, end_address, dso_name):
+        self.start_address = start_address
+        self.end_address = end_address
+        self.dso_name = dso_name
+        self.data_raw = None
+        self.data_normalized = None
+        self.wss = 0
+
+    def update_range_info(self, bytes_per_sample):
+        self.start_address_aligned = closestAlignedValueTo(
+                                                self.start_address,
+                                                bytes_per_sample)
+        self.end_address_aligned = alignValueTo(
+                                                self.end_address,
+                                                bytes_per_sample)
+        self.byte_size = self.end_address - self.start_address + 1
+        self.byte_size_aligned = self.end_address_aligned - \
+                                 self.start_address_aligned + \
+                                 bytes_per_sample
+        self.sample_count = self.byte_size_aligned // bytes_per_sample
+
+    def sparse_data(self):
+        """ Returns (pixel indexes, normalized, raw) of the non-empty pixels """
+        nonzero = np.flatnonzero(self.data_raw)
+        return (nonzero, self.data_normalized[nonzero],
+                self.data_raw[nonzero])
+
+    def info(self, index):
+        return {
+            "index": index,
+            "startAddress": self.start_address,
+            "endAddress": self.end_address,
+            "totalSize": self.byte_size,
+            "startAddressAligned": self.start_address_aligned,
+            "endAddressAligned": self.end_address_aligned,
+            "dsoName": self.dso_name,
+            "wss": int(self.wss)
+        }
+
+    def to_dict(self, index, sparse=None):
+        pixels, normalized, raw = \
+            self.sparse_data() if sparse is None else sparse
+        result = self.info(index)
+        result["data"] = dict(zip(pixels.tolist(),
+                                  zip(normalized.tolist(), raw.tolist())))
+        return result
+
+
+class Columns(object):
+    """ Column-wise view of (ip, length, exec_count, dso_name) rows """
+    def __init__(self, ips, lengths, counts, dso_names):
+        self.ips = np.asarray(ips, dtype=np.int64)
+        self.lengths = np.asarray(lengths, dtype=np.int64)
+        self.counts = np.asarray(counts, dtype=np.int64)
+        self.dso_names = dso_names
+
+    def __len__(self):
+        return len(self.dso_names)
+
+
+def instructions_query(source):
+    """ Query of the heatmap input rows, 'source' being instructions_view or
+        a table with the same columns.
+    """
+    return ("select ip, octet_length(opcode) as length, exec_count, "
+            "dso_name from " + source + " order by ip")
+
+
+def summed_instructions_query(source, counts):
+    """ Like instructions_query, with exec_count taken from 'counts', a
+        subquery of (instruction_id, exec_count) rows.
+    """
+    return ("select v.ip, octet_length(v.opcode) as length, w.exec_count, "
+            "v.dso_name from (" + counts + ") w "
+            "join " + source + " v on v.id = w.instruction_id "
+            "order by v.ip")
+
+
+#
+# Time windows: exec counts per (instruction, window) written by the exporter
+# when run with 'windows=<n>'.
+#
+WINDOWS_TABLE = "instruction_windows"
+TIME_WINDOWS_TABLE = "time_windows"
+
+
+def windowed_instructions_query(schema, source):
+    """ instructions_query with exec_count summed over the windows that
+        overlap [%(start_time)s, %(end_time)s].
+    """
+    return summed_instructions_query(source,
+                "select instruction_id, sum(exec_count) as exec_count "
+                "from " + schema + "." + WINDOWS_TABLE + " "
+                "where window_id in ("
+                    "select id from " + schema + "." + TIME_WINDOWS_TABLE +
+                    " where end_time >= %(start_time)s"
+                    " and start_time <= %(end_time)s) "
+                "group by instruction_id")
+
+
+def time_windows(cur, schema):
+    cur.execute("select id, start_time, end_time from " + schema + "." +
+                TIME_WINDOWS_TABLE + " order by id")
+    return [{"window": row[0], "startTime": row[1], "endTime": row[2]}
+            for row in cur.fetchall()]
+
+
+#
+# Per-thread and per-cpu exec counts written by the exporter when run with
+# 'breakdown', as (table, id column) pairs.
+#
+THREADS_BREAKDOWN = ("instruction_threads", "thread_id")
+CPUS_BREAKDOWN = ("instruction_cpus", "cpu_id")
+
+
+def breakdown_instructions_query(schema, source, breakdown):
+    """ instructions_query with exec_count summed over the threads or cpus
+        (depending on 'breakdown') listed in %(ids)s.
+    """
+    table, column = breakdown
+    return summed_instructions_query(source,
+                "select instruction_id, sum(exec_count) as exec_count "
+                "from " + schema + "." + table + " "
+                "where " + column + " = any(%(ids)s) "
+                "group by instruction_id")
+
+
+def breakdown_totals(cur, schema, breakdown):
+    """ Returns [id, exec count, instruction count] per thread or cpu,
+        hottest first
+    """
+    table, column = breakdown
+    cur.execute("select " + column + ", sum(exec_count), count(*) from " +
+                schema + "." + table + " group by " + column +
+                " order by 2 desc")
+    return [list(row) for row in cur.fetchall()]
+
+
+def columns_from_rows(rows):
+    count = len(rows)
+    return Columns(np.fromiter((row[0] for row in rows), np.int64, count),
+                   np.fromiter((row[1] for row in rows), np.int64, count),
+                   np.fromiter((row[2] for row in rows), np.int64, count),
+                   [row[3] for row in rows])
+
+
+def load_columns(cur):
+    """ Reads (ip, length, exec_count, dso_name) rows from an executed cursor
+        into a Columns object.
+    """
+    return columns_from_rows(cur.fetchall())
+
+
+@contextlib.contextmanager
+def server_cursor(conn):
+    """ Named cursor, whose rows stay on the server until they are fetched.
+        Such a cursor only lives inside a transaction, which is opened for
+        its lifetime on autocommit connections.
+    """
+    autocommit = conn.autocommit
+    conn.autocommit = False
+    cur = conn.cursor("heatmap_stream_" + uuid.uuid4().hex)
+    try:
+        yield cur
+    finally:
+        try:
+            cur.close()
+        except psycopg2.Error:
+            pass
+        if autocommit:
+            conn.rollback()
+            conn.autocommit = True
+
+
+def iter_columns(conn, query, chunk_size=STREAM_CHUNK):
+    """ Runs 'query' on a server-side cursor and yields its rows as Columns
+        chunks of at most chunk_size rows.
+    """
+    with server_cursor(conn) as cur:
+        cur.execute(query)
+        while True:
+            rows = cur.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield columns_from_rows(rows)
+
+
+class RangeSplitter(object):
+    """ Groups ip-sorted rows into per-DSO memory ranges. DSOs with holes
+        larger than MAX_RANGE_GAP are split into several slices.
+        Rows are first fed with add() to find the ranges, then finish() fixes
+        their order and assign() maps rows to the index of their range (-1 if
+        the row is dropped). Both passes can be done chunk by chunk, and work
+        on whole DSOs at a time: their cost is linear in the number of rows
+        however many slices the DSOs are split into. A slice ends with its
+        last row, so rows of overlapping instructions that run past that
+        end are dropped.
+    """
+    def __init__(self):
+        self.dso_codes = {}
+        self.dso_names = []
+        # DSO name -> its slices, in address order
+        self.dso_slices = {}
+        self.slice_bounds = None
+        self.range_index = None
+
+    def _dso_groups(self, columns):
+        """ Yields (dso name, row indexes in ip order) for the rows with a
+            non-zero ip
+        """
+        get_code = self.dso_codes.get
+        codes = np.fromiter((get_code(name, -1) for name in columns.dso_names),
+                            np.int64, len(columns))
+        if (codes < 0).any():
+            for name in set(columns.dso_names):
+                if name not in self.dso_codes:
+                    self.dso_codes[name] = len(self.dso_names)
+                    self.dso_names.append(name)
+            codes = np.fromiter((get_code(name) for name in
+                                 columns.dso_names), np.int64, len(columns))
+        codes[columns.ips == 0] = -1
+        # Stable, so the rows of every DSO stay in ip order
+        order = np.argsort(codes, kind='mergesort')
+        bounds = np.flatnonzero(np.diff(codes[order])) + 1
+        for rows in np.split(order, bounds):
+            if len(rows) and codes[rows[0]] >= 0:
+                yield self.dso_names[codes[rows[0]]], rows
+
+    def add(self, columns):
+        for dso_name, rows in self._dso_groups(columns):
+            starts = columns.ips[rows]
+            ends = starts + columns.lengths[rows] - 1
+            slices = self.dso_slices.setdefault(dso_name, [])
+            # Rows are ip-sorted, so a row can only extend the last slice of
+            # its DSO, and only if it is close enough to the previous row
+            prev_ends = np.empty_like(ends)
+            prev_ends[1:] = ends[:-1]
+            prev_ends[0] = slices[-1].end_address if slices else 0
+            breaks = starts - prev_ends > MAX_RANGE_GAP
+            breaks[0] |= not slices
+            firsts = np.flatnonzero(breaks).tolist()
+            stops = firsts[1:] + [len(rows)]
+            if not breaks[0]:
+                slices[-1].end_address = int(ends[firsts[0] - 1] if firsts
+                                             else ends[-1])
+            for first, stop in zip(firsts, stops):
+                slice_name = "%s_%d" % (dso_name, len(slices)) if slices \
+                             else dso_name
+                slices.append(MemoryRange(int(starts[first]),
+                                          int(ends[stop - 1]), slice_name))
+
+    def finish(self):
+        """ Returns the ranges sorted by start address (equivalent to sorting
+            by the aligned one)
+        """
+        ranges = sorted([ar for slices in self.dso_slices.values()
+                            for ar in slices],
+                        key=lambda x: x.start_address)
+        self.range_index = dict((ar.dso_name, idx)
+                                for idx, ar in enumerate(ranges))
+        self.slice_bounds = {}
+        for dso_name, slices in self.dso_slices.items():
+            self.slice_bounds[dso_name] = (
+                np.array([ar.start_address for ar in slices], dtype=np.int64),
+                np.array([ar.end_address for ar in slices], dtype=np.int64),
+                np.array([self.range_index[ar.dso_name] for ar in slices],
+                         dtype=np.int64))
+        return ranges
+
+    def assign(self, columns):
+        range_ids = np.full(len(columns), -1, dtype=np.int64)
+        for dso_name, rows in self._dso_groups(columns):
+            if dso_name not in self.slice_bounds:
+                continue
+            slice_starts, slice_ends, slice_ids = self.slice_bounds[dso_name]
+            starts = columns.ips[rows]
+            ends = starts + columns.lengths[rows] - 1
+            if len(slice_ids) == 1:
+                found = np.zeros(len(rows), dtype=np.int64)
+            else:
+                # The only slice that can hold a row is the last one starting
+                # at or before it
+                found = np.searchsorted(slice_starts, starts,
+                                        side='right') - 1
+            inside = found >= 0
+            found[~inside] = 0
+            inside &= ends <= slice_ends[found]
+            range_ids[rows] = np.where(inside, slice_ids[found], -1)
+            dropped = len(rows) - int(inside.sum())
+            if dropped:
+                print ("Dropping %d from %s" % (dropped, dso_name))
+        return range_ids
+
+
+def split_ranges(columns):
+    """ Returns the list of ranges of in-memory rows and, for every row, the
+        index of the range it belongs to (-1 if the row is dropped).
+    """
+    splitter = RangeSplitter()
+    splitter.add(columns)
+    ranges = splitter.finish()
+    return ranges, splitter.assign(columns)
+
+
+def bin_ranges(ranges, range_ids, columns, bytes_per_sample):
+    """ Accumulates exec counts of all rows into the pixels of their ranges.
+        All ranges share one flat pixel array; an instruction covering pixels
+        [first, last] adds its count at 'first' and removes it after 'last' in
+        a difference array, which a single cumsum turns into pixel totals.
+        Returns the flat raw array and the offset of each range inside it.
+    """
+    for ar in ranges:
+        ar.update_range_info(bytes_per_sample)
+
+    offsets = np.zeros(len(ranges) + 1, dtype=np.int64)
+    np.cumsum([ar.sample_count for ar in ranges], out=offsets[1:])
+    total_samples = int(offsets[-1])
+    starts_aligned = np.array([ar.start_address_aligned for ar in ranges],
+                              dtype=np.int64)
+
+    valid = range_ids >= 0
+    rids = range_ids[valid]
+    ips = columns.ips[valid]
+    lengths = columns.lengths[valid]
+    counts = columns.counts[valid].astype(np.float64)
+
+    rel_start = ips - starts_aligned[rids]
+    first = rel_start // bytes_per_sample + offsets[rids]
+    last = (rel_start + lengths - 1) // bytes_per_sample + offsets[rids]
+
+    diff = np.bincount(first, weights=counts, minlength=total_samples + 1)
+    diff -= np.bincount(last + 1, weights=counts,
+                        minlength=total_samples + 1)
+    raw = np.rint(np.cumsum(diff[:total_samples])).astype(np.int64)
+
+    wss = np.bincount(rids, weights=lengths, minlength=len(ranges))
+    for idx, ar in enumerate(ranges):
+        ar.data_raw = raw[offsets[idx]:offsets[idx + 1]]
+        ar.wss = int(wss[idx])
+    return raw, offsets
+
+
+def scale_values(raw, log_scale=True):
+    """ Returns the raw counts as floats, log2 scaled if log_scale """
+    values = np.zeros(len(raw), dtype=np.float64)
+    hit = raw > 0
+    if log_scale:
+        values[hit] = np.log(raw[hit]) / LOG2
+    else:
+        values[hit] = raw[hit]
+    return values
+
+
+def normalize_values(values, maxes, scale_max=NORMALIZED_MAX):
+    """ Maps scaled values to integers in [0, scale_max] """
+    normalized = np.zeros(len(values), dtype=np.int64)
+    scaled = values > 0
+    maxes = maxes[scaled] if isinstance(maxes, np.ndarray) else maxes
+    normalized[scaled] = np.floor(scale_max * values[scaled] / maxes)
+    return normalized
+
+
+def normalize_ranges(ranges, raw, offsets, log_scale=True,
+                     use_global_max_for_norm=True, scale_max=NORMALIZED_MAX):
+    """ Scales raw counts (log2 if log_scale) to [0, scale_max] using either
+        the global maximum or the maximum of each range.
+    """
+    if len(ranges) == 0:
+        return
+    values = scale_values(raw, log_scale)
+    if use_global_max_for_norm:
+        maxes = values.max()
+    else:
+        maxes = np.repeat(np.maximum.reduceat(values, offsets[:-1]),
+                          np.diff(offsets))
+
+    normalized = normalize_values(values, maxes, scale_max)
+    for idx, ar in enumerate(ranges):
+        ar.data_normalized = normalized[offsets[idx]:offsets[idx + 1]]
+
+
+def heatmap_result(bytes_per_sample, ranges, sparse=None):
+    return {
+        "bytesPerSample": bytes_per_sample,
+        "wss": sum([ar.wss for ar in ranges]),
+        "ranges": [ar.to_dict(idx, None if sparse is None else sparse[idx])
+                   for idx, ar in enumerate(ranges)]
+        }
+
+
+#
+# Binary wire format, all integers little-endian:
+#
+#   'PTHM'                     magic
+#   uint32                     length of the JSON header
+#   JSON header                same as the JSON response, except that each
+#                              range has a 'count' of non-empty pixels instead
+#                              of 'data'; space padded to a multiple of 4 bytes
+#   for each range, in header order:
+#       uint32[count]          pixel indexes
+#       uint32[count]          raw counts, saturated at 2^32 - 1
+#       uint16[count]          normalized values, zero padded to 4 bytes
+#
+# Every array starts 4-byte aligned so the client can map it directly as a
+# Uint32Array/Uint16Array.
+#
+BINARY_MAGIC = b'PTHM'
+WIRE_PIXEL_DTYPE = np.dtype('<u4')
+WIRE_RAW_DTYPE = np.dtype('<u4')
+WIRE_NORMALIZED_DTYPE = np.dtype('<u2')
+WIRE_RAW_MAX = np.iinfo(WIRE_RAW_DTYPE).max
+
+
+def _pad4(data, fill=b'\0'):
+    return data + fill * (-len(data) % 4)
+
+
+def binary_result(bytes_per_sample, ranges, sparse=None):
+    header = {
+        "bytesPerSample": bytes_per_sample,
+        "wss": sum([ar.wss for ar in ranges]),
+        "ranges": []
+        }
+    blocks = []
+    for idx, ar in enumerate(ranges):
+        pixels, normalized, raw = \
+            ar.sparse_data() if sparse is None else sparse[idx]
+        info = ar.info(idx)
+        info["count"] = len(pixels)
+        header["ranges"].append(info)
+        blocks.append(pixels.astype(WIRE_PIXEL_DTYPE).tobytes())
+        blocks.append(np.minimum(raw, WIRE_RAW_MAX).astype(
+                                            WIRE_RAW_DTYPE).tobytes())
+        blocks.append(_pad4(normalized.astype(
+                                            WIRE_NORMALIZED_DTYPE).tobytes()))
+    header = _pad4(json.dumps(header).encode('ascii'), b' ')
+    return b''.join([BINARY_MAGIC, struct.pack('<I', len(header)), header] +
+                    blocks)
+
+
+def build_heatmap(columns, bytes_per_sample, log_scale=True,
+                  use_global_max_for_norm=True, encoder=heatmap_result):
+    """ Builds the full heatmap response for ip-sorted instruction columns,
+        encoded by 'encoder' (heatmap_result or binary_result)
+    """
+    ranges, range_ids = split_ranges(columns)
+    raw, offsets = bin_ranges(ranges, range_ids, columns, bytes_per_sample)
+    normalize_ranges(ranges, raw, offsets, log_scale, use_global_max_for_norm)
+    return encoder(bytes_per_sample, ranges)
+
+
+#
+# Heatmap pyramid: every level of PYRAMID_LEVELS binned once at import time
+# and stored as one row per range, holding only the non-empty pixels.
+#
+def create_pyramid_table(cur, schema):
+    table = schema + "." + PYRAMID_TABLE
+    cur.execute("DROP TABLE IF EXISTS " + table)
+    cur.execute("CREATE TABLE " + table + " ("
+                "bytes_per_sample  integer  NOT NULL,"
+                "range_index       integer  NOT NULL,"
+                "dso_name          varchar(256),"
+                "start_address     bigint,"
+                "end_address       bigint,"
+                "wss               bigint,"
+                "pixels            bytea,"
+                "normalized        bytea,"
+                "raw               bytea,"
+                "PRIMARY KEY (bytes_per_sample, range_index))")
+
+
+def store_pyramid(cur, schema, columns, levels=PYRAMID_LEVELS):
+    """ Bins ip-sorted instruction columns at every level and writes them to
+        the pyramid table. Range slicing does not depend on the level, so it
+        is only done once.
+    """
+    create_pyramid_table(cur, schema)
+    ranges, range_ids = split_ranges(columns)
+    for bytes_per_sample in levels:
+        raw, offsets = bin_ranges(ranges, range_ids, columns,
+                                  bytes_per_sample)
+        normalize_ranges(ranges, raw, offsets)
+        for idx, ar in enumerate(ranges):
+            pixels, normalized, raw_values = ar.sparse_data()
+            cur.execute("INSERT INTO " + schema + "." + PYRAMID_TABLE +
+                        " VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)",
+                        (bytes_per_sample, idx, ar.dso_name,
+                         ar.start_address, ar.end_address, ar.wss,
+                         psycopg2.Binary(
+                            pixels.astype(PIXEL_DTYPE).tobytes()),
+                         psycopg2.Binary(
+                            normalized.astype(NORMALIZED_DTYPE).tobytes()),
+                         psycopg2.Binary(
+                            raw_values.astype(RAW_DTYPE).tobytes())))
+
+
+def load_pyramid_level(cur, schema, bytes_per_sample, encoder=heatmap_result):
+    """ Returns the heatmap response for a precomputed level, or None if the
+        level is not part of the trace's pyramid.
+    """
+    cur.execute("select dso_name, start_address, end_address, wss, pixels, "
+                "normalized, raw from " + schema + "." + PYRAMID_TABLE +
+                " where bytes_per_sample = %s order by range_index",
+                (bytes_per_sample, ))
+    rows = cur.fetchall()
+    if not rows:
+        return None
+    ranges = []
+    sparse = []
+    for dso_name, start_address, end_address, wss, pixels, normalized, \
+            raw in rows:
+        ar = MemoryRange(start_address, end_address, dso_name)
+        ar.update_range_info(bytes_per_sample)
+        ar.wss = wss
+        ranges.append(ar)
+        sparse.append((np.frombuffer(pixels, dtype=PIXEL_DTYPE),
+                       np.frombuffer(normalized, dtype=NORMALIZED_DTYPE),
+                       np.frombuffer(raw, dtype=RAW_DTYPE)))
+    return encoder(bytes_per_sample, ranges, sparse)
+
+
+def pyramid_level_info(cur, schema, bytes_per_sample):
+    """ Returns (range count, total wss) of a precomputed level """
+    cur.execute("select count(*), coalesce(sum(wss), 0) from " + schema +
+                "." + PYRAMID_TABLE + " where bytes_per_sample = %s",
+                (bytes_per_sample, ))
+    return cur.fetchone()
+
+
+#
+# Streaming: the response is produced one range at a time, in one pass over
+# the rows. The generators below first yield a header dict (bytesPerSample),
+# then one dict per range as soon as it is complete, in the same layout as
+# the 'ranges' items of build_heatmap, and last a trailer dict (wss,
+# rangeCount). Ranges come in the order they are completed, their 'index'
+# being their position in the build_heatmap response.
+#
+# When normalized with the global maximum, which is only known once every
+# range is binned, the normalized values of the ranges are null and the
+# trailer has the 'normalizationMax' to compute them from the raw counts:
+# floor(NORMALIZED_MAX * scale_values(raw) / normalizationMax).
+#
+def stream_pyramid_level(conn, schema, bytes_per_sample):
+    yield {"bytesPerSample": bytes_per_sample}
+
+    total_wss = 0
+    range_count = 0
+    with server_cursor(conn) as cur:
+        cur.execute("select range_index, dso_name, start_address, "
+                    "end_address, wss, pixels, normalized, raw from " +
+                    schema + "." + PYRAMID_TABLE +
+                    " where bytes_per_sample = %s order by range_index",
+                    (bytes_per_sample, ))
+        for idx, dso_name, start_address, end_address, wss, pixels, \
+                normalized, raw in cur:
+            ar = MemoryRange(start_address, end_address, dso_name)
+            ar.update_range_info(bytes_per_sample)
+            ar.wss = wss
+            yield ar.to_dict(idx, (
+                        np.frombuffer(pixels, dtype=PIXEL_DTYPE),
+                        np.frombuffer(normalized, dtype=NORMALIZED_DTYPE),
+                        np.frombuffer(raw, dtype=RAW_DTYPE)))
+            total_wss += int(wss)
+            range_count += 1
+    yield {"wss": total_wss, "rangeCount": range_count}
+
+
+class StreamingRanges(RangeSplitter):
+    """ Splits ip-sorted row chunks into the ranges of split_ranges and bins
+        them, in one pass. A range stays open while rows can still extend
+        it, that is until they are more than MAX_RANGE_GAP past its end, and
+        only the pixels of the open ranges are kept in memory.
+        feed() and finish() return the ranges they closed as (index, range)
+        pairs, the index being the position of the range in start address
+        order. Rows running past the end of their range are dropped, as by
+        RangeSplitter.assign.
+    """
+    def __init__(self, bytes_per_sample):
+        RangeSplitter.__init__(self)
+        self.bytes_per_sample = bytes_per_sample
+        # DSO name -> its last slice, if still open
+        self.open_slices = {}
+        self.slice_counts = {}
+        self.range_count = 0
+
+    def _open(self, dso_name, start_address):
+        count = self.slice_counts.get(dso_name, 0)
+        self.slice_counts[dso_name] = count + 1
+        ar = MemoryRange(start_address, start_address,
+                         "%s_%d" % (dso_name, count) if count else dso_name)
+        ar.update_range_info(self.bytes_per_sample)
+        ar.data_raw = np.zeros(0, dtype=np.int64)
+        ar.pending = None
+        return ar
+
+    def _add(self, ar, starts, lengths, counts):
+        ar.end_address = int(starts[-1] + lengths[-1] - 1)
+        if ar.pending is not None:
+            starts, lengths, counts = [np.concatenate(pair) for pair in
+                                       zip(ar.pending,
+                                           (starts, lengths, counts))]
+        # The range ends with its last row, which starts at the last ip or
+        # later: rows ending before it are in, the others are binned once
+        # the range is closed
+        settled = starts + lengths - 1 <= int(starts.max())
+        ar.pending = (starts[~settled], lengths[~settled], counts[~settled])
+        if settled.any():
+            self._bin(ar, starts[settled], lengths[settled], counts[settled])
+
+    def _bin(self, ar, starts, lengths, counts):
+        bps = self.bytes_per_sample
+        rel_start = starts - ar.start_address_aligned
+        first = rel_start // bps
+        last = (rel_start + lengths - 1) // bps
+        base = int(first.min())
+        span = int(last.max()) - base + 2
+        if base + span - 1 > len(ar.data_raw):
+            # Grown geometrically, as the end of the range is not known yet
+            grown = np.zeros(max(base + span - 1, 2 * len(ar.data_raw)),
+                             dtype=np.int64)
+            grown[:len(ar.data_raw)] = ar.data_raw
+            ar.data_raw = grown
+        diff = np.bincount(first - base, weights=counts, minlength=span)
+        diff -= np.bincount(last + 1 - base, weights=counts, minlength=span)
+        ar.data_raw[base:base + span - 1] += \
+            np.rint(np.cumsum(diff[:span - 1])).astype(np.int64)
+        ar.wss += int(lengths.sum())
+
+    def _close(self, ar):
+        starts, lengths, counts = ar.pending
+        ar.pending = None
+        inside = starts + lengths - 1 <= ar.end_address
+        if inside.any():
+            self._bin(ar, starts[inside], lengths[inside], counts[inside])
+        if not inside.all():
+            print ("Dropping %d from %s" % (len(inside) - int(inside.sum()),
+                                            ar.dso_name))
+        ar.update_range_info(self.bytes_per_sample)
+        pixels = np.zeros(ar.sample_count, dtype=np.int64)
+        kept = min(ar.sample_count, len(ar.data_raw))
+        pixels[:kept] = ar.data_raw[:kept]
+        ar.data_raw = pixels
+
+    def feed(self, columns):
+        if not len(columns):
+            return []
+        opened = []
+        closed = []
+        for dso_name, rows in self._dso_groups(columns):
+            starts = columns.ips[rows]
+            lengths = columns.lengths[rows]
+            counts = columns.counts[rows].astype(np.float64)
+            ends = starts + lengths - 1
+            ar = self.open_slices.get(dso_name)
+            # Same slices as RangeSplitter.add
+            prev_ends = np.empty_like(ends)
+            prev_ends[1:] = ends[:-1]
+            prev_ends[0] = ar.end_address if ar is not None else 0
+            breaks = starts - prev_ends > MAX_RANGE_GAP
+            breaks[0] |= ar is None
+            firsts = np.flatnonzero(breaks).tolist()
+            for first, stop in zip([0] + firsts, firsts + [len(rows)]):
+                if first == stop:
+                    continue
+                if breaks[first]:
+                    if ar is not None:
+                        closed.append(ar)
+                    ar = self._open(dso_name, int(starts[first]))
+                    opened.append(ar)
+                self._add(ar, starts[first:stop], lengths[first:stop],
+                          counts[first:stop])
+            self.open_slices[dso_name] = ar
+        # Later chunks only have higher addresses, so the ranges opened in
+        # this one come next in start address order
+        for ar in sorted(opened, key=lambda x: x.start_address):
+            ar.index = self.range_count
+            self.range_count += 1
+        last_ip = int(columns.ips[-1])
+        for dso_name, ar in self.open_slices.items():
+            if ar is not None and last_ip - ar.end_address > MAX_RANGE_GAP:
+                closed.append(ar)
+                self.open_slices[dso_name] = None
+        return self._closed_pairs(closed)
+
+    def finish(self):
+        closed = [ar for ar in self.open_slices.values() if ar is not None]
+        self.open_slices = {}
+        return self._closed_pairs(closed)
+
+    def _closed_pairs(self, closed):
+        closed.sort(key=lambda x: x.index)
+        for ar in closed:
+            self._close(ar)
+        return [(ar.index, ar) for ar in closed]
+
+
+def stream_heatmap(conn, query, bytes_per_sample, log_scale=True,
+                   use_global_max_for_norm=True):
+    """ Streams the heatmap of an ip-sorted instruction query, which runs
+        once on a server-side cursor
+    """
+    return stream_heatmap_chunks(iter_columns(conn, query), bytes_per_sample,
+                                 log_scale, use_global_max_for_norm)
+
+
+def stream_heatmap_chunks(chunks, bytes_per_sample, log_scale=True,
+                          use_global_max_for_norm=True):
+    """ Streams the heatmap of ip-sorted Columns chunks, each range being
+        sent once the chunks have moved past it
+    """
+    yield {"bytesPerSample": bytes_per_sample}
+
+    streaming = StreamingRanges(bytes_per_sample)
+
+    def closed_ranges():
+        for columns in chunks:
+            for item in streaming.feed(columns):
+                yield item
+        for item in streaming.finish():
+            yield item
+
+    total_wss = 0
+    global_max = 0.0
+    for idx, ar in closed_ranges():
+        values = scale_values(ar.data_raw, log_scale)
+        if use_global_max_for_norm:
+            global_max = max(global_max, values.max())
+            pixels = np.flatnonzero(ar.data_raw)
+            yield ar.to_dict(idx, (pixels,
+                                   np.full(len(pixels), None, dtype=object),
+                                   ar.data_raw[pixels]))
+        else:
+            ar.data_normalized = normalize_values(values, values.max())
+            yield ar.to_dict(idx)
+        total_wss += ar.wss
+        ar.data_raw = None
+        ar.data_normalized = None
+
+    trailer = {"wss": total_wss, "rangeCount": streaming.range_count}
+    if use_global_max_for_norm:
+        trailer["normalizationMax"] = float(global_max)
+    yield trailer
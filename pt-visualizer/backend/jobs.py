@@ -0,0 +1,277 @@
+'''
+// Copyright (c) 2015-2019 Intel Corporation
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//      http://www.apache.org/licenses/LICENSE-2.0
+//
+// Unless required by applicable law or agreed to in writing, software
+// distributed under the License is distributed on an "AS IS" BASIS,
+// WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+// See the License for the specific language governing permissions and
+// limitations under the License.
+'''
+# Heavy backend computations, and the RQ jobs that run them outside of the
+# web server:
+#
+#   $ rq worker --path pt-visualizer/backend
+#
+# (started by pt-vis.sh --serv). Job ids are made of the trace id and the
+# request parameters, so submitting the same request again finds the job
+# already queued, or its result already stored in Redis.
+
+import contextlib
+import psycopg2.extras
+
+import status as stat
+import heatmap
+import postprocess
+import disasm
+import search
+
+# Seconds a finished job, and its result, is kept in Redis
+RESULT_TTL = 24 * 60 * 60
+# Seconds a job may run before its worker gives up on it
+JOB_TIMEOUT = 60 * 60
+
+
+def job_id(traceId, kind, *params):
+    return ":".join(["pt" + str(traceId), kind] + [str(p) for p in params])
+
+
+def delete_trace_jobs(queue, traceId):
+    """ Drops the jobs, and cached results, of a deleted trace """
+    prefix = queue.job_class.redis_job_namespace_prefix
+    for key in queue.connection.scan_iter(prefix + job_id(traceId, "*")):
+        job = queue.fetch_job(key[len(prefix):])
+        if job is not None:
+            job.delete()
+
+
+def breakdown_query(cur, schema, breakdown, ids):
+    # Bound here so that the streaming paths can run it as is
+    return cur.mogrify(heatmap.breakdown_instructions_query(
+                            schema,
+                            postprocess.instructions_source(cur, schema),
+                            breakdown),
+                       {"ids": list(ids)})
+
+
+def full_heatmap(cur, schema, bytes_per_sample, encoder, query=None):
+    """ Heatmap of all the instructions of a trace, or of the rows selected
+        by 'query'. Power-of-two levels are precomputed at import time.
+    """
+    if query is None:
+        if postprocess.has_table(cur, schema, heatmap.PYRAMID_TABLE):
+            result = heatmap.load_pyramid_level(cur, schema,
+                                                bytes_per_sample, encoder)
+            if result is not None:
+                return result
+        query = heatmap.instructions_query(
+                        postprocess.instructions_source(cur, schema))
+    cur.execute(query)
+    columns = heatmap.load_columns(cur)
+    return heatmap.build_heatmap(columns, bytes_per_sample, encoder=encoder)
+
+
+def disassembly(cur, schema, start_addr, end_addr, disassembler):
+    """ Symbols and decoded instructions between two addresses """
+    source = postprocess.instructions_source(cur, schema)
+    # Use the text decoded at import time when the trace has it
+    if postprocess.has_table(cur, schema, disasm.DISASM_TABLE):
+        cur.execute("select symbol_name, iv.opcode, exec_count, ip, "
+                    "sym_offset, octet_length(iv.opcode), instr from " +
+                    source + " iv left join " + schema +
+                    "." + disasm.DISASM_TABLE + " d on d.opcode = iv.opcode "
+                    "where ip >= " + str(start_addr) +
+                    " and ip <= " + str(end_addr) +
+                    " order by symbol_name, ip;")
+    else:
+        cur.execute("select symbol_name, opcode, exec_count, ip, sym_offset, "
+                    "octet_length(opcode), NULL from " +
+                    source + " where ip >= " +
+                    str(start_addr) + " and ip <= " + str(end_addr) +
+                    " order by symbol_name, ip;")
+    rows = cur.fetchall()
+    # Decode whatever is left with a single xed run
+    decoded = [elem[6] for elem in rows]
+    missing = [idx for idx, text in enumerate(decoded) if text is None]
+    if missing:
+        for idx, text in zip(missing, disassembler.decode_many(
+                                        [rows[idx][1] for idx in missing])):
+            decoded[idx] = text
+    result_data = {}
+    total_exec_count = 0
+    for elem, decoded_instr in zip(rows, decoded):
+        if elem[0] not in result_data:
+            result_data[elem[0]] = {
+                "symbol": elem[0],
+                "instructions": []
+            }
+        result_data[elem[0]]["instructions"].append({
+                                                "instr": decoded_instr,
+                                                "count": elem[2],
+                                                "ip": elem[3],
+                                                "offset": elem[4],
+                                                "length": elem[5]})
+        total_exec_count += elem[2]
+    return {"totalHits": total_exec_count,
+            "symbols": result_data.values()}
+
+
+def dso_transitions(named_cur, schema, one, two):
+    """ Calls between the symbols of two DSOs, in both directions """
+    if postprocess.has_table(named_cur, schema, postprocess.CALL_TRANSITIONS):
+        named_cur.execute("select fs.name as from_symbol_name, from_dso, "
+                "ts.name as to_symbol_name, to_dso, count as calls "
+                "from " + schema + "." + postprocess.CALL_TRANSITIONS + " t "
+                "join " + schema + ".symbols fs on fs.id = from_symbol_id "
+                "join " + schema + ".symbols ts on ts.id = to_symbol_id "
+                "where (from_dso = %(one)s and to_dso = %(two)s) or "
+                "(from_dso = %(two)s and to_dso = %(one)s)",
+                {"one": one, "two": two})
+    else:
+        # Traces imported before call_transitions, one row per call
+        named_cur.execute("select * from ("
+                "select cpf.symbol_id as from_symbol_id, "
+                "(select name from " + schema +
+                ".symbols where id = cpf.symbol_id) as from_symbol_name, "
+                "(select dso_id from " + schema +
+                ".symbols where id = cpf.symbol_id) as from_dso, "
+                "cpt.symbol_id as to_symbol_id, "
+                "(select name from " + schema +
+                ".symbols where id = cpt.symbol_id) as to_symbol_name, "
+                "(select dso_id from " + schema +
+                ".symbols where id = cpt.symbol_id) as to_dso, "
+                "1 as calls from " + schema + ".calls cls "
+                "inner join " + schema + ".call_paths cpt on "
+                "cls.call_path_id = cpt.id " +
+                "inner join " + schema + ".call_paths cpf on "
+                "cls.parent_call_path_id = cpf.id "
+                ") as filterThis where (from_dso = " + str(one) +
+                " and to_dso = " + str(two) + ") or (from_dso = " + str(two) +
+                " and to_dso = " + str(one) + ")")
+
+    one_symbols = []
+    two_symbols = []
+    one_dict = {}
+    two_dict = {}
+    result_dict = {}
+    def get_idx(dct, lst, sym):
+        if sym not in dct:
+            idx = len(lst)
+            lst.append({ "name": sym,
+                         "in": 0,
+                         "out": 0,
+                         "idx": idx})
+            dct[sym] = idx
+            return idx
+        else:
+            return dct[sym]
+    for item in named_cur.fetchall():
+        reverse = one == item.to_dso
+        src = item.from_symbol_name if not reverse else  \
+              item.to_symbol_name
+        src_idx = get_idx(one_dict, one_symbols, src)
+        dest = item.to_symbol_name if not reverse else   \
+               item.from_symbol_name
+        dest_idx = get_idx(two_dict, two_symbols, dest)
+        count = item.calls
+        if (src_idx, dest_idx) not in result_dict:
+            result_dict[(src_idx, dest_idx)] = [count, 0] if not reverse \
+                                               else [0, count]
+        else:
+            dir_idx = 0 if not reverse else 1
+            result_dict[(src_idx, dest_idx)][dir_idx] += count
+        if reverse:
+            one_symbols[src_idx]["in"] += count
+            two_symbols[dest_idx]["out"] += count
+        else:
+            one_symbols[src_idx]["out"] += count
+            two_symbols[dest_idx]["in"] += count
+
+    return {"symbolsLeft": one_symbols,
+            "symbolsRight": two_symbols,
+            "edges" : [{"left": k[0],
+                        "right": k[1],
+                        "count": result_dict[k]}
+                        for k in result_dict]}
+
+
+def dso_matrix(cur, schema):
+    """ Number of calls between every pair of DSOs: the DSOs of the trace,
+        sparse [from_dso, to_dso, calls] triplets and what they count. Traces
+        exported without calls count the branch samples of
+        dso_transitions_view instead ('branches'), older ones have no
+        transitions (None). Returns None when there is no such trace.
+    """
+    if not postprocess.has_table(cur, schema, "dsos"):
+        return None
+    source = "calls"
+    if postprocess.has_table(cur, schema, postprocess.CALL_TRANSITIONS):
+        cur.execute("select from_dso, to_dso, sum(count)::bigint from " +
+                    schema + "." + postprocess.CALL_TRANSITIONS +
+                    " group by 1, 2")
+    elif postprocess.has_table(cur, schema, "calls"):
+        cur.execute("select fs.dso_id, ts.dso_id, count(*) from " +
+                    schema + ".calls c "
+                    "join " + schema + ".call_paths cpt "
+                        "on cpt.id = c.call_path_id "
+                    "join " + schema + ".call_paths cpf "
+                        "on cpf.id = c.parent_call_path_id "
+                    "join " + schema + ".symbols fs on fs.id = cpf.symbol_id "
+                    "join " + schema + ".symbols ts on ts.id = cpt.symbol_id "
+                    "group by 1, 2")
+    elif postprocess.has_table(cur, schema, "dso_transitions_view"):
+        source = "branches"
+        cur.execute("select from_dso_id, to_dso_id, count::bigint from " +
+                    schema + ".dso_transitions_view")
+    else:
+        source = None
+    transitions = [list(row) for row in cur.fetchall()] if source else []
+    cur.execute("select id, name from " + schema + ".dsos order by name")
+    return {"dsos": [{"id": row[0], "name": row[1]}
+                     for row in cur.fetchall()],
+            "transitions": transitions,
+            "source": source}
+
+
+#
+# RQ entry points, run in the worker processes
+#
+@contextlib.contextmanager
+def job_cursors():
+    conn = stat.getStatus().conn
+    try:
+        yield (conn.cursor(),
+               conn.cursor(cursor_factory=psycopg2.extras.NamedTupleCursor))
+    finally:
+        # Jobs only read, don't leave the next job in a failed transaction
+        conn.rollback()
+
+
+def heatmap_job(traceId, bytes_per_sample, binary, breakdown=None, ids=()):
+    encoder = heatmap.binary_result if binary else heatmap.heatmap_result
+    schema = "pt" + str(traceId)
+    with job_cursors() as (cur, named_cur):
+        query = None
+        if ids:
+            query = breakdown_query(cur, schema, breakdown, ids)
+        return full_heatmap(cur, schema, bytes_per_sample, encoder, query)
+
+
+def disassembly_job(traceId, start_addr, end_addr):
+    with job_cursors() as (cur, named_cur):
+        return disassembly(cur, "pt" + str(traceId), start_addr, end_addr,
+                           disasm.getDisassembler())
+
+
+def dso_transitions_job(traceId, one, two):
+    with job_cursors() as (cur, named_cur):
+        return dso_transitions(named_cur, "pt" + str(traceId), one, two)
+
+
+def search_index_job(traceId):
+    search.build_indexes(stat.getStatus().conn, "t" + str(traceId))
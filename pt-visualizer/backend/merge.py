@@ -0,0 +1,190 @@
+'''
+// Copyright (c) 2015-2019 Intel Corporation
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//      http://www.apache.org/licenses/LICENSE-2.0
+//
+// Unless required by applicable law or agreed to in writing, software
+// distributed under the License is distributed on an "AS IS" BASIS,
+// WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+// See the License for the specific language governing permissions and
+// limitations under the License.
+'''
+# Merged traces: several traces of the same program, e.g. many short
+# collections, folded into a new trace with the summed exec counts.
+#
+#   $ python merge.py <name> <traceId> <traceId> [...]
+#
+# Instructions are keyed on (dso name, symbol name, sym_offset), as their
+# addresses change from one run to the next with ASLR. The merged trace is
+# laid out at the addresses of the first trace: the symbols of the other
+# traces are moved by the most common distance between their symbols and the
+# same symbols of the first trace, per DSO. Symbols sharing a name in a DSO are
+# matched in address order. Instructions of no known symbol keep their
+# address.
+#
+# The merged trace has the dsos, symbols and instructions tables and the
+# instructions_view of an exported trace, and goes through the same
+# post-import stages, so the heatmap and working set size endpoints read it
+# like any other trace.
+
+import sys
+import datetime
+
+import status as stat
+import postprocess
+import tracediff
+
+
+def union_query(schemas, select):
+    """ UNION ALL of 'select' for every trace schema, 'select' being
+        formatted with the index of the trace ('source') and its schema
+    """
+    return " UNION ALL ".join([select.format(source=idx, schema=source)
+                               for idx, source in enumerate(schemas)])
+
+
+def build_merged_tables(cur, schema, sources):
+    # Every symbol of every trace with its merged ids, the unknown symbol
+    # and DSO keeping id 0 like in exported traces. Symbols with the same
+    # name in a DSO, e.g. static functions or names truncated by the
+    # exporter, are told apart by their order in the DSO.
+    cur.execute("CREATE TEMP TABLE merge_symbols ON COMMIT DROP AS "
+                "SELECT s.*, "
+                    "CASE WHEN symbol_id = " +
+                        str(tracediff.UNKNOWN_SYMBOL_ID) + " THEN 0 "
+                    "ELSE dense_rank() OVER "
+                        "(ORDER BY dso_name, symbol_name, ordinal) "
+                        "END AS merged_id, "
+                    "CASE WHEN dso_id = 0 THEN 0 "
+                    "ELSE dense_rank() OVER (ORDER BY dso_name) "
+                        "END AS merged_dso_id "
+                "FROM (SELECT s.*, row_number() OVER "
+                        "(PARTITION BY source, dso_name, symbol_name "
+                        "ORDER BY sym_start, symbol_id) AS ordinal "
+                    "FROM (" + union_query(sources,
+                    "SELECT {source} AS source, s.id AS symbol_id, "
+                    "s.dso_id, d.name AS dso_name, s.name AS symbol_name, "
+                    "s.sym_start, s.sym_end "
+                    "FROM {schema}.symbols s "
+                    "LEFT JOIN {schema}.dsos d ON d.id = s.dso_id") +
+                    ") s) s")
+
+    # Where each trace has its symbols, and where the merged trace has them
+    cur.execute("CREATE TEMP TABLE merge_starts ON COMMIT DROP AS "
+                "SELECT source, merged_id, merged_dso_id, start "
+                "FROM (" + union_query(sources,
+                    "SELECT {source} AS source, symbol_id, "
+                    "min(ip - sym_offset) AS start "
+                    "FROM {schema}.instructions "
+                    "WHERE symbol_id <> " +
+                        str(tracediff.UNKNOWN_SYMBOL_ID) + " "
+                    "GROUP BY 1, 2") + ") st "
+                "JOIN merge_symbols USING (source, symbol_id)")
+    cur.execute("CREATE TEMP TABLE merge_shifts ON COMMIT DROP AS "
+                "SELECT s.source, s.merged_dso_id, "
+                    "mode() WITHIN GROUP (ORDER BY r.start - s.start) "
+                    "AS shift "
+                "FROM merge_starts s JOIN merge_starts r "
+                    "ON r.source = 0 AND r.merged_id = s.merged_id "
+                "WHERE s.source > 0 GROUP BY 1, 2")
+    # Symbols are placed by the first trace that has instructions in them
+    cur.execute("CREATE TEMP TABLE merge_placement ON COMMIT DROP AS "
+                "SELECT DISTINCT ON (merged_id) merged_id, source, "
+                    "start + coalesce(shift, 0) AS start, "
+                    "coalesce(shift, 0) AS shift "
+                "FROM merge_starts "
+                "LEFT JOIN merge_shifts USING (source, merged_dso_id) "
+                "ORDER BY merged_id, source")
+
+    cur.execute("CREATE TABLE " + schema + ".dsos AS "
+                "SELECT DISTINCT merged_dso_id::smallint AS id, "
+                    "dso_name AS name "
+                "FROM merge_symbols")
+    # Moved along with their instructions
+    cur.execute("CREATE TABLE " + schema + ".symbols AS "
+                "SELECT DISTINCT ON (ms.merged_id) "
+                    "ms.merged_id::integer AS id, "
+                    "ms.merged_dso_id::smallint AS dso_id, "
+                    "ms.symbol_name AS name, "
+                    "ms.sym_start + coalesce(p.shift, 0) AS sym_start, "
+                    "ms.sym_end + coalesce(p.shift, 0) AS sym_end "
+                "FROM merge_symbols ms "
+                "LEFT JOIN merge_placement p "
+                    "ON p.merged_id = ms.merged_id AND p.source = ms.source "
+                "ORDER BY ms.merged_id, p.source IS NULL, ms.source")
+    cur.execute("CREATE TABLE " + schema + ".instructions AS "
+                "SELECT row_number() OVER (ORDER BY ip)::integer AS id, "
+                    "symbol_id, ip, exec_count, sym_offset, opcode "
+                "FROM (SELECT ms.merged_id::integer AS symbol_id, "
+                    "coalesce(p.start + i.sym_offset, i.ip) AS ip, "
+                    "sum(i.exec_count)::bigint AS exec_count, "
+                    "i.sym_offset, "
+                    "(array_agg(i.opcode ORDER BY i.source))[1] AS opcode "
+                "FROM (" + union_query(sources,
+                    "SELECT {source} AS source, symbol_id, ip, exec_count, "
+                    "sym_offset, opcode FROM {schema}.instructions") + ") i "
+                "LEFT JOIN merge_symbols ms "
+                    "ON ms.source = i.source AND ms.symbol_id = i.symbol_id "
+                "LEFT JOIN merge_placement p ON p.merged_id = ms.merged_id "
+                "GROUP BY 1, 2, 4) merged")
+
+    for table in ("dsos", "symbols", "instructions"):
+        cur.execute("ALTER TABLE " + schema + "." + table +
+                    " ADD PRIMARY KEY (id)")
+        cur.execute("ANALYZE " + schema + "." + table)
+    # Same view as export-to-postgresql.py
+    cur.execute("CREATE VIEW " + schema + ".instructions_view AS "
+                "SELECT "
+                    "instructions.id,"
+                    "(SELECT name FROM " + schema + ".symbols "
+                        "WHERE symbols.id = symbol_id) AS symbol_name,"
+                    "(SELECT name FROM " + schema + ".dsos WHERE dsos.id = "
+                    "(SELECT dso_id FROM " + schema + ".symbols "
+                        "WHERE symbols.id = symbol_id)) AS dso_name,"
+                    "instructions.ip,"
+                    "instructions.exec_count,"
+                    "instructions.sym_offset,"
+                    "instructions.opcode"
+                " FROM " + schema + ".instructions")
+
+
+def merge_traces(conn, name, trace_ids):
+    """ Creates a trace merging the given ones, returns its id """
+    cur = conn.cursor()
+    for traceId in trace_ids:
+        if not postprocess.has_table(cur, "pt" + str(traceId),
+                                     "instructions"):
+            raise ValueError("No trace " + str(traceId))
+    cur.execute("INSERT INTO public.traces (name, description, created) "
+                "VALUES (%s, %s, now()) RETURNING id",
+                (name, "Merge of traces " +
+                       ", ".join([str(traceId) for traceId in trace_ids])))
+    merged_id = cur.fetchone()[0]
+    schema = "pt" + str(merged_id)
+    try:
+        cur.execute("CREATE SCHEMA " + schema)
+        build_merged_tables(cur, schema,
+                            ["pt" + str(traceId) for traceId in trace_ids])
+        conn.commit()
+    except:
+        conn.rollback()
+        raise
+    postprocess.run(conn, schema)
+    return merged_id
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 4:
+        print >> sys.stderr, "Usage is: merge.py <name> <traceId> " \
+                             "<traceId> [...]"
+        sys.exit(1)
+    status = stat.getStatus()
+    print datetime.datetime.today(), "Merging traces " + \
+          ", ".join(sys.argv[2:])
+    merged_id = merge_traces(status.conn, sys.argv[1],
+                             [int(traceId) for traceId in sys.argv[2:]])
+    print datetime.datetime.today(), "Done, trace " + str(merged_id)
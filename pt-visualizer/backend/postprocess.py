@@ -0,0 +1,194 @@
+'''
+// Copyright (c) 2015-2019 Intel Corporation
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//      http://www.apache.org/licenses/LICENSE-2.0
+//
+// Unless required by applicable law or agreed to in writing, software
+// distributed under the License is distributed on an "AS IS" BASIS,
+// WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+// See the License for the specific language governing permissions and
+// limitations under the License.
+'''
+# Post-import stages: derived per-trace tables that are built once, after a
+# trace has been loaded, so that the API endpoints can read them directly.
+#
+# The exporter runs all stages at the end of trace_end. Traces imported
+# before a stage existed can be backfilled with:
+#
+#   $ python postprocess.py <traceId> [stage ...]
+
+import sys
+import datetime
+import subprocess
+
+import status as stat
+import heatmap
+import disasm
+
+# Denormalized copy of instructions_view (see build_instructions_flat)
+INSTRUCTIONS_FLAT = "instructions_flat"
+# Number of calls per (from_dso, to_dso, from_symbol_id, to_symbol_id)
+CALL_TRANSITIONS = "call_transitions"
+# Working set size, exec counts and instruction counts per symbol and per DSO
+WSS_SYMBOLS = "wss_symbols"
+WSS_DSOS = "wss_dsos"
+
+
+def has_table(cur, schema, table):
+    cur.execute("select 1 from information_schema.tables "
+                "where table_schema = %s and table_name = %s",
+                (schema, table))
+    return cur.fetchone() is not None
+
+
+def instructions_source(cur, schema):
+    """ Returns the relation to read instruction rows from: the flattened
+        table when the trace has one, instructions_view otherwise.
+    """
+    if has_table(cur, schema, INSTRUCTIONS_FLAT):
+        return schema + "." + INSTRUCTIONS_FLAT
+    return schema + ".instructions_view"
+
+
+def build_instructions_flat(cur, schema):
+    table = schema + "." + INSTRUCTIONS_FLAT
+    cur.execute("DROP TABLE IF EXISTS " + table)
+    cur.execute("CREATE TABLE " + table + " AS "
+                "SELECT "
+                    "i.id,"
+                    "s.name AS symbol_name,"
+                    "d.name AS dso_name,"
+                    "i.ip,"
+                    "i.exec_count,"
+                    "i.sym_offset,"
+                    "i.opcode,"
+                    "octet_length(i.opcode) AS length"
+                " FROM " + schema + ".instructions i"
+                " LEFT JOIN " + schema + ".symbols s ON s.id = i.symbol_id"
+                " LEFT JOIN " + schema + ".dsos d ON d.id = s.dso_id")
+    cur.execute("ALTER TABLE " + table + " ADD PRIMARY KEY (id)")
+    cur.execute("CREATE INDEX " + INSTRUCTIONS_FLAT + "_ip_idx ON " +
+                table + " (ip)")
+    cur.execute("CREATE INDEX " + INSTRUCTIONS_FLAT + "_dso_idx ON " +
+                table + " (dso_name)")
+    cur.execute("ANALYZE " + table)
+
+
+def build_heatmap_pyramid(cur, schema):
+    cur.execute(heatmap.instructions_query(instructions_source(cur, schema)))
+    columns = heatmap.load_columns(cur)
+    heatmap.store_pyramid(cur, schema, columns,
+                          stat.getStatus().heatmapconfig['pyramid_levels'])
+
+
+def build_disasm_table(cur, schema):
+    try:
+        disasm.store_disasm_table(cur, schema)
+    except (OSError, subprocess.CalledProcessError) as e:
+        # xed is optional here, symbolsataddrfull decodes at request time
+        print datetime.datetime.today(), "Warning: cannot run xed, " \
+              "skipping disassembly table ({0})".format(e)
+        cur.connection.rollback()
+
+
+def build_call_transitions(cur, schema):
+    """ Aggregates the calls between symbols, found by joining every call
+        with its own call path and its caller's, for the transition graph
+    """
+    if not has_table(cur, schema, "calls"):
+        return
+    table = schema + "." + CALL_TRANSITIONS
+    cur.execute("DROP TABLE IF EXISTS " + table)
+    cur.execute("CREATE TABLE " + table + " AS "
+                "SELECT "
+                    "fs.dso_id AS from_dso,"
+                    "ts.dso_id AS to_dso,"
+                    "fs.id AS from_symbol_id,"
+                    "ts.id AS to_symbol_id,"
+                    "count(*) AS count"
+                " FROM " + schema + ".calls c"
+                " JOIN " + schema + ".call_paths cpt ON cpt.id = c.call_path_id"
+                " JOIN " + schema + ".call_paths cpf"
+                    " ON cpf.id = c.parent_call_path_id"
+                " JOIN " + schema + ".symbols fs ON fs.id = cpf.symbol_id"
+                " JOIN " + schema + ".symbols ts ON ts.id = cpt.symbol_id"
+                " GROUP BY 1, 2, 3, 4")
+    cur.execute("CREATE INDEX " + CALL_TRANSITIONS + "_dsos_idx ON " +
+                table + " (from_dso, to_dso)")
+    cur.execute("ANALYZE " + table)
+
+
+def build_wss_tables(cur, schema):
+    """ Rolls the instructions up per (dso_name, symbol_name), then per
+        dso_name. Keyed by names, as the wss endpoints group them.
+    """
+    table = schema + "." + WSS_SYMBOLS
+    cur.execute("DROP TABLE IF EXISTS " + table)
+    cur.execute("CREATE TABLE " + table + " AS "
+                "SELECT "
+                    "d.name AS dso_name,"
+                    "s.name AS symbol_name,"
+                    "sum(octet_length(i.opcode))::bigint AS wss,"
+                    "sum(i.exec_count)::bigint AS hits,"
+                    "count(*) AS instructions"
+                " FROM " + schema + ".instructions i"
+                " LEFT JOIN " + schema + ".symbols s ON s.id = i.symbol_id"
+                " LEFT JOIN " + schema + ".dsos d ON d.id = s.dso_id"
+                " GROUP BY 1, 2")
+    cur.execute("CREATE INDEX " + WSS_SYMBOLS + "_dso_idx ON " +
+                table + " (dso_name)")
+    cur.execute("ANALYZE " + table)
+
+    dso_table = schema + "." + WSS_DSOS
+    cur.execute("DROP TABLE IF EXISTS " + dso_table)
+    cur.execute("CREATE TABLE " + dso_table + " AS "
+                "SELECT "
+                    "dso_name,"
+                    "sum(wss)::bigint AS wss,"
+                    "sum(hits)::bigint AS hits,"
+                    "sum(instructions)::bigint AS instructions"
+                " FROM " + table +
+                " GROUP BY 1")
+    cur.execute("ANALYZE " + dso_table)
+
+
+# Stages run in this order; later stages may read tables of earlier ones
+STAGES = [
+    ("instructions_flat", build_instructions_flat),
+    ("heatmap_pyramid", build_heatmap_pyramid),
+    ("disasm", build_disasm_table),
+    ("call_transitions", build_call_transitions),
+    ("wss", build_wss_tables),
+]
+# Stages that only run when explicitly requested
+OPTIONAL_STAGES = ["instructions_flat"]
+
+
+def run(conn, schema, stages=None, optional=()):
+    """ Runs the given stages, or all default stages plus the 'optional'
+        ones when no stage is named.
+    """
+    cur = conn.cursor()
+    for name, stage in STAGES:
+        if stages:
+            if name not in stages:
+                continue
+        elif name in OPTIONAL_STAGES and name not in optional:
+            continue
+        print datetime.datetime.today(), "Building " + name
+        stage(cur, schema)
+        conn.commit()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print >> sys.stderr, "Usage is: postprocess.py <traceId> " \
+                             "[" + "/".join([s[0] for s in STAGES]) + "]"
+        sys.exit(1)
+    status = stat.getStatus()
+    run(status.conn, "pt" + str(int(sys.argv[1])), sys.argv[2:])
+    print datetime.datetime.today(), "Done"
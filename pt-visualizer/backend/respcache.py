@@ -0,0 +1,182 @@
+'''
+// Copyright (c) 2015-2019 Intel Corporation
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//      http://www.apache.org/licenses/LICENSE-2.0
+//
+// Unless required by applicable law or agreed to in writing, software
+// distributed under the License is distributed on an "AS IS" BASIS,
+// WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+// See the License for the specific language governing permissions and
+// limitations under the License.
+'''
+# Cache of API responses. Traces do not change once they are imported, so
+# the response of a read-only endpoint only depends on the endpoint, the
+# trace and the request arguments.
+#
+# Responses are kept in an in-process LRU bounded by their total size and,
+# when a directory is configured, in files shared by all backend processes
+# that also outlive restarts. Entries are grouped per trace so that they
+# can all be dropped when the trace is deleted.
+
+import os
+import uuid
+import shutil
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+import psycopg2
+
+DEFAULT_SIZE = 64 * 1024 * 1024
+# Larger responses only go to the disk tier, so that a single one does not
+# flush the whole in-process cache
+MAX_ENTRY_FRACTION = 4
+
+# Random token of the database, stored in it the first time a backend needs
+# it. A re-created database gets a new one, although it numbers its traces
+# (and, in a new cluster, its oids) from the start again.
+TOKEN_TABLE = "public.cache_token"
+
+
+def database_token(conn):
+    """ Returns the token of the database, None if it cannot be read or
+        stored, e.g. without the privilege to create the table
+    """
+    cur = conn.cursor()
+    try:
+        cur.execute("CREATE TABLE IF NOT EXISTS " + TOKEN_TABLE + " ("
+                    "id smallint PRIMARY KEY CHECK (id = 0), "
+                    "token varchar(32) NOT NULL)")
+        cur.execute("INSERT INTO " + TOKEN_TABLE + " (id, token) "
+                    "SELECT 0, %s WHERE NOT EXISTS "
+                    "(SELECT 1 FROM " + TOKEN_TABLE + ")",
+                    (uuid.uuid4().hex, ))
+        conn.commit()
+    except psycopg2.Error as e:
+        # Also when another backend stored it at the same time
+        conn.rollback()
+        print "Cannot store the response cache token:", e
+    try:
+        cur.execute("SELECT token FROM " + TOKEN_TABLE)
+        row = cur.fetchone()
+    except psycopg2.Error as e:
+        conn.rollback()
+        print "Cannot read the response cache token:", e
+        return None
+    return row[0] if row is not None else None
+
+
+def response_key(token, endpoint, traceId, view_args, args, accept):
+    """ Cache key of a response: the database token, the endpoint name and
+        trace, the other URL arguments, the query string as (name, value)
+        pairs and the Accept header
+    """
+    return (token, endpoint, traceId, tuple(sorted(view_args.items())),
+            tuple(sorted(args)), accept)
+
+
+class ResponseCache(object):
+    def __init__(self, max_bytes=DEFAULT_SIZE, disk_dir=None):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.entries = OrderedDict()
+        self.traces = {}
+        self.size = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _trace_dir(self, traceId):
+        return os.path.join(self.disk_dir, "pt" + str(traceId))
+
+    def _disk_path(self, traceId, key):
+        return os.path.join(self._trace_dir(traceId),
+                            hashlib.sha1(repr(key)).hexdigest())
+
+    def _read_disk(self, traceId, key):
+        try:
+            with open(self._disk_path(traceId, key), 'rb') as entry:
+                mimetype = entry.readline().rstrip('\n')
+                return mimetype, entry.read()
+        except IOError:
+            return None
+
+    def _write_disk(self, traceId, key, value):
+        trace_dir = self._trace_dir(traceId)
+        try:
+            if not os.path.isdir(trace_dir):
+                os.makedirs(trace_dir)
+            # Written aside and renamed, other processes may be reading
+            fd, tmp_path = tempfile.mkstemp(dir=trace_dir, prefix='.')
+            with os.fdopen(fd, 'wb') as entry:
+                entry.write(value[0] + '\n')
+                entry.write(value[1])
+            os.rename(tmp_path, self._disk_path(traceId, key))
+        except (IOError, OSError) as e:
+            print "Response cache: cannot write to", trace_dir, e
+
+    def _store(self, traceId, key, value):
+        size = len(value[1])
+        if size * MAX_ENTRY_FRACTION > self.max_bytes:
+            return
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.size -= len(old[1][1])
+        self.entries[key] = (traceId, value)
+        self.traces.setdefault(traceId, set()).add(key)
+        self.size += size
+        while self.size > self.max_bytes:
+            old_key, (old_trace, old_value) = self.entries.popitem(last=False)
+            trace_keys = self.traces[old_trace]
+            trace_keys.discard(old_key)
+            if not trace_keys:
+                del self.traces[old_trace]
+            self.size -= len(old_value[1])
+            self.evictions += 1
+
+    def get(self, traceId, key):
+        """ Returns the cached (mimetype, body) for key, or None """
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                self.entries[key] = entry
+                self.hits += 1
+                return entry[1]
+        value = self._read_disk(traceId, key) if self.disk_dir else None
+        with self.lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.disk_hits += 1
+                self._store(traceId, key, value)
+        return value
+
+    def put(self, traceId, key, value):
+        with self.lock:
+            self._store(traceId, key, value)
+        if self.disk_dir:
+            self._write_disk(traceId, key, value)
+
+    def invalidate(self, traceId):
+        """ Drops every response of a trace """
+        with self.lock:
+            for key in self.traces.pop(traceId, ()):
+                self.size -= len(self.entries.pop(key)[1][1])
+        if self.disk_dir:
+            shutil.rmtree(self._trace_dir(traceId), ignore_errors=True)
+
+    def stats(self):
+        with self.lock:
+            return {"entries": len(self.entries),
+                    "bytes": self.size,
+                    "capacity": self.max_bytes,
+                    "hits": self.hits,
+                    "diskHits": self.disk_hits,
+                    "misses": self.misses,
+                    "evictions": self.evictions}
@@ -19,16 +19,17 @@ import psycopg2
 import psycopg2.extras
 import datetime
 import math
+import functools
 import simplejson as json
-import subprocess
-import re
 from operator import itemgetter
-from flask import Flask, request, jsonify, send_file, abort
+from flask import Flask, request, jsonify, send_file, abort, url_for
+from flask import Response, stream_with_context
 from werkzeug import secure_filename
 import glob
 from flask import g
 if not sys.platform.startswith('win'):
     from redis import Redis
+    from redis.exceptions import RedisError
     from rq import Queue
 
 SAT_HOME = os.environ.get('SAT_HOME')
@@ -40,24 +41,29 @@ if SAT_HOME is None:
     os.environ['SAT_HOME'] = SAT_HOME
 
 import status as stat
+import heatmap
+import postprocess
+import disasm
+import jobs
+import respcache
+import search
+import tracediff
 
 app = Flask(__name__, static_url_path='',
             static_folder=os.path.join(SAT_HOME, 'pt-visualizer', 'webui'))
 
 status = stat.getStatus()
+disassembler = disasm.getDisassembler()
+cache = respcache.ResponseCache(status.cacheconfig['size'],
+                                status.cacheconfig['dir'])
 
-app.debug = True
 DEBUG = False
 
 INS_MORE_LIMIT = 1000
 
 def get_db():
     if getattr(g, '_database', None) is None:
-        g._database = psycopg2.connect(
-            dbname=status.getDbConfig('dbname'),
-            user=status.getDbConfig('user'),
-            password=status.getDbConfig('password'),
-            host='localhost')
+        g._database = status.getPool().getconn()
         g._database.autocommit = True
     return g._database
 
@@ -66,7 +72,8 @@ def get_db():
 def teardown_db(exception):
     db = getattr(g, '_database', None)
     if db is not None:
-        db.close()
+        g._database = None
+        status.getPool().putconn(db)
 
 dthandler = lambda obj: (
     obj.isoformat()
@@ -76,6 +83,8 @@ dthandler = lambda obj: (
 # Work Queues
 if not sys.platform.startswith('win'):
     queue = Queue(connection=Redis())
+else:
+    queue = None
 
 
 def begin_db_request():
@@ -84,6 +93,46 @@ def begin_db_request():
             db.cursor(cursor_factory=psycopg2.extras.NamedTupleCursor))
 
 
+#
+# Responses of read-only endpoints are cached by (database, endpoint, trace,
+# request arguments), see respcache.py. Streamed responses are not cached,
+# nor any response when the database token cannot be had.
+#
+# Trace ids are never reused within a database, so a deleted trace's entries
+# left in other backend processes are just never asked for again. Databases
+# are told apart by the token respcache stores in them, as a re-created one
+# numbers its traces from 1 again while the disk tier still holds the old
+# responses.
+#
+db_token = None
+db_token_read = False
+
+def database_token():
+    global db_token, db_token_read
+    if not db_token_read:
+        db_token = respcache.database_token(get_db())
+        db_token_read = True
+    return db_token
+
+def cached(endpoint):
+    @functools.wraps(endpoint)
+    def wrapper(traceId, **kwargs):
+        token = database_token()
+        if token is None:
+            return endpoint(traceId, **kwargs)
+        key = respcache.response_key(token, endpoint.__name__, traceId,
+                                     kwargs, request.args.items(multi=True),
+                                     request.headers.get('Accept'))
+        hit = cache.get(traceId, key)
+        if hit is not None:
+            return Response(hit[1], mimetype=hit[0])
+        response = app.make_response(endpoint(traceId, **kwargs))
+        if response.status_code == 200 and not response.is_streamed:
+            cache.put(traceId, key, (response.mimetype, response.get_data()))
+        return response
+    return wrapper
+
+
 @app.route('/', methods=['GET', 'POST', 'PATCH', 'PUT', 'DELETE'])
 def main():
     return app.send_static_file('index.html')
@@ -136,10 +185,17 @@ def delete_trace(traceId):
         cur.execute("DROP SCHEMA IF EXISTS "+schema+" CASCADE;")
         cur.execute("DELETE FROM public.traces WHERE id = %s",(traceId,))
         db.commit()
-        return jsonify({"status":"ok"})
+        cache.invalidate(traceId)
     except Exception, e:
         print "error ".format(e)
         return jsonify({"status":"error"})
+    # The trace is gone, even when its jobs cannot be dropped
+    if queue is not None:
+        try:
+            jobs.delete_trace_jobs(queue, traceId)
+        except RedisError as e:
+            print "Cannot delete the jobs of the trace:", e
+    return jsonify({"status":"ok"})
 
 ################################################################
 #
@@ -183,25 +239,42 @@ def get_traces():
 
 
 #
-#  SEARCH
+#  SEARCH (legacy 't<id>' schemas, see search.py)
+#
+# Traces found to be indexed, the others get their index job submitted
+search_indexed = set()
+
+def search_schema(cur, traceId):
+    schema = "t" + str(traceId)
+    if traceId not in search_indexed:
+        if search.has_indexes(cur, schema):
+            search_indexed.add(traceId)
+        elif queue is not None:
+            # Searches still work unindexed when there is no Redis
+            try:
+                enqueue_job(jobs.job_id(traceId, "searchindex"),
+                            jobs.search_index_job, traceId)
+            except RedisError as e:
+                print "Cannot submit the search index job:", e
+    return schema
+
+def search_rows(named_cur):
+    return [dict((named_cur.description[i][0], value) \
+           for i, value in enumerate(row)) for row in named_cur.fetchall()]
+
 #
 #  Search matching symbol name - limiting to 100 results
 #
 @app.route('/api/1/search/<int:traceId>', methods=['GET', 'POST'])
-def search(traceId):
+def search_symbols(traceId):
     cur, named_cur = begin_db_request()
-    schema = "t" + str(traceId)
+    schema = search_schema(cur, traceId)
     if "search" in request.json and len(request.json['search']):
-        named_cur.execute("""SELECT symbol.id, symbol from """+schema+""".symbol
-                             WHERE symbol LIKE %s
-                             ORDER BY symbol
-                             LIMIT 100""",('%' + request.json['search'] + '%',))
-
-        r = [dict((named_cur.description[i][0], value) \
-               for i, value in enumerate(row)) for row in named_cur.fetchall()]
+        named_cur.execute(search.symbols_query(schema),
+                          ('%' + request.json['search'] + '%',))
         if DEBUG:
             print named_cur.query
-        return jsonify({"data":r})
+        return jsonify({"data":search_rows(named_cur)})
 
     return jsonify({"error":"error"})
 #
@@ -210,35 +283,23 @@ def search(traceId):
 @app.route('/api/1/search/hits/<int:traceId>', methods=['GET', 'POST'])
 def search_hits(traceId):
     cur, named_cur = begin_db_request()
-    schema = "t" + str(traceId)
+    schema = search_schema(cur, traceId)
     if "ids" in request.json and len(request.json['ids']):
-        ids = ""
-        comma = ""
-
-        for id in request.json['ids']:
-            ids = ids + comma + str(id)
-            comma = ", "
-        print ids
-        named_cur.execute("""SELECT symbol.id, count(*) as hits from """+schema+""".symbol
-                LEFT JOIN """+schema+""".ins on symbol.id = ins.symbol_id
-                WHERE symbol.id IN %s
-                AND call = 'c'
-                GROUP BY 1""",(tuple(request.json['ids']),))
+        named_cur.execute(search.hits_query(schema),
+                          (tuple(request.json['ids']),))
         if DEBUG:
             print named_cur.query
-        r = [dict((named_cur.description[i][0], value) \
-               for i, value in enumerate(row)) for row in named_cur.fetchall()]
-        return jsonify({"data":r})
+        return jsonify({"data":search_rows(named_cur)})
     return jsonify({"error":"error"})
 
 #
 #  3.rd phase Search places for search hits
 #
-@app.route('/api/1/search/<int:traceId>/<int:pixels>/<int:start_time>/<int:end_time>/<int:symbol_id>', methods=['GET', 'POST'])
-def search_full(traceId,pixels,start_time,end_time,symbol_id):
+def search_time_slices(traceId, pixels, start_time, end_time, symbol_name,
+                       symbol_id=None):
     cur, named_cur = begin_db_request()
-    schema = "t" + str(traceId)
-    time_slice = (end_time - start_time -1) / pixels
+    schema = search_schema(cur, traceId)
+    time_slice = max(1, (end_time - start_time -1) / pixels)
     if DEBUG:
         print "Search Full"
         print "Start=%d"%start_time
@@ -246,296 +307,202 @@ def search_full(traceId,pixels,start_time,end_time,symbol_id):
         print "timeslice=%d"%time_slice
         print "pixels Wanted=%d"%pixels
 
-    named_cur.execute("""SELECT (ts/%s)*%s as ts, count(*) as hits, cpu
-            from """+schema+""".ins
-            full join
-                (select ts from generate_series(%s,%s,%s) ts) s1
-                using (ts)
-            WHERE symbol_id = %s and ts > %s and ts < %s and call = 'c'
-            group by 1,3
-            order by ts""",(time_slice,time_slice,start_time,end_time,time_slice,symbol_id,start_time-1,end_time+1,))
-
+    # Overflows and lost samples are special symbols, counted with any call
+    if symbol_name is not None:
+        symbol_id = search.special_symbol_id(cur, schema, symbol_name)
+        if symbol_id is None:
+            return jsonify({"data":[]})
+    named_cur.execute(search.time_slices_query(schema, symbol_name is None),
+                      {"slice": time_slice, "symbol_id": symbol_id,
+                       "start_time": start_time, "end_time": end_time})
     if DEBUG:
         print named_cur.query
-    rows = named_cur.fetchall()
+    return jsonify({"data":search_rows(named_cur)})
 
-    r = [dict((named_cur.description[i][0], value) \
-           for i, value in enumerate(row)) for row in rows]
-    return jsonify({"data":r})
+@app.route('/api/1/search/<int:traceId>/<int:pixels>/<int:start_time>/<int:end_time>/<int:symbol_id>', methods=['GET', 'POST'])
+def search_full(traceId,pixels,start_time,end_time,symbol_id):
+    return search_time_slices(traceId, pixels, start_time, end_time, None,
+                              symbol_id)
 
 #
 #  Search overflows
 #
 @app.route('/api/1/search/overflow/<int:traceId>/<int:pixels>/<int:start_time>/<int:end_time>', methods=['GET', 'POST'])
 def search_full_overflow(traceId,pixels,start_time,end_time):
-    cur, named_cur = begin_db_request()
-    schema = "t" + str(traceId)
-    time_slice = (end_time - start_time -1) / pixels
-    if DEBUG:
-        print "Search Full"
-        print "Start=%d"%start_time
-        print "End=%d"%end_time
-        print "timeslice=%d"%time_slice
-        print "pixels Wanted=%d"%pixels
-
-    # TODO symbol like overflow is SLOW!!!!! Change look for ID so that it can be indexed
-    named_cur.execute("""SELECT id from """+schema+""".symbol where symbol LIKE 'overflow'""")
-    symbol_id = named_cur.fetchone()
-
-    # Same as below, but now with cpu info
-    named_cur.execute("""SELECT (ts/%s)*%s as ts, count(*) as hits, cpu
-            from """+schema+""".ins
-            full join
-                (select ts from generate_series(%s,%s,%s) ts) s1
-                using (ts)
-            WHERE symbol_id = %s and ts > %s and ts < %s
-            group by 1,3
-            order by ts""",(time_slice,time_slice,start_time,end_time,time_slice,symbol_id,start_time-1,end_time+1,))
-
-    if DEBUG:
-        print named_cur.query
-    rows = named_cur.fetchall()
-
-    r = [dict((named_cur.description[i][0], value) \
-           for i, value in enumerate(row)) for row in rows]
-    return jsonify({"data":r})
+    return search_time_slices(traceId, pixels, start_time, end_time,
+                              search.OVERFLOW_SYMBOL)
 
 #
-#  Search overflows
+#  Search lost samples
 #
 @app.route('/api/1/search/lost/<int:traceId>/<int:pixels>/<int:start_time>/<int:end_time>', methods=['GET', 'POST'])
 def search_full_lost(traceId,pixels,start_time,end_time):
-    cur, named_cur = begin_db_request()
-    schema = "t" + str(traceId)
-    time_slice = (end_time - start_time -1) / pixels
-    if DEBUG:
-        print "Search Full"
-        print "Start=%d"%start_time
-        print "End=%d"%end_time
-        print "timeslice=%d"%time_slice
-        print "pixels Wanted=%d"%pixels
-
-    named_cur.execute("""SELECT id from """+schema+""".symbol where symbol LIKE 'lost'""")
-    symbol_id = named_cur.fetchone()
+    return search_time_slices(traceId, pixels, start_time, end_time,
+                              search.LOST_SYMBOL)
 
-    # Same as below, but now with cpu info
-    named_cur.execute("""SELECT (ts/%s)*%s as ts, count(*) as hits, cpu
-            from """+schema+""".ins
-            full join
-                (select ts from generate_series(%s,%s,%s) ts) s1
-                using (ts)
-            WHERE symbol_id = %s and ts > %s and ts < %s
-            group by 1,3
-            order by ts""",(time_slice,time_slice,start_time,end_time,time_slice,symbol_id,start_time-1,end_time+1,))
 
-    if DEBUG:
-        print named_cur.query
-    rows = named_cur.fetchall()
+#
+# Memory Heatmap Full Dataset
+#
+@app.route('/api/1/heatmap/<int:traceId>/full/<int:bytes_per_sample>',
+           methods=['GET'])
+@cached
+def memheatmap_full(traceId, bytes_per_sample):
+    cur, named_cur = begin_db_request()
+    schema = "pt" + str(traceId)
+    binary = heatmap_wants_binary()
+    stream_format = None if binary else heatmap_stream_format()
+    breakdown = heatmap_breakdown(cur, schema)
+    query = jobs.breakdown_query(cur, schema, *breakdown) \
+            if breakdown is not None else None
+
+    if stream_format is not None:
+        # Pyramid levels only hold the unfiltered counts
+        if query is None and \
+           postprocess.has_table(cur, schema, heatmap.PYRAMID_TABLE) and \
+           heatmap.pyramid_level_info(cur, schema, bytes_per_sample)[0]:
+            items = heatmap.stream_pyramid_level(get_db(), schema,
+                                                 bytes_per_sample)
+        else:
+            if query is None:
+                query = heatmap.instructions_query(
+                                postprocess.instructions_source(cur, schema))
+            items = heatmap.stream_heatmap(get_db(), query, bytes_per_sample)
+        return stream_heatmap_response(items, stream_format)
 
-    r = [dict((named_cur.description[i][0], value) \
-           for i, value in enumerate(row)) for row in rows]
-    return jsonify({"data":r})
+    encoder = heatmap.binary_result if binary else heatmap.heatmap_result
+    return heatmap_response(jobs.full_heatmap(cur, schema, bytes_per_sample,
+                                              encoder, query),
+                            binary)
 
 
 #
-# Memory Heatmap Full Dataset
+# Per-thread / per-cpu heatmaps of traces exported with 'breakdown', selected
+# with ?tid=<tid>[&tid=...] or ?cpu=<cpu>[&cpu=...] (not both at once).
 #
+def heatmap_breakdown(cur, schema):
+    """ Returns the (breakdown, ids) selected by the request, or None """
+    tids = request.args.getlist('tid', type=int)
+    cpus = request.args.getlist('cpu', type=int)
+    if not tids and not cpus:
+        return None
+    if tids and cpus:
+        abort(400)
+    breakdown = heatmap.THREADS_BREAKDOWN if tids else heatmap.CPUS_BREAKDOWN
+    if not postprocess.has_table(cur, schema, breakdown[0]):
+        abort(404)
+    return breakdown, sorted(set(tids or cpus))
+
+@app.route('/api/1/heatmap/<int:traceId>/breakdown', methods=['GET'])
+def memheatmap_breakdown(traceId):
+    cur, named_cur = begin_db_request()
+    schema = "pt" + str(traceId)
+    if not postprocess.has_table(cur, schema,
+                                 heatmap.THREADS_BREAKDOWN[0]):
+        abort(404)
+    return jsonify({
+        "threads": heatmap.breakdown_totals(cur, schema,
+                                            heatmap.THREADS_BREAKDOWN),
+        "cpus": heatmap.breakdown_totals(cur, schema,
+                                         heatmap.CPUS_BREAKDOWN)
+    })
 
-# Gets the smallest value >= val which is a multiple of 'to'
-def alignValueTo(val, to):
-    if val == 0:
-        return to
-    md = val % to
-    return int(val if md == 0 else val + (to - md))
 
-# Gets the largest value <= val which is a multiple of 'to'
-def closestAlignedValueTo(val, to):
-    return val - (val % to)
+#
+# Memory Heatmap of a time range, from the per-window counts of traces
+# exported with 'windows=<n>'
+#
+@app.route('/api/1/heatmap/<int:traceId>/windows', methods=['GET'])
+def memheatmap_windows(traceId):
+    cur, named_cur = begin_db_request()
+    schema = "pt" + str(traceId)
+    if not postprocess.has_table(cur, schema, heatmap.TIME_WINDOWS_TABLE):
+        abort(404)
+    return jsonify({"windows": heatmap.time_windows(cur, schema)})
 
-@app.route('/api/1/heatmap/<int:traceId>/full/<int:bytes_per_sample>',
-           methods=['GET'])
-def memheatmap_full(traceId, bytes_per_sample):
-    class MemoryRange:
-        def __init__(self, start_address, end_address, dso_name):
-            self.start_address = start_address
-            self.end_address = end_address
-            self.dso_name = dso_name
-            self.data_raw = None
-            self.data_normalized = None
-            self.wss = 0
-
-        def update_range_info(self):
-            self.start_address_aligned = closestAlignedValueTo(
-                                                    self.start_address,
-                                                    bytes_per_sample)
-            self.end_address_aligned = alignValueTo(
-                                                    self.end_address,
-                                                    bytes_per_sample)
-            self.byte_size = self.end_address - self.start_address + 1
-            self.byte_size_aligned = self.end_address_aligned - \
-                                     self.start_address_aligned + \
-                                     bytes_per_sample
-            self.sample_count = self.byte_size_aligned // bytes_per_sample
-            self.data_raw = [0] * self.sample_count
-            self.data_normalized = [0] * self.sample_count
-
-        def add_sample(self, ip, length, count):
-            if ip < self.start_address or ip > self.end_address:
-                if DEBUG:
-                    print("Invalid sample skipped")
-                return
-            start_address = ip - self.start_address_aligned
-            end_address = (start_address + length) - 1
-            start_sample = start_address // bytes_per_sample
-            end_sample = end_address // bytes_per_sample
-            for pidx in range(start_sample, end_sample + 1):
-                self.data_raw[pidx] += count
-            self.wss += length
-
-        def process_data(self, log_scale=True):
-            self.max_raw = max(self.data_raw)
-            if log_scale:
-                for idx in range(len(self.data_raw)):
-                    if self.data_raw[idx] > 0:
-                        self.data_normalized[idx] = math.log(
-                                                        self.data_raw[idx], 2)
-                self.max_normalized = max(self.data_normalized)
-            else:
-                self.data_normalized = self.data_raw[:]
-                self.max_normalized = self.max_raw
-
-        def normalize_data(self, scale_max=2047.0, global_max=None):
-            m = self.max_scaled if global_max is None else global_max
-            for idx in range(0, len(self.data_normalized)):
-                if self.data_normalized[idx] > 0:
-                    self.data_normalized[idx] = int(
-                        math.floor(scale_max * self.data_normalized[idx] / m))
-
-        def to_dict(self, index):
-            data = {}
-            for idx in range(len(self.data_raw)):
-                if self.data_raw[idx] != 0:
-                    data[idx] = [self.data_normalized[idx],
-                                 self.data_raw[idx]]
-            return {
-                "index": index,
-                "startAddress": self.start_address,
-                "endAddress": self.end_address,
-                "totalSize": self.byte_size,
-                "startAddressAligned": self.start_address_aligned,
-                "endAddressAligned": self.end_address_aligned,
-                "dsoName": self.dso_name,
-                "wss": self.wss,
-                "data": data
-            }
-
-    log_scale = True
-    use_global_max_for_norm = True
+@app.route('/api/1/heatmap/<int:traceId>/window/<int:bytes_per_sample>/'
+           '<int:start_time>/<int:end_time>', methods=['GET'])
+def memheatmap_window(traceId, bytes_per_sample, start_time, end_time):
     cur, named_cur = begin_db_request()
     schema = "pt" + str(traceId)
-    t_instr = schema + ".instructions"
-    t_sym = schema + ".symbols"
-    t_dso = schema + ".dsos"
+    if not postprocess.has_table(cur, schema, heatmap.WINDOWS_TABLE):
+        abort(404)
+    binary = heatmap_wants_binary()
+    encoder = heatmap.binary_result if binary else heatmap.heatmap_result
 
-    named_cur.execute("select ip, octet_length(opcode) as length, exec_count, "
-                      "dso_name from " + schema +
-                      ".instructions_view order by ip")
+    cur.execute(heatmap.windowed_instructions_query(
+                        schema, postprocess.instructions_source(cur, schema)),
+                {"start_time": start_time, "end_time": end_time})
+    columns = heatmap.load_columns(cur)
 
-    rows = named_cur.fetchall()
-    rows.sort(key=itemgetter(0))
-    address_ranges = {}
-    range_slices = {}
-    MAX_RANGE_GAP = 128 * 1024 * 1024
+    return heatmap_response(heatmap.build_heatmap(columns, bytes_per_sample,
+                                                  encoder=encoder),
+                            binary)
 
-    for row in rows:
-        start_address = row.ip
-        current_dso = row.dso_name
-        if start_address == 0:
-            continue
-        end_address = start_address + row.length - 1
-        if current_dso not in address_ranges:
-            address_ranges[current_dso] = \
-                        MemoryRange(start_address, end_address, current_dso)
-        else:
-            if current_dso in range_slices:
-                found_slice = False
-                for name in range_slices[current_dso]:
-                    if start_address - \
-                       address_ranges[name].end_address <= MAX_RANGE_GAP:
-                        address_ranges[name].end_address = end_address
-                        found_slice = True
-                        break
-                if not found_slice:
-                    added_dso_name = "%s_%d" % (current_dso,
-                                                len(range_slices[current_dso]))
-                    range_slices[current_dso].append(added_dso_name)
-                    address_ranges[added_dso_name] = \
-                        MemoryRange(start_address, end_address, added_dso_name)
-            else:
-                if start_address - \
-                   address_ranges[current_dso].end_address > MAX_RANGE_GAP:
-                    added_dso_name = "%s_%d" % (current_dso, 1)
-                    range_slices[current_dso] = [current_dso, added_dso_name]
-                    address_ranges[added_dso_name] = \
-                        MemoryRange(start_address, end_address, added_dso_name)
-                else:
-                    address_ranges[current_dso].end_address = end_address
-
-    ranges_count = len(address_ranges)
-
-    # Update range internals (get aligned addresses, calculate height etc.)
-    for ar in address_ranges.values():
-        ar.update_range_info()
-
-    # Sort ranges by start_address_aligned
-    address_ranges_list = sorted(address_ranges.values(),
-                                 key=lambda x: x.start_address_aligned)
-
-    # Add samples to ranges
-    for row in rows:
-        if row.ip == 0:
-            continue
-        target_dso = None
-        start_address = row.ip
-        end_address = start_address + row.length - 1
-        if row.dso_name in range_slices:
-            for name in range_slices[row.dso_name]:
-                if address_ranges[name].start_address <= start_address and \
-                   address_ranges[name].end_address >= end_address:
-                    target_dso = name
-                    break
-        else:
-            target_dso = row.dso_name
-        if target_dso is None:
-            print ("Dropping from %s" % (row.dso_name))
-        else:
-            address_ranges[target_dso].add_sample(start_address, row.length,
-                                                  row.exec_count)
 
-    # Process data (create logarithmic scale, calculate max)
-    for ar in address_ranges_list:
-        ar.process_data(log_scale)
+#
+# Compact binary heatmap (see heatmap.binary_result for the layout), selected
+# with ?format=binary or an 'Accept: application/octet-stream' header.
+#
+HEATMAP_BINARY_TYPE = "application/octet-stream"
 
-    # If global max is required, calculate it as the max of all ranges' maxes
-    global_max = None
-    if use_global_max_for_norm:
-        global_max = max(
-                    [ar.max_normalized for ar in address_ranges_list])
+def heatmap_wants_binary():
+    return request.args.get('format') == "binary" or \
+           request.accept_mimetypes.best == HEATMAP_BINARY_TYPE
 
-    # Normalize data in ranges to [0, 2047] based on either local or global max
-    for ar in address_ranges_list:
-        ar.normalize_data(2047.0, global_max)
+def heatmap_response(result, binary):
+    if binary:
+        return Response(result, mimetype=HEATMAP_BINARY_TYPE)
+    return jsonify(result)
 
-    # Total WSS
-    total_wss = sum([ar.wss for ar in address_ranges_list])
 
-    # Create result data
-    return jsonify({
-        "bytesPerSample": bytes_per_sample,
-        "wss": total_wss,
-        "ranges":
-            [ar.to_dict(idx) for idx, ar in enumerate(address_ranges_list)]
-        })
+#
+# Streaming heatmap responses, selected with ?stream=json|ndjson or an
+# 'Accept: application/x-ndjson' header. Ranges are sent as soon as they are
+# complete, in no particular order, see heatmap.stream_heatmap_chunks.
+# 'ndjson' sends a header line (bytesPerSample), one line per range and a
+# trailer line (wss, rangeCount and, when the normalized values are left
+# null, normalizationMax). 'json' sends the layout of the non-streaming
+# endpoint with the trailer fields after the ranges.
+#
+HEATMAP_STREAM_TYPES = {
+    "json": "application/json",
+    "ndjson": "application/x-ndjson"
+}
+
+def heatmap_stream_format():
+    stream_format = request.args.get('stream')
+    if stream_format is None and \
+       HEATMAP_STREAM_TYPES["ndjson"] in request.headers.get('Accept', ''):
+        stream_format = "ndjson"
+    if stream_format is not None and \
+       stream_format not in HEATMAP_STREAM_TYPES:
+        abort(400)
+    return stream_format
+
+def stream_heatmap_response(items, stream_format):
+    def generate():
+        header = next(items)
+        if stream_format == "ndjson":
+            yield json.dumps(header) + "\n"
+            for item in items:
+                yield json.dumps(item) + "\n"
+        else:
+            yield '{"bytesPerSample": %d, "ranges": [' % \
+                  header["bytesPerSample"]
+            separator = ""
+            for item in items:
+                if "index" not in item:
+                    # The trailer
+                    yield "]" + "".join([", %s: %s" % (json.dumps(key),
+                                                        json.dumps(value))
+                                         for key, value in
+                                         sorted(item.items())]) + "}"
+                    break
+                yield separator + json.dumps(item)
+                separator = ", "
+    return Response(stream_with_context(generate()),
+                    mimetype=HEATMAP_STREAM_TYPES[stream_format])
 
 
 #
@@ -543,11 +510,17 @@ def memheatmap_full(traceId, bytes_per_sample):
 #
 @app.route('/api/1/wss/<int:traceId>/',
            methods=['GET'])
+@cached
 def wss_per_dso(traceId):
     cur, named_cur = begin_db_request()
     schema = "pt" + str(traceId)
-    cur.execute("select dso_name, sum(octet_length(opcode)) from " +
-                schema + ".instructions_view group by dso_name;")
+    if postprocess.has_table(cur, schema, postprocess.WSS_DSOS):
+        cur.execute("select dso_name, wss from " + schema + "." +
+                    postprocess.WSS_DSOS)
+    else:
+        source = postprocess.instructions_source(cur, schema)
+        cur.execute("select dso_name, sum(octet_length(opcode)) from " +
+                    source + " group by dso_name;")
     rows = cur.fetchall()
     rows.sort(key=itemgetter(1))
     total_wss = 0
@@ -564,12 +537,19 @@ def wss_per_dso(traceId):
 #
 @app.route('/api/1/dsosymwss/<int:traceId>/<dsoName>',
            methods=['GET'])
+@cached
 def wss_per_sym(traceId, dsoName):
     cur, named_cur = begin_db_request()
     schema = "pt" + str(traceId)
-    cur.execute("select symbol_name, sum(octet_length(opcode)) from " +
-                schema + ".instructions_view where dso_name = \'" +
-                dsoName + "\' group by symbol_name;")
+    if postprocess.has_table(cur, schema, postprocess.WSS_SYMBOLS):
+        cur.execute("select symbol_name, wss from " + schema + "." +
+                    postprocess.WSS_SYMBOLS + " where dso_name = %s",
+                    (dsoName, ))
+    else:
+        source = postprocess.instructions_source(cur, schema)
+        cur.execute("select symbol_name, sum(octet_length(opcode)) from " +
+                    source + " where dso_name = %s group by symbol_name;",
+                    (dsoName, ))
     rows = cur.fetchall()
     rows.sort(key=itemgetter(1))
     total_dso_wss = 0
@@ -586,59 +566,29 @@ def wss_per_sym(traceId, dsoName):
 #
 @app.route('/api/1/symbolsataddr/<int:traceId>/<int:start_addr>/<int:end_addr>',
            methods=['GET'])
+@cached
 def symbols_at_addr(traceId, start_addr, end_addr):
     cur, named_cur = begin_db_request()
     schema = "pt" + str(traceId)
-    cur.execute("select distinct symbol_name from " + schema +
-                ".instructions_view where ip >= " + str(start_addr) +
+    source = postprocess.instructions_source(cur, schema)
+    cur.execute("select distinct symbol_name from " + source +
+                " where ip >= " + str(start_addr) +
                 " and ip <= " + str(end_addr))
     return jsonify([elem[0] for elem in cur.fetchall()])
 
 #
 # Get symbols names + assembly found between two addresses
 #
-instr_extr = re.compile('SHORT: (.*)')
-
 @app.route('/api/1/symbolsataddrfull/<int:traceId>/<int:start_addr>/'
            '<int:end_addr>', methods=['GET'])
 def symbols_at_addr_full(traceId, start_addr, end_addr):
     cur, named_cur = begin_db_request()
-    schema = "pt" + str(traceId)
-    cur.execute("select symbol_name, opcode, exec_count, ip, sym_offset, "
-                "octet_length(opcode) from " +
-                schema + ".instructions_view where ip >= " + str(start_addr) +
-                " and ip <= " + str(end_addr) +
-                " order by symbol_name, ip;")
-    result_data = {}
-    total_exec_count = 0
-    for elem in cur.fetchall():
-        if elem[0] not in result_data:
-            result_data[elem[0]] = {
-                "symbol": elem[0],
-                "instructions": []
-            }
-        instr_string = ["%0.2X" % (ord(b)) for b in elem[1]]
-        result = subprocess.check_output(["xed", "-64", "-d"] + instr_string,
-                 stderr=subprocess.STDOUT)
-        decoded_instr = "unknown"
-        if result:
-            for line in result.splitlines():
-                res = instr_extr.match(line)
-                if res:
-                    decoded_instr = res.group(1)
-                    break
-        result_data[elem[0]]["instructions"].append({
-                                                "instr": decoded_instr,
-                                                "count": elem[2],
-                                                "ip": elem[3],
-                                                "offset": elem[4],
-                                                "length": elem[5]})
-        total_exec_count += elem[2]
-    return jsonify({"totalHits": total_exec_count,
-                    "symbols": result_data.values()})
+    return jsonify(jobs.disassembly(cur, "pt" + str(traceId), start_addr,
+                                    end_addr, disassembler))
 
 
 @app.route('/api/1/alldsos/<int:traceId>', methods=['GET'])
+@cached
 def get_all_dsos(traceId):
     cur, named_cur = begin_db_request()
     schema = "pt" + str(traceId)
@@ -647,74 +597,144 @@ def get_all_dsos(traceId):
                      "name": item[1]} for item in cur.fetchall()])
 
 
+#
+# Calls between every pair of DSOs of a trace, see jobs.dso_matrix
+#
+@app.route('/api/1/dsomatrix/<int:traceId>', methods=['GET'])
+@cached
+def get_dso_matrix(traceId):
+    cur, named_cur = begin_db_request()
+    result = jobs.dso_matrix(cur, "pt" + str(traceId))
+    if result is None:
+        abort(404)
+    return jsonify(result)
+
+
 @app.route('/api/1/dsotransitions/<int:traceId>/<int:one>/<int:two>',
            methods=['GET'])
 def get_dsos_jumps(traceId, one, two):
     cur, named_cur = begin_db_request()
-    schema = "pt" + str(traceId)
+    return jsonify(jobs.dso_transitions(named_cur, "pt" + str(traceId),
+                                        one, two))
 
-    named_cur.execute("select * from ("
-                "select cpf.symbol_id as from_symbol_id, "
-                "(select name from " + schema +
-                ".symbols where id = cpf.symbol_id) as from_symbol_name, "
-                "(select dso_id from " + schema +
-                ".symbols where id = cpf.symbol_id) as from_dso, "
-                "cpt.symbol_id as to_symbol_id, "
-                "(select name from " + schema +
-                ".symbols where id = cpt.symbol_id) as to_symbol_name, "
-                "(select dso_id from " + schema +
-                ".symbols where id = cpt.symbol_id) as to_dso, "
-                "flags from " + schema + ".calls cls "
-                "inner join " + schema + ".call_paths cpt on "
-                "cls.call_path_id = cpt.id " +
-                "inner join " + schema + ".call_paths cpf on "
-                "cls.parent_call_path_id = cpf.id "
-                ") as filterThis where (from_dso = " + str(one) +
-                " and to_dso = " + str(two) + ") or (from_dso = " + str(two) +
-                " and to_dso = " + str(one) + ")")
-
-    one_symbols = []
-    two_symbols = []
-    one_dict = {}
-    two_dict = {}
-    result_dict = {}
-    def get_idx(dct, lst, sym):
-        if sym not in dct:
-            idx = len(lst)
-            lst.append({ "name": sym,
-                         "in": 0,
-                         "out": 0,
-                         "idx": idx})
-            dct[sym] = idx
-            return idx
-        else:
-            return dct[sym]
-    for item in named_cur.fetchall():
-        reverse = one == item.to_dso
-        src = item.from_symbol_name if not reverse else  \
-              item.to_symbol_name
-        src_idx = get_idx(one_dict, one_symbols, src)
-        dest = item.to_symbol_name if not reverse else   \
-               item.from_symbol_name
-        dest_idx = get_idx(two_dict, two_symbols, dest)
-        if (src_idx, dest_idx) not in result_dict:
-            result_dict[(src_idx, dest_idx)] = [1, 0] if not reverse else [0, 1]
-        else:
-            dir_idx = 0 if not reverse else 1
-            result_dict[(src_idx, dest_idx)][dir_idx] += 1
-        if reverse:
-            one_symbols[src_idx]["in"] += 1
-            two_symbols[dest_idx]["out"] += 1
-        else:
-            one_symbols[src_idx]["out"] += 1
-            two_symbols[dest_idx]["in"] += 1
 
-    return jsonify({"symbolsLeft": one_symbols,
-                    "symbolsRight": two_symbols,
-                    "edges" : [{"left": k[0],
-                                "right": k[1],
-                                "count": result_dict[k]}
-                                for k in result_dict]})
+#
+# Differences between a base trace and another one, see tracediff.py. Not
+# cached, the response depends on two traces.
+#
+def diff_schemas(baseId, traceId):
+    cur, named_cur = begin_db_request()
+    schemas = ("pt" + str(baseId), "pt" + str(traceId))
+    for schema in schemas:
+        if not postprocess.has_table(cur, schema, "instructions"):
+            abort(404)
+    return cur, schemas
+
+@app.route('/api/1/diff/<int:baseId>/<int:traceId>/heatmap/'
+           '<int:bytes_per_sample>', methods=['GET'])
+def diff_heatmap(baseId, traceId, bytes_per_sample):
+    cur, schemas = diff_schemas(baseId, traceId)
+    return jsonify(tracediff.diff_heatmap(cur, schemas[0], schemas[1],
+                                          bytes_per_sample))
+
+@app.route('/api/1/diff/<int:baseId>/<int:traceId>/symbols', methods=['GET'])
+def diff_symbols(baseId, traceId):
+    cur, schemas = diff_schemas(baseId, traceId)
+    return jsonify(tracediff.symbol_deltas(cur, schemas[0], schemas[1]))
+
+
+#
+# Background jobs (see jobs.py). POST submits the computation of a heavy
+# result to the RQ workers, or finds the job already submitted with the same
+# parameters, GET /api/1/jobs/<id> polls it and GET /api/1/jobs/<id>/result
+# returns the result once the job is finished.
+#
+def job_status(job):
+    data = {"id": job.id,
+            "status": job.get_status(),
+            "poll": url_for('get_job', job_id=job.id),
+            "result": url_for('get_job_result', job_id=job.id)}
+    if job.is_failed and job.exc_info:
+        data["error"] = job.exc_info.strip().splitlines()[-1]
+    return data
+
+def job_response(job):
+    data = job_status(job)
+    if data["status"] == "finished":
+        return jsonify(data)
+    return jsonify(data), 500 if job.is_failed else 202
+
+def enqueue_job(job_id, func, *args):
+    job = queue.fetch_job(job_id)
+    # Failed jobs are retried, any other one is still valid
+    if job is None or job.is_failed:
+        job = queue.enqueue(func, args=args, job_id=job_id,
+                            result_ttl=jobs.RESULT_TTL,
+                            job_timeout=jobs.JOB_TIMEOUT)
+    return job
+
+def submit_job(job_id, func, *args):
+    if queue is None:
+        abort(501)
+    return job_response(enqueue_job(job_id, func, *args))
+
+def fetch_job(job_id):
+    job = queue.fetch_job(job_id) if queue is not None else None
+    if job is None:
+        abort(404)
+    return job
+
+@app.route('/api/1/jobs/heatmap/<int:traceId>/<int:bytes_per_sample>',
+           methods=['POST'])
+def submit_heatmap_job(traceId, bytes_per_sample):
+    cur, named_cur = begin_db_request()
+    binary = heatmap_wants_binary()
+    params = [bytes_per_sample, "binary" if binary else "json"]
+    breakdown, ids = heatmap_breakdown(cur, "pt" + str(traceId)) or \
+                     (None, ())
+    if ids:
+        params.append(breakdown[1] + "=" + ",".join(map(str, ids)))
+    return submit_job(jobs.job_id(traceId, "heatmap", *params),
+                      jobs.heatmap_job, traceId, bytes_per_sample, binary,
+                      breakdown, ids)
+
+@app.route('/api/1/jobs/disasm/<int:traceId>/<int:start_addr>/'
+           '<int:end_addr>', methods=['POST'])
+def submit_disassembly_job(traceId, start_addr, end_addr):
+    return submit_job(jobs.job_id(traceId, "disasm", start_addr, end_addr),
+                      jobs.disassembly_job, traceId, start_addr, end_addr)
+
+@app.route('/api/1/jobs/dsotransitions/<int:traceId>/<int:one>/<int:two>',
+           methods=['POST'])
+def submit_dso_transitions_job(traceId, one, two):
+    return submit_job(jobs.job_id(traceId, "dsotransitions", one, two),
+                      jobs.dso_transitions_job, traceId, one, two)
+
+@app.route('/api/1/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    return job_response(fetch_job(job_id))
+
+@app.route('/api/1/jobs/<job_id>/result', methods=['GET'])
+def get_job_result(job_id):
+    job = fetch_job(job_id)
+    if not job.is_finished:
+        return job_response(job)
+    # Binary heatmaps are stored encoded, everything else as JSON data
+    if isinstance(job.result, basestring):
+        return Response(job.result, mimetype=HEATMAP_BINARY_TYPE)
+    return jsonify(job.result)
+
+
+#
+# Backend runtime statistics
+#
+@app.route('/api/1/stats', methods=['GET'])
+def get_stats():
+    return jsonify({"dbPool": status.getPool().stats(),
+                    "disassembler": disassembler.stats(),
+                    "responseCache": cache.stats()})
 
+# Development server only, pt-vis.sh --serv runs the app under gunicorn
 if __name__ == '__main__':
+    app.debug = True
     app.run(host="127.0.0.1", port=5005)
@@ -0,0 +1,114 @@
+'''
+// Copyright (c) 2015-2019 Intel Corporation
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//      http://www.apache.org/licenses/LICENSE-2.0
+//
+// Unless required by applicable law or agreed to in writing, software
+// distributed under the License is distributed on an "AS IS" BASIS,
+// WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+// See the License for the specific language governing permissions and
+// limitations under the License.
+'''
+# Symbol search in the legacy 't<id>' trace schemas: symbol(id, symbol) and
+# ins(symbol_id, ts, cpu, call), one row per executed instruction.
+#
+# Symbol names are matched with LIKE '%term%', which a pg_trgm index answers
+# without reading the whole symbol table, and hits are counted per time
+# slice from a range scan of an ins(symbol_id, ts) index. The indexes are
+# built once per trace, by a job the backend submits on the first search,
+# or with:
+#
+#   $ python search.py <traceId>
+
+import sys
+import datetime
+import psycopg2
+
+import status as stat
+
+SYMBOL_TRGM_INDEX = "symbol_symbol_trgm_idx"
+INS_SYMBOL_TS_INDEX = "ins_symbol_id_ts_idx"
+
+# Symbols standing for trace overflows and lost samples
+OVERFLOW_SYMBOL = "overflow"
+LOST_SYMBOL = "lost"
+
+# (schema, name) -> id of a special symbol, None if the trace has none
+special_symbols = {}
+
+
+def has_index(cur, schema, index):
+    cur.execute("select 1 from pg_indexes "
+                "where schemaname = %s and indexname = %s", (schema, index))
+    return cur.fetchone() is not None
+
+
+def has_indexes(cur, schema):
+    # The trigram index is optional, pg_trgm may not be installed
+    return has_index(cur, schema, INS_SYMBOL_TS_INDEX)
+
+
+def build_indexes(conn, schema):
+    cur = conn.cursor()
+    if not has_index(cur, schema, SYMBOL_TRGM_INDEX):
+        try:
+            cur.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+            cur.execute("CREATE INDEX " + SYMBOL_TRGM_INDEX + " ON " +
+                        schema + ".symbol USING gin (symbol gin_trgm_ops)")
+            conn.commit()
+        except psycopg2.Error as e:
+            conn.rollback()
+            print "No pg_trgm, symbol names are searched unindexed:", e
+    if not has_index(cur, schema, INS_SYMBOL_TS_INDEX):
+        cur.execute("CREATE INDEX " + INS_SYMBOL_TS_INDEX + " ON " +
+                    schema + ".ins (symbol_id, ts)")
+        cur.execute("ANALYZE " + schema + ".ins")
+        conn.commit()
+
+
+def special_symbol_id(cur, schema, name):
+    key = (schema, name)
+    if key not in special_symbols:
+        cur.execute("select id from " + schema + ".symbol where symbol = %s",
+                    (name,))
+        row = cur.fetchone()
+        special_symbols[key] = row[0] if row is not None else None
+    return special_symbols[key]
+
+
+def symbols_query(schema):
+    """ Up to 100 symbols whose name is LIKE %s """
+    return ("select symbol.id, symbol from " + schema + ".symbol "
+            "where symbol like %s order by symbol limit 100")
+
+
+def hits_query(schema):
+    """ Number of calls of each symbol of the %s tuple of ids """
+    return ("select symbol_id as id, count(*) as hits from " + schema +
+            ".ins where symbol_id in %s and call = 'c' group by 1")
+
+
+def time_slices_query(schema, calls_only):
+    """ Hits of %(symbol_id)s per cpu and %(slice)s long time slice between
+        %(start_time)s and %(end_time)s, both included
+    """
+    return ("select (ts/%(slice)s)*%(slice)s as ts, count(*) as hits, cpu "
+            "from " + schema + ".ins "
+            "where symbol_id = %(symbol_id)s "
+            "and ts >= %(start_time)s and ts <= %(end_time)s" +
+            (" and call = 'c'" if calls_only else "") +
+            " group by 1, 3 order by 1")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        print >> sys.stderr, "Usage is: search.py <traceId>"
+        sys.exit(1)
+    status = stat.getStatus()
+    print datetime.datetime.today(), "Indexing t" + str(int(sys.argv[1]))
+    build_indexes(status.conn, "t" + str(int(sys.argv[1])))
+    print datetime.datetime.today(), "Done"
@@ -17,6 +17,10 @@ import os
 import psycopg2
 import psycopg2.extras
 import ConfigParser
+import threading
+import dbpool
+import respcache
+import heatmap
 
 SAT_HOME = os.environ.get('SAT_HOME')
 # Set SAT_HOME for rest of the backend
@@ -40,9 +44,38 @@ class Status(object):
     def __init__(self):
         self.dbconfig = {}
         self._initConfig()
-        self.conn = psycopg2.connect(dbname=self.dbconfig['dbname'],
-            user=self.dbconfig['user'], password=self.dbconfig['password'])
-        self.cursor = self.conn.cursor()
+        self._conn = None
+        self._cursor = None
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    # Opened on first use only, the web backend works on pooled connections
+    @property
+    def conn(self):
+        if self._conn is None:
+            self._conn = psycopg2.connect(dbname=self.dbconfig['dbname'],
+                user=self.dbconfig['user'], password=self.dbconfig['password'])
+        return self._conn
+
+    @property
+    def cursor(self):
+        if self._cursor is None:
+            self._cursor = self.conn.cursor()
+        return self._cursor
+
+    def getPool(self):
+        """ Connection pool shared by the threads of the web backend """
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = dbpool.ConnectionPool(
+                    minconn=self.dbconfig['pool_min'],
+                    maxconn=self.dbconfig['pool_max'],
+                    timeout=self.dbconfig['pool_timeout'],
+                    dbname=self.dbconfig['dbname'],
+                    user=self.dbconfig['user'],
+                    password=self.dbconfig['password'],
+                    host='localhost')
+            return self._pool
 
     def getDbConfig(self, key):
         if key not in self.dbconfig:
@@ -57,6 +90,28 @@ class Status(object):
         self.dbconfig['dbname'] = self.config.get('DB', 'dbname')
         self.dbconfig['user'] = self.config.get('DB', 'user')
         self.dbconfig['password'] = self.config.get('DB', 'password')
+        # Optional connection pool sizing
+        for key, default in (('pool_min', dbpool.DEFAULT_MIN),
+                             ('pool_max', dbpool.DEFAULT_MAX),
+                             ('pool_timeout', dbpool.DEFAULT_TIMEOUT)):
+            if self.config.has_option('DB', key):
+                self.dbconfig[key] = self.config.getint('DB', key)
+            else:
+                self.dbconfig[key] = default
+        # Optional API response cache, in MB and a shared directory
+        self.cacheconfig = {'size': respcache.DEFAULT_SIZE, 'dir': None}
+        if self.config.has_option('Cache', 'size'):
+            self.cacheconfig['size'] = \
+                    self.config.getint('Cache', 'size') * 1024 * 1024
+        if self.config.has_option('Cache', 'dir'):
+            self.cacheconfig['dir'] = os.path.join(
+                    SAT_HOME, self.config.get('Cache', 'dir'))
+        # Optional heatmap levels precomputed at import, in bytes per sample
+        self.heatmapconfig = {'pyramid_levels': heatmap.PYRAMID_LEVELS}
+        if self.config.has_option('Heatmap', 'pyramid_levels'):
+            self.heatmapconfig['pyramid_levels'] = [
+                    int(level) for level in
+                    self.config.get('Heatmap', 'pyramid_levels').split(',')]
 
     def createTracesTable(self):
         self.cursor.execute('CREATE TABLE IF NOT EXISTS public.traces (id serial, name varchar(256), description varchar(2048),' +
@@ -0,0 +1,90 @@
+'''
+// Copyright (c) 2015-2019 Intel Corporation
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//      http://www.apache.org/licenses/LICENSE-2.0
+//
+// Unless required by applicable law or agreed to in writing, software
+// distributed under the License is distributed on an "AS IS" BASIS,
+// WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+// See the License for the specific language governing permissions and
+// limitations under the License.
+'''
+# Base class of the tests that need the database of conf/db_config. Every
+# test gets its own connection and scratch schemas, laid out like exported
+# traces, which are dropped afterwards.
+
+import os
+import sys
+import unittest
+import psycopg2
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+
+import status as stat
+
+
+class DbTestCase(unittest.TestCase):
+    def setUp(self):
+        try:
+            self.conn = stat.getStatus().conn
+        except (IOError, psycopg2.Error) as e:
+            raise unittest.SkipTest("No database: " + str(e).strip())
+        self.conn.rollback()
+        self.cur = self.conn.cursor()
+        self.schemas = []
+
+    def tearDown(self):
+        self.conn.rollback()
+        for schema in self.schemas:
+            self.cur.execute("DROP SCHEMA IF EXISTS " + schema + " CASCADE")
+        self.conn.commit()
+
+    def create_schema(self, schema):
+        self.schemas.append(schema)
+        self.cur.execute("DROP SCHEMA IF EXISTS " + schema + " CASCADE")
+        self.cur.execute("CREATE SCHEMA " + schema)
+        return schema
+
+    def create_trace(self, schema, dsos, symbols, instructions):
+        """ Trace tables and instructions_view as written by
+            export-to-postgresql.py, from (id, name) dsos, (id, dso_id, name,
+            sym_start, sym_end) symbols and (symbol_id, ip, exec_count,
+            sym_offset, length) instructions, whose ids follow their order
+        """
+        self.create_schema(schema)
+        self.cur.execute("CREATE TABLE " + schema + ".dsos ("
+                         "id smallint NOT NULL, name varchar(256))")
+        self.cur.execute("CREATE TABLE " + schema + ".symbols ("
+                         "id integer NOT NULL, dso_id smallint, "
+                         "name varchar(256), sym_start bigint, "
+                         "sym_end bigint)")
+        self.cur.execute("CREATE TABLE " + schema + ".instructions ("
+                         "id integer NOT NULL, symbol_id integer, "
+                         "ip bigint, exec_count integer, "
+                         "sym_offset bigint, opcode bytea)")
+        for row in dsos:
+            self.cur.execute("INSERT INTO " + schema + ".dsos "
+                             "VALUES (%s, %s)", row)
+        for row in symbols:
+            self.cur.execute("INSERT INTO " + schema + ".symbols "
+                             "VALUES (%s, %s, %s, %s, %s)", row)
+        for idx, (symbol_id, ip, exec_count, sym_offset, length) in \
+                enumerate(instructions):
+            self.cur.execute("INSERT INTO " + schema + ".instructions "
+                             "VALUES (%s, %s, %s, %s, %s, %s)",
+                             (idx + 1, symbol_id, ip, exec_count, sym_offset,
+                              psycopg2.Binary(b'\x90' * length)))
+        self.cur.execute("CREATE VIEW " + schema + ".instructions_view AS "
+                         "SELECT i.id, s.name AS symbol_name, "
+                         "d.name AS dso_name, i.ip, i.exec_count, "
+                         "i.sym_offset, i.opcode "
+                         "FROM " + schema + ".instructions i "
+                         "LEFT JOIN " + schema + ".symbols s "
+                             "ON s.id = i.symbol_id "
+                         "LEFT JOIN " + schema + ".dsos d ON d.id = s.dso_id")
+        return schema
@@ -0,0 +1,215 @@
+'''
+// Copyright (c) 2015-2019 Intel Corporation
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//      http://www.apache.org/licenses/LICENSE-2.0
+//
+// Unless required by applicable law or agreed to in writing, software
+// distributed under the License is distributed on an "AS IS" BASIS,
+// WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+// See the License for the specific language governing permissions and
+// limitations under the License.
+'''
+# memheatmap_full as it was before the heatmap module, the reference the
+# array-backed engine is checked and benchmarked against. The body is copied
+# verbatim from sat-backend.py, except that the rows of instructions_view
+# are passed in and the result is returned instead of its JSON response.
+
+import math
+import collections
+from operator import itemgetter
+
+DEBUG = False
+
+Row = collections.namedtuple('Row', ['ip', 'length', 'exec_count',
+                                     'dso_name'])
+
+
+# Gets the smallest value >= val which is a multiple of 'to'
+def alignValueTo(val, to):
+    if val == 0:
+        return to
+    md = val % to
+    return int(val if md == 0 else val + (to - md))
+
+# Gets the largest value <= val which is a multiple of 'to'
+def closestAlignedValueTo(val, to):
+    return val - (val % to)
+
+def memheatmap_full(rows, bytes_per_sample):
+    """ 'rows' are (ip, length, exec_count, dso_name) tuples """
+    class MemoryRange:
+        def __init__(self, start_address, end_address, dso_name):
+            self.start_address = start_address
+            self.end_address = end_address
+            self.dso_name = dso_name
+            self.data_raw = None
+            self.data_normalized = None
+            self.wss = 0
+
+        def update_range_info(self):
+            self.start_address_aligned = closestAlignedValueTo(
+                                                    self.start_address,
+                                                    bytes_per_sample)
+            self.end_address_aligned = alignValueTo(
+                                                    self.end_address,
+                                                    bytes_per_sample)
+            self.byte_size = self.end_address - self.start_address + 1
+            self.byte_size_aligned = self.end_address_aligned - \
+                                     self.start_address_aligned + \
+                                     bytes_per_sample
+            self.sample_count = self.byte_size_aligned // bytes_per_sample
+            self.data_raw = [0] * self.sample_count
+            self.data_normalized = [0] * self.sample_count
+
+        def add_sample(self, ip, length, count):
+            if ip < self.start_address or ip > self.end_address:
+                if DEBUG:
+                    print("Invalid sample skipped")
+                return
+            start_address = ip - self.start_address_aligned
+            end_address = (start_address + length) - 1
+            start_sample = start_address // bytes_per_sample
+            end_sample = end_address // bytes_per_sample
+            for pidx in range(start_sample, end_sample + 1):
+                self.data_raw[pidx] += count
+            self.wss += length
+
+        def process_data(self, log_scale=True):
+            self.max_raw = max(self.data_raw)
+            if log_scale:
+                for idx in range(len(self.data_raw)):
+                    if self.data_raw[idx] > 0:
+                        self.data_normalized[idx] = math.log(
+                                                        self.data_raw[idx], 2)
+                self.max_normalized = max(self.data_normalized)
+            else:
+                self.data_normalized = self.data_raw[:]
+                self.max_normalized = self.max_raw
+
+        def normalize_data(self, scale_max=2047.0, global_max=None):
+            m = self.max_scaled if global_max is None else global_max
+            for idx in range(0, len(self.data_normalized)):
+                if self.data_normalized[idx] > 0:
+                    self.data_normalized[idx] = int(
+                        math.floor(scale_max * self.data_normalized[idx] / m))
+
+        def to_dict(self, index):
+            data = {}
+            for idx in range(len(self.data_raw)):
+                if self.data_raw[idx] != 0:
+                    data[idx] = [self.data_normalized[idx],
+                                 self.data_raw[idx]]
+            return {
+                "index": index,
+                "startAddress": self.start_address,
+                "endAddress": self.end_address,
+                "totalSize": self.byte_size,
+                "startAddressAligned": self.start_address_aligned,
+                "endAddressAligned": self.end_address_aligned,
+                "dsoName": self.dso_name,
+                "wss": self.wss,
+                "data": data
+            }
+
+    log_scale = True
+    use_global_max_for_norm = True
+
+    rows = [Row(*row) for row in rows]
+    rows.sort(key=itemgetter(0))
+    address_ranges = {}
+    range_slices = {}
+    MAX_RANGE_GAP = 128 * 1024 * 1024
+
+    for row in rows:
+        start_address = row.ip
+        current_dso = row.dso_name
+        if start_address == 0:
+            continue
+        end_address = start_address + row.length - 1
+        if current_dso not in address_ranges:
+            address_ranges[current_dso] = \
+                        MemoryRange(start_address, end_address, current_dso)
+        else:
+            if current_dso in range_slices:
+                found_slice = False
+                for name in range_slices[current_dso]:
+                    if start_address - \
+                       address_ranges[name].end_address <= MAX_RANGE_GAP:
+                        address_ranges[name].end_address = end_address
+                        found_slice = True
+                        break
+                if not found_slice:
+                    added_dso_name = "%s_%d" % (current_dso,
+                                                len(range_slices[current_dso]))
+                    range_slices[current_dso].append(added_dso_name)
+                    address_ranges[added_dso_name] = \
+                        MemoryRange(start_address, end_address, added_dso_name)
+            else:
+                if start_address - \
+                   address_ranges[current_dso].end_address > MAX_RANGE_GAP:
+                    added_dso_name = "%s_%d" % (current_dso, 1)
+                    range_slices[current_dso] = [current_dso, added_dso_name]
+                    address_ranges[added_dso_name] = \
+                        MemoryRange(start_address, end_address, added_dso_name)
+                else:
+                    address_ranges[current_dso].end_address = end_address
+
+    ranges_count = len(address_ranges)
+
+    # Update range internals (get aligned addresses, calculate height etc.)
+    for ar in address_ranges.values():
+        ar.update_range_info()
+
+    # Sort ranges by start_address_aligned
+    address_ranges_list = sorted(address_ranges.values(),
+                                 key=lambda x: x.start_address_aligned)
+
+    # Add samples to ranges
+    for row in rows:
+        if row.ip == 0:
+            continue
+        target_dso = None
+        start_address = row.ip
+        end_address = start_address + row.length - 1
+        if row.dso_name in range_slices:
+            for name in range_slices[row.dso_name]:
+                if address_ranges[name].start_address <= start_address and \
+                   address_ranges[name].end_address >= end_address:
+                    target_dso = name
+                    break
+        else:
+            target_dso = row.dso_name
+        if target_dso is None:
+            print ("Dropping from %s" % (row.dso_name))
+        else:
+            address_ranges[target_dso].add_sample(start_address, row.length,
+                                                  row.exec_count)
+
+    # Process data (create logarithmic scale, calculate max)
+    for ar in address_ranges_list:
+        ar.process_data(log_scale)
+
+    # If global max is required, calculate it as the max of all ranges' maxes
+    global_max = None
+    if use_global_max_for_norm:
+        global_max = max(
+                    [ar.max_normalized for ar in address_ranges_list])
+
+    # Normalize data in ranges to [0, 2047] based on either local or global max
+    for ar in address_ranges_list:
+        ar.normalize_data(2047.0, global_max)
+
+    # Total WSS
+    total_wss = sum([ar.wss for ar in address_ranges_list])
+
+    # Create result data
+    return {
+        "bytesPerSample": bytes_per_sample,
+        "wss": total_wss,
+        "ranges":
+            [ar.to_dict(idx) for idx, ar in enumerate(address_ranges_list)]
+        }
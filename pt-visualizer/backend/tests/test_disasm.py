@@ -0,0 +1,105 @@
+'''
+// Copyright (c) 2015-2019 Intel Corporation
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//      http://www.apache.org/licenses/LICENSE-2.0
+//
+// Unless required by applicable law or agreed to in writing, software
+// distributed under the License is distributed on an "AS IS" BASIS,
+// WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+// See the License for the specific language governing permissions and
+// limitations under the License.
+'''
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+
+import disasm
+
+# 'xed -64 -ir' output for push rbp; mov rbp, rsp; <2 bad bytes>; ret
+XED_OUTPUT = b"""\
+XDIS 0: PUSH      BASE       55                       push rbp
+XDIS 1: DATAXFER  BASE       4889E5                   mov rbp, rsp
+ERROR: GENERAL_ERROR Could not decode at offset: 0x4 PC: 0x4: [0F0B...]
+XDIS 6: RET       BASE       C3                       ret
+# end of text section.
+# Errors: 1
+"""
+
+
+class StubDisassembler(disasm.Disassembler):
+    """ Records the xed batches, and decodes opcodes to their hex """
+    def __init__(self, *args, **kwargs):
+        super(StubDisassembler, self).__init__(*args, **kwargs)
+        self.batches = []
+
+    def _run_xed(self, opcodes):
+        self.batches.append(list(opcodes))
+        return [opcode.encode('hex') for opcode in opcodes]
+
+
+class RunXedTest(unittest.TestCase):
+    def setUp(self):
+        self.check_output = disasm.subprocess.check_output
+        self.commands = []
+
+        def check_output(command, **kwargs):
+            self.commands.append(command)
+            with open(command[-1], 'rb') as raw_file:
+                self.raw = raw_file.read()
+            return XED_OUTPUT
+        disasm.subprocess.check_output = check_output
+
+    def tearDown(self):
+        disasm.subprocess.check_output = self.check_output
+
+    def test_batch(self):
+        # Matched back by offset, opcodes at an error line are unknown
+        opcodes = [b'\x55', b'\x48\x89\xe5', b'\x0f\x0b', b'\xc3']
+        texts = disasm.Disassembler(xed='xed').decode_many(opcodes)
+        self.assertEqual(texts, ["push rbp", "mov rbp, rsp",
+                                 disasm.UNKNOWN, "ret"])
+        self.assertEqual(len(self.commands), 1)
+        self.assertEqual(self.commands[0][:3], ['xed', '-64', '-ir'])
+        self.assertEqual(self.raw, b''.join(opcodes))
+
+
+class CacheTest(unittest.TestCase):
+    def test_one_run_per_batch(self):
+        disassembler = StubDisassembler(cache_size=8)
+        texts = disassembler.decode_many([b'\x55', b'\xc3', b'\x55'])
+        self.assertEqual(texts, ["55", "c3", "55"])
+        self.assertEqual(disassembler.batches, [[b'\x55', b'\xc3']])
+        texts = disassembler.decode_many([b'\xc3', b'\x90', b'\x90',
+                                          b'\xc3'])
+        self.assertEqual(texts, ["c3", "90", "90", "c3"])
+        self.assertEqual(disassembler.batches[1], [b'\x90'])
+
+    def test_stats(self):
+        # Counted once per distinct opcode of a batch
+        disassembler = StubDisassembler(cache_size=8)
+        disassembler.decode_many([b'\x55', b'\xc3', b'\x55'])
+        disassembler.decode_many([b'\xc3', b'\x90', b'\x90', b'\xc3'])
+        stats = disassembler.stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 3))
+        self.assertEqual(stats["entries"], 3)
+
+    def test_eviction(self):
+        disassembler = StubDisassembler(cache_size=2)
+        disassembler.decode_many([b'\x01', b'\x02'])
+        disassembler.decode(b'\x01')
+        disassembler.decode(b'\x03')
+        self.assertEqual(disassembler.decode(b'\x01'), "01")
+        self.assertEqual(disassembler.decode(b'\x02'), "02")
+        self.assertEqual(disassembler.batches,
+                         [[b'\x01', b'\x02'], [b'\x03'], [b'\x02']])
+
+
+if __name__ == '__main__':
+    unittest.main()
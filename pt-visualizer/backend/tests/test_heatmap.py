@@ -0,0 +1,469 @@
+'''
+// Copyright (c) 2015-2019 Intel Corporation
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//      http://www.apache.org/licenses/LICENSE-2.0
+//
+// Unless required by applicable law or agreed to in writing, software
+// distributed under the License is distributed on an "AS IS" BASIS,
+// WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+// See the License for the specific language governing permissions and
+// limitations under the License.
+'''
+# Heatmap engine tests, run from pt-visualizer/backend with
+#
+#   $ python -m unittest discover -s tests -t .
+
+import os
+import sys
+import json
+import struct
+import unittest
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+
+import heatmap
+import postprocess
+import jobs
+import memheatmap_baseline
+from dbtest import DbTestCase
+
+DSOS = ["main", "libc.so.6", "libjit.so"]
+
+# Binary heatmap decoded by the UI tests, see fixture_columns
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            '..', '..', '..', 'src', 'ui', 'test', 'fixtures')
+
+
+def random_columns(rnd, instructions):
+    """ ip-sorted rows of interleaved DSOs, with holes big enough to split
+        their ranges, and ranges that end in another order than they start
+    """
+    lengths = rnd.randint(1, 16, size=instructions).astype(np.int64)
+    gaps = rnd.randint(0, 48, size=instructions).astype(np.int64)
+    holes = rnd.random_sample(instructions) < 0.02
+    gaps[holes] += heatmap.MAX_RANGE_GAP + rnd.randint(1, 4096)
+    # Instructions do not overlap
+    ips = 0x400000 + np.cumsum(lengths + gaps) - lengths
+    counts = rnd.geometric(0.05, size=instructions).astype(np.int64)
+    # Runs of one DSO, the same DSO coming back after others
+    runs = np.cumsum(rnd.random_sample(instructions) < 0.1)
+    dso_names = [DSOS[run % len(DSOS)] for run in
+                 ((runs * 7919) % 11).tolist()]
+    return heatmap.Columns(ips, lengths, counts, dso_names)
+
+
+def chunks_of(columns, size):
+    for start in range(0, len(columns), size):
+        end = start + size
+        yield heatmap.Columns(columns.ips[start:end],
+                              columns.lengths[start:end],
+                              columns.counts[start:end],
+                              columns.dso_names[start:end])
+
+
+def as_json(result):
+    return json.loads(json.dumps(result))
+
+
+def without_tie_order(result):
+    # memheatmap_full left ranges with the same aligned start in dict order
+    for ar in result["ranges"]:
+        del ar["index"]
+    result["ranges"].sort(key=lambda ar: (ar["startAddressAligned"],
+                                          ar["dsoName"]))
+    return result
+
+
+class BaselineTest(unittest.TestCase):
+    """ split_ranges and bin_ranges against the former memheatmap_full """
+    def check_baseline(self, columns, bytes_per_sample):
+        rows = zip(columns.ips.tolist(), columns.lengths.tolist(),
+                   columns.counts.tolist(), columns.dso_names)
+        self.assertEqual(
+            without_tie_order(as_json(
+                heatmap.build_heatmap(columns, bytes_per_sample))),
+            without_tie_order(as_json(
+                memheatmap_baseline.memheatmap_full(rows,
+                                                    bytes_per_sample))))
+
+    def test_random_traces(self):
+        rnd = np.random.RandomState(2)
+        for trial in range(40):
+            self.check_baseline(random_columns(rnd, rnd.randint(1, 3000)),
+                                [1, 16, 64, 2048][trial % 4])
+
+    def test_instructions_across_pixels(self):
+        # Counted in every pixel they overlap, unaligned range starts
+        columns = heatmap.Columns([0x1003, 0x100e, 0x1040], [15, 4, 1],
+                                  [3, 1, 1024], ["main"] * 3)
+        for bytes_per_sample in (1, 4, 16, 64):
+            self.check_baseline(columns, bytes_per_sample)
+
+    def test_slices(self):
+        # A DSO coming back past MAX_RANGE_GAP, then in its first slice
+        gap = heatmap.MAX_RANGE_GAP
+        columns = heatmap.Columns([0x1000, 0x1010, 0x1000 + 2 * gap,
+                                   0x1000 + 4 * gap, 0x1008 + 4 * gap],
+                                  [4] * 5, [1, 2, 3, 4, 5],
+                                  ["main", "libc.so.6", "main", "main",
+                                   "libc.so.6"])
+        self.check_baseline(columns, 64)
+
+
+def fixture_columns():
+    # Ranges of 3 and 6 non-empty pixels at 4 bytes per sample, so that the
+    # normalized arrays need padding or not, and a DSO name the JSON header
+    # has to escape
+    return heatmap.Columns([0x1000, 0x1004, 0x1040,
+                            0x9000, 0x9100,
+                            0x40000000, 0x40000040, 0x40000080],
+                           [4, 2, 1, 8, 3, 15, 1, 2],
+                           [1, 2, 3, 1000, 70000, 5, 6, 1 << 20],
+                           ["main"] * 3 + [u"libcaf\u00e9.so"] * 2 +
+                           ["libc.so.6"] * 3)
+
+
+def decode_binary(data):
+    """ Reads the binary wire format back into the heatmap_result layout,
+        checking the alignment of every array
+    """
+    assert data[:4] == heatmap.BINARY_MAGIC
+    header_length = struct.unpack('<I', data[4:8])[0]
+    assert header_length % 4 == 0
+    result = json.loads(data[8:8 + header_length].decode('ascii'))
+    offset = 8 + header_length
+    for ar in result["ranges"]:
+        count = ar.pop("count")
+        arrays = []
+        for dtype in (heatmap.WIRE_PIXEL_DTYPE, heatmap.WIRE_RAW_DTYPE,
+                      heatmap.WIRE_NORMALIZED_DTYPE):
+            assert offset % 4 == 0
+            arrays.append(np.frombuffer(data, dtype, count, offset))
+            offset += count * dtype.itemsize
+        offset += -offset % 4
+        pixels, raw, normalized = arrays
+        ar["data"] = dict((str(pixel), [norm, value]) for pixel, norm, value
+                          in zip(pixels.tolist(), normalized.tolist(),
+                                 raw.tolist()))
+    assert offset == len(data)
+    return result
+
+
+class BinaryResultTest(unittest.TestCase):
+    def test_same_as_json(self):
+        for bytes_per_sample in (1, 4, 64):
+            columns = fixture_columns()
+            self.assertEqual(
+                decode_binary(heatmap.build_heatmap(
+                    columns, bytes_per_sample,
+                    encoder=heatmap.binary_result)),
+                as_json(heatmap.build_heatmap(columns, bytes_per_sample)))
+
+    def test_saturated_raw_counts(self):
+        columns = heatmap.Columns([0x1000, 0x1010], [1, 1],
+                                  [heatmap.WIRE_RAW_MAX + 5, 7],
+                                  ["main", "main"])
+        result = decode_binary(heatmap.build_heatmap(
+                    columns, 16, encoder=heatmap.binary_result))
+        self.assertEqual(result["ranges"][0]["data"],
+                         {"0": [2047, heatmap.WIRE_RAW_MAX],
+                          "1": [179, 7]})
+
+    def test_empty(self):
+        result = heatmap.build_heatmap(heatmap.Columns([], [], [], []), 64,
+                                       encoder=heatmap.binary_result)
+        self.assertEqual(decode_binary(result),
+                         {"bytesPerSample": 64, "wss": 0, "ranges": []})
+
+    def test_ui_fixture(self):
+        # The UI tests decode this response, and check it against the JSON one
+        columns = fixture_columns()
+        with open(os.path.join(FIXTURES_DIR, "heatmap.bin"), 'rb') as fixture:
+            self.assertEqual(fixture.read(), heatmap.build_heatmap(
+                                columns, 4, encoder=heatmap.binary_result))
+        with open(os.path.join(FIXTURES_DIR, "heatmap.json")) as fixture:
+            self.assertEqual(json.load(fixture),
+                             as_json(heatmap.build_heatmap(columns, 4)))
+
+
+class RangeSplitterTest(unittest.TestCase):
+    def test_slices(self):
+        gap = heatmap.MAX_RANGE_GAP
+        columns = heatmap.Columns([0, 0x1000, 0x1008, 0x2000 + gap,
+                                   0x3000 + 3 * gap, 0x3010 + 3 * gap],
+                                  [1, 4, 4, 2, 2, 2], [1] * 6,
+                                  ["main", "main", "libc.so.6", "main",
+                                   "main", "libc.so.6"])
+        ranges, range_ids = heatmap.split_ranges(columns)
+        self.assertEqual([(ar.dso_name, ar.start_address, ar.end_address)
+                          for ar in ranges],
+                         [("main", 0x1000, 0x1003),
+                          ("libc.so.6", 0x1008, 0x100b),
+                          ("main_1", 0x2000 + gap, 0x2001 + gap),
+                          ("main_2", 0x3000 + 3 * gap, 0x3001 + 3 * gap),
+                          ("libc.so.6_1", 0x3010 + 3 * gap,
+                           0x3011 + 3 * gap)])
+        # Rows at ip 0 are not in memory
+        self.assertEqual(range_ids.tolist(), [-1, 0, 1, 2, 3, 4])
+
+    def test_chunks(self):
+        # Same ranges and assignment as in one go, wherever the chunks end
+        rnd = np.random.RandomState(4)
+        for trial in range(40):
+            columns = random_columns(rnd, rnd.randint(1, 2000))
+            ranges, range_ids = heatmap.split_ranges(columns)
+            chunk_size = rnd.randint(1, 300)
+            splitter = heatmap.RangeSplitter()
+            for chunk in chunks_of(columns, chunk_size):
+                splitter.add(chunk)
+            chunked = splitter.finish()
+            self.assertEqual([(ar.dso_name, ar.start_address,
+                               ar.end_address) for ar in chunked],
+                             [(ar.dso_name, ar.start_address,
+                               ar.end_address) for ar in ranges])
+            self.assertEqual(np.concatenate(
+                                [splitter.assign(chunk) for chunk in
+                                 chunks_of(columns, chunk_size)]).tolist(),
+                             range_ids.tolist())
+
+
+def normalized_stream(ranges, trailer):
+    """ Fills in the normalized values left null by the stream """
+    for ar in ranges:
+        if "normalizationMax" in trailer:
+            raw = np.array([raw for normalized, raw in ar["data"].values()],
+                           dtype=np.int64)
+            normalized = heatmap.normalize_values(
+                                heatmap.scale_values(raw),
+                                trailer["normalizationMax"]).tolist()
+            ar["data"] = dict(zip(ar["data"].keys(),
+                                  zip(normalized, raw.tolist())))
+    return sorted(ranges, key=lambda ar: ar["index"])
+
+
+class StreamHeatmapTest(unittest.TestCase):
+    def stream(self, chunks, bytes_per_sample, use_global_max_for_norm=True):
+        """ Returns the (header, ranges, trailer) of a stream """
+        items = list(heatmap.stream_heatmap_chunks(
+                        chunks, bytes_per_sample,
+                        use_global_max_for_norm=use_global_max_for_norm))
+        return items[0], items[1:-1], items[-1]
+
+    def check_stream(self, columns, bytes_per_sample, chunk_size,
+                     use_global_max_for_norm=True):
+        expected = heatmap.build_heatmap(columns, bytes_per_sample,
+                                         use_global_max_for_norm=
+                                            use_global_max_for_norm)
+        header, ranges, trailer = self.stream(chunks_of(columns, chunk_size),
+                                              bytes_per_sample,
+                                              use_global_max_for_norm)
+        self.assertEqual(header, {"bytesPerSample": bytes_per_sample})
+        self.assertEqual(trailer["wss"], expected["wss"])
+        self.assertEqual(trailer["rangeCount"], len(expected["ranges"]))
+        self.assertEqual("normalizationMax" in trailer,
+                         use_global_max_for_norm)
+        if use_global_max_for_norm:
+            for ar in ranges:
+                for normalized, raw in ar["data"].values():
+                    self.assertIsNone(normalized)
+        self.assertEqual(normalized_stream(ranges, trailer),
+                         expected["ranges"])
+        return ranges
+
+    def test_matches_build_heatmap(self):
+        rnd = np.random.RandomState(1)
+        for trial in range(40):
+            columns = random_columns(rnd, rnd.randint(1, 3000))
+            self.check_stream(columns, [1, 16, 64, 2048][trial % 4],
+                              rnd.randint(1, 700), trial % 3 != 0)
+
+    def test_ranges_ending_out_of_order(self):
+        # 'main' spans the whole trace and ends last, so it is the last range
+        # sent although it has index 0
+        gap = heatmap.MAX_RANGE_GAP
+        columns = heatmap.Columns([0x1000, 0x1010, 0x1020, 0x1000 + gap,
+                                   0x1000 + 2 * gap, 0x1010 + 2 * gap],
+                                  [4] * 6, [1, 2, 3, 4, 5, 6],
+                                  ["main", "libc.so.6", "libjit.so",
+                                   "main", "main", "libc.so.6"])
+        ranges = self.check_stream(columns, 16, 2)
+        self.assertEqual([(ar["index"], ar["dsoName"]) for ar in ranges],
+                         [(1, "libc.so.6"), (2, "libjit.so"),
+                          (0, "main"), (3, "libc.so.6_1")])
+
+    def test_overlapping_instructions(self):
+        # Rows running past the last row of their range are dropped, unless a
+        # later row, maybe of a later chunk, goes as far
+        gap = heatmap.MAX_RANGE_GAP
+        columns = heatmap.Columns([0x1000, 0x1002, 0x1004, 0x1006, 0x1008,
+                                   0x1000 + 2 * gap, 0x1002 + 2 * gap],
+                                  [16, 2, 8, 2, 6, 8, 2],
+                                  [1, 2, 4, 8, 16, 32, 64],
+                                  ["main"] * 5 + ["libc.so.6"] * 2)
+        ranges, range_ids = heatmap.split_ranges(columns)
+        self.assertEqual(range_ids.tolist(), [-1, 0, 0, 0, 0, -1, 1])
+        for chunk_size in (1, 2, 7):
+            self.check_stream(columns, 4, chunk_size)
+
+    def test_nothing_held_back(self):
+        # 'main' stays open over the whole trace while slices of 'libc.so.6'
+        # are completed one after the other: each of them is sent before the
+        # next chunk is read
+        gap = heatmap.MAX_RANGE_GAP
+        ips = []
+        dso_names = []
+        for step in range(40):
+            ips.append(0x400000 + step * gap // 2)
+            dso_names.append("main")
+            if step % 4 == 1:
+                ips.append(0x400010 + step * gap // 2)
+                dso_names.append("libc.so.6")
+        columns = heatmap.Columns(ips, [4] * len(ips), [1] * len(ips),
+                                  dso_names)
+        expected = heatmap.build_heatmap(columns, 64)["ranges"]
+        sent = []
+        pending = []
+
+        def chunks():
+            for chunk in chunks_of(columns, 1):
+                yield chunk
+                # Ranges the rows read so far have gone past and are not
+                # sent yet
+                pending.append(len([
+                    ar for ar in expected
+                    if int(chunk.ips[-1]) - ar["endAddress"] > gap and
+                       ar["index"] not in sent]))
+
+        items = heatmap.stream_heatmap_chunks(chunks(), 64)
+        next(items)
+        for item in items:
+            if "index" in item:
+                sent.append(item["index"])
+        self.assertEqual(len(expected), 11)
+        self.assertEqual(sorted(sent), range(len(expected)))
+        self.assertEqual(max(pending), 0)
+        # 'main' comes with the last slice, both open until the end
+        self.assertEqual(sent[-2:], [0, len(expected) - 1])
+
+    def test_empty(self):
+        self.assertEqual(self.stream(iter([]), 64),
+                         ({"bytesPerSample": 64}, [],
+                          {"wss": 0, "rangeCount": 0,
+                           "normalizationMax": 0.0}))
+        self.assertEqual(self.stream(iter([]), 64, False),
+                         ({"bytesPerSample": 64}, [],
+                          {"wss": 0, "rangeCount": 0}))
+
+
+DB_DSOS = [(0, "unknown"), (1, "main"), (2, "libc.so.6")]
+DB_SYMBOLS = [(0, 0, "unknown", 0, 0), (1, 1, "main", 0x1000, 0x1100),
+              (2, 2, "memcpy", 0x9000, 0x9100)]
+# Exec counts are the sums of the per-window and per-thread/cpu rows below
+DB_INSTRUCTIONS = [(1, 0x1000, 6, 0, 4), (1, 0x1004, 2, 4, 2),
+                   (2, 0x9000, 9, 0, 8)]
+
+
+class WindowsQueryTest(DbTestCase):
+    def setUp(self):
+        super(WindowsQueryTest, self).setUp()
+        self.schema = self.create_trace("test_heatmap_windows", DB_DSOS,
+                                        DB_SYMBOLS, DB_INSTRUCTIONS)
+        self.cur.execute("CREATE TABLE " + self.schema + ".time_windows ("
+                         "id smallint, start_time bigint, end_time bigint)")
+        self.cur.execute("INSERT INTO " + self.schema + ".time_windows "
+                         "VALUES (0, 100, 199), (1, 200, 299), (2, 300, 399)")
+        self.cur.execute("CREATE TABLE " + self.schema +
+                         ".instruction_windows (instruction_id integer, "
+                         "window_id smallint, exec_count integer)")
+        self.cur.execute("INSERT INTO " + self.schema + ".instruction_windows "
+                         "VALUES (1, 0, 1), (1, 1, 2), (1, 2, 3), "
+                         "(2, 2, 2), (3, 0, 4), (3, 1, 5)")
+
+    def window_rows(self, start_time, end_time):
+        self.cur.execute(heatmap.windowed_instructions_query(
+                            self.schema, postprocess.instructions_source(
+                                            self.cur, self.schema)),
+                         {"start_time": start_time, "end_time": end_time})
+        return [(ip, length, int(count), dso_name)
+                for ip, length, count, dso_name in self.cur.fetchall()]
+
+    def test_overlapping_windows(self):
+        # Windows are counted whole as soon as they overlap the time range
+        self.assertEqual(self.window_rows(250, 300),
+                         [(0x1000, 4, 5, "main"), (0x1004, 2, 2, "main"),
+                          (0x9000, 8, 5, "libc.so.6")])
+        self.assertEqual(self.window_rows(199, 199),
+                         [(0x1000, 4, 1, "main"),
+                          (0x9000, 8, 4, "libc.so.6")])
+
+    def test_whole_trace(self):
+        self.assertEqual(self.window_rows(0, 1000),
+                         [(0x1000, 4, 6, "main"), (0x1004, 2, 2, "main"),
+                          (0x9000, 8, 9, "libc.so.6")])
+
+    def test_outside_of_the_trace(self):
+        self.assertEqual(self.window_rows(400, 500), [])
+        self.assertEqual(self.window_rows(300, 200), [])
+
+    def test_time_windows(self):
+        self.assertEqual(heatmap.time_windows(self.cur, self.schema)[1],
+                         {"window": 1, "startTime": 200, "endTime": 299})
+
+
+class BreakdownQueryTest(DbTestCase):
+    def setUp(self):
+        super(BreakdownQueryTest, self).setUp()
+        self.schema = self.create_trace("test_heatmap_breakdown", DB_DSOS,
+                                        DB_SYMBOLS, DB_INSTRUCTIONS)
+        for table, column, column_type, rows in (
+                ("instruction_threads", "thread_id", "integer",
+                 "(1, 100, 5), (1, 101, 1), (2, 101, 2), (3, 102, 9)"),
+                # cpu -1 for samples perf could not tell the cpu of
+                ("instruction_cpus", "cpu_id", "smallint",
+                 "(1, 0, 3), (1, -1, 3), (2, -1, 2), (3, 3, 9)")):
+            self.cur.execute("CREATE TABLE " + self.schema + "." + table +
+                             " (instruction_id integer, " + column + " " +
+                             column_type + ", exec_count integer)")
+            self.cur.execute("INSERT INTO " + self.schema + "." + table +
+                             " VALUES " + rows)
+
+    def breakdown_rows(self, breakdown, ids):
+        self.cur.execute(jobs.breakdown_query(self.cur, self.schema,
+                                              breakdown, ids))
+        return [(ip, length, int(count), dso_name)
+                for ip, length, count, dso_name in self.cur.fetchall()]
+
+    def test_threads(self):
+        self.assertEqual(self.breakdown_rows(heatmap.THREADS_BREAKDOWN,
+                                             [101]),
+                         [(0x1000, 4, 1, "main"), (0x1004, 2, 2, "main")])
+        self.assertEqual(self.breakdown_rows(heatmap.THREADS_BREAKDOWN,
+                                             [100, 101, 102]),
+                         [(0x1000, 4, 6, "main"), (0x1004, 2, 2, "main"),
+                          (0x9000, 8, 9, "libc.so.6")])
+        self.assertEqual(self.breakdown_rows(heatmap.THREADS_BREAKDOWN,
+                                             [7]), [])
+
+    def test_unknown_cpu(self):
+        self.assertEqual(self.breakdown_rows(heatmap.CPUS_BREAKDOWN, [-1]),
+                         [(0x1000, 4, 3, "main"), (0x1004, 2, 2, "main")])
+        self.assertEqual(self.breakdown_rows(heatmap.CPUS_BREAKDOWN, [-1, 3]),
+                         [(0x1000, 4, 3, "main"), (0x1004, 2, 2, "main"),
+                          (0x9000, 8, 9, "libc.so.6")])
+
+    def test_totals(self):
+        self.assertEqual(
+            [[value, int(hits), count] for value, hits, count in
+             heatmap.breakdown_totals(self.cur, self.schema,
+                                      heatmap.CPUS_BREAKDOWN)],
+            [[3, 9, 1], [-1, 5, 2], [0, 3, 1]])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+'''
+// Copyright (c) 2015-2019 Intel Corporation
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//      http://www.apache.org/licenses/LICENSE-2.0
+//
+// Unless required by applicable law or agreed to in writing, software
+// distributed under the License is distributed on an "AS IS" BASIS,
+// WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+// See the License for the specific language governing permissions and
+// limitations under the License.
+'''
+import unittest
+
+from dbtest import DbTestCase
+
+import jobs
+
+DSOS = [(0, "unknown"), (1, "main"), (2, "libc.so.6")]
+SYMBOLS = [(0, 0, "unknown", 0, 0), (1, 1, "main", 0x1000, 0x1100),
+           (2, 2, "memcpy", 0x9000, 0x9100)]
+INSTRUCTIONS = [(1, 0x1000, 5, 0, 4), (2, 0x9000, 7, 0, 2)]
+
+
+class DsoMatrixTest(DbTestCase):
+    def test_calls(self):
+        schema = self.create_trace("test_jobs_calls", DSOS, SYMBOLS,
+                                   INSTRUCTIONS)
+        self.cur.execute("CREATE TABLE " + schema + ".call_transitions ("
+                         "from_dso smallint, to_dso smallint, "
+                         "from_symbol_id integer, to_symbol_id integer, "
+                         "count bigint)")
+        self.cur.execute("INSERT INTO " + schema + ".call_transitions "
+                         "VALUES (1, 2, 1, 2, 3), (1, 2, 1, 2, 4), "
+                         "(2, 2, 2, 2, 1)")
+        matrix = jobs.dso_matrix(self.cur, schema)
+        self.assertEqual(matrix["source"], "calls")
+        self.assertEqual(sorted(matrix["transitions"]),
+                         [[1, 2, 7], [2, 2, 1]])
+        self.assertEqual([dso["name"] for dso in matrix["dsos"]],
+                         ["libc.so.6", "main", "unknown"])
+
+    def test_branches(self):
+        # Default and heatmap-only exports count the branch samples
+        schema = self.create_trace("test_jobs_branches", DSOS, SYMBOLS,
+                                   INSTRUCTIONS)
+        self.cur.execute("CREATE TABLE " + schema + ".branch_transitions ("
+                         "from_symbol_id integer, to_symbol_id integer, "
+                         "count bigint)")
+        self.cur.execute("INSERT INTO " + schema + ".branch_transitions "
+                         "VALUES (1, 2, 3), (1, 1, 10), (0, 2, 1), "
+                         "(2, 1, 2)")
+        self.cur.execute("CREATE VIEW " + schema + ".dso_transitions_view "
+                         "AS SELECT f.dso_id AS from_dso_id, "
+                         "t.dso_id AS to_dso_id, sum(b.count) AS count "
+                         "FROM " + schema + ".branch_transitions b "
+                         "JOIN " + schema + ".symbols f "
+                             "ON f.id = b.from_symbol_id "
+                         "JOIN " + schema + ".symbols t "
+                             "ON t.id = b.to_symbol_id "
+                         "GROUP BY 1, 2")
+        matrix = jobs.dso_matrix(self.cur, schema)
+        self.assertEqual(matrix["source"], "branches")
+        self.assertEqual(sorted(matrix["transitions"]),
+                         [[0, 2, 1], [1, 1, 10], [1, 2, 3], [2, 1, 2]])
+        self.assertEqual(len(matrix["dsos"]), 3)
+
+    def test_no_transitions(self):
+        schema = self.create_trace("test_jobs_none", DSOS, SYMBOLS,
+                                   INSTRUCTIONS)
+        matrix = jobs.dso_matrix(self.cur, schema)
+        self.assertEqual(matrix["source"], None)
+        self.assertEqual(matrix["transitions"], [])
+        self.assertEqual(len(matrix["dsos"]), 3)
+
+    def test_no_trace(self):
+        self.assertEqual(jobs.dso_matrix(self.cur, "test_jobs_missing"),
+                         None)
+
+
+if __name__ == '__main__':
+    unittest.main()
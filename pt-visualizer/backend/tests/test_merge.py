@@ -0,0 +1,98 @@
+'''
+// Copyright (c) 2015-2019 Intel Corporation
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//      http://www.apache.org/licenses/LICENSE-2.0
+//
+// Unless required by applicable law or agreed to in writing, software
+// distributed under the License is distributed on an "AS IS" BASIS,
+// WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+// See the License for the specific language governing permissions and
+// limitations under the License.
+'''
+import unittest
+
+from dbtest import DbTestCase
+
+import merge
+
+DSOS = [(0, "unknown"), (1, "main"), (2, "libc.so.6")]
+
+# Two static functions named 'helper' in main, laid out in this order
+BASE_SYMBOLS = [(0, 0, "unknown", 0, 0),
+                (1, 1, "main", 0x1000, 0x1010),
+                (2, 1, "helper", 0x1100, 0x1110),
+                (3, 1, "helper", 0x1200, 0x1210),
+                (4, 2, "memcpy", 0x9000, 0x9010)]
+BASE_INSTRUCTIONS = [(1, 0x1000, 1, 0, 4), (1, 0x1004, 2, 4, 4),
+                     (2, 0x1100, 3, 0, 4), (3, 0x1200, 5, 0, 4),
+                     (3, 0x1204, 6, 4, 2), (4, 0x9000, 7, 0, 8),
+                     (0, 0x5000, 9, 0, 1)]
+
+# Same program with main 0x10000 and libc 0x20000 higher, other symbol ids,
+# and a function the base trace did not run
+SYMBOLS = [(0, 0, "unknown", 0, 0),
+           (7, 1, "helper", 0x11200, 0x11210),
+           (8, 1, "helper", 0x11100, 0x11110),
+           (9, 1, "main", 0x11000, 0x11010),
+           (10, 1, "cold", 0x11300, 0x11310),
+           (11, 2, "memcpy", 0x29000, 0x29010)]
+INSTRUCTIONS = [(9, 0x11000, 10, 0, 4), (8, 0x11100, 20, 0, 4),
+                (7, 0x11200, 30, 0, 4), (7, 0x11208, 40, 8, 4),
+                (10, 0x11304, 50, 4, 4), (11, 0x29000, 60, 0, 8),
+                (0, 0x5000, 70, 0, 1)]
+
+
+class MergeTest(DbTestCase):
+    def merged(self):
+        sources = [self.create_trace("test_merge_base", DSOS, BASE_SYMBOLS,
+                                     BASE_INSTRUCTIONS),
+                   self.create_trace("test_merge_trace", DSOS, SYMBOLS,
+                                     INSTRUCTIONS)]
+        schema = self.create_schema("test_merge_merged")
+        merge.build_merged_tables(self.cur, schema, sources)
+        return schema
+
+    def test_summed_counts(self):
+        schema = self.merged()
+        self.cur.execute("SELECT i.ip, i.exec_count, i.sym_offset, "
+                         "s.name, octet_length(i.opcode) "
+                         "FROM " + schema + ".instructions i "
+                         "JOIN " + schema + ".symbols s "
+                             "ON s.id = i.symbol_id ORDER BY i.ip")
+        self.assertEqual(self.cur.fetchall(),
+                         [(0x1000, 11, 0, "main", 4),
+                          (0x1004, 2, 4, "main", 4),
+                          (0x1100, 23, 0, "helper", 4),
+                          (0x1200, 35, 0, "helper", 4),
+                          (0x1204, 6, 4, "helper", 2),
+                          (0x1208, 40, 8, "helper", 4),
+                          (0x1304, 50, 4, "cold", 4),
+                          (0x5000, 79, 0, "unknown", 1),
+                          (0x9000, 67, 0, "memcpy", 8)])
+
+    def test_symbols(self):
+        # Same-named symbols stay apart, and symbols placed from the second
+        # trace move along with their instructions
+        schema = self.merged()
+        self.cur.execute("SELECT d.name, s.name, s.sym_start, s.sym_end "
+                         "FROM " + schema + ".symbols s "
+                         "JOIN " + schema + ".dsos d ON d.id = s.dso_id "
+                         "ORDER BY s.sym_start")
+        self.assertEqual(self.cur.fetchall(),
+                         [("unknown", "unknown", 0, 0),
+                          ("main", "main", 0x1000, 0x1010),
+                          ("main", "helper", 0x1100, 0x1110),
+                          ("main", "helper", 0x1200, 0x1210),
+                          ("main", "cold", 0x1300, 0x1310),
+                          ("libc.so.6", "memcpy", 0x9000, 0x9010)])
+        self.cur.execute("SELECT sum(exec_count) FROM " + schema +
+                         ".instructions_view WHERE dso_name = 'main'")
+        self.assertEqual(self.cur.fetchone()[0], 167)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,161 @@
+'''
+// Copyright (c) 2015-2019 Intel Corporation
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//      http://www.apache.org/licenses/LICENSE-2.0
+//
+// Unless required by applicable law or agreed to in writing, software
+// distributed under the License is distributed on an "AS IS" BASIS,
+// WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+// See the License for the specific language governing permissions and
+// limitations under the License.
+'''
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+
+import psycopg2
+
+import respcache
+
+JSON = "application/json"
+
+
+class FakeConnection(object):
+    """ Runs the statements of respcache.database_token against a token
+        table held in memory, failing the statements that start with one of
+        'failing'
+    """
+    def __init__(self, token=None, failing=()):
+        self.token = token
+        self.failing = failing
+        self.statements = []
+        self.rollbacks = 0
+
+    def cursor(self):
+        return self
+
+    def execute(self, query, params=None):
+        self.statements.append(query.split()[0])
+        if query.startswith(self.failing):
+            raise psycopg2.ProgrammingError("permission denied")
+        if query.startswith("INSERT") and self.token is None:
+            self.token = params[0]
+        self.row = (self.token, ) if self.token is not None else None
+
+    def fetchone(self):
+        return self.row
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        self.rollbacks += 1
+
+
+class ResponseCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.disk_dir = tempfile.mkdtemp(prefix='pt-vis-cache-')
+
+    def tearDown(self):
+        shutil.rmtree(self.disk_dir)
+
+    def test_memory_lru(self):
+        cache = respcache.ResponseCache(max_bytes=40)
+        for idx in range(4):
+            cache.put(1, ("wss", idx), (JSON, "x" * 10))
+        cache.get(1, ("wss", 0))
+        cache.put(1, ("wss", 4), (JSON, "x" * 10))
+        self.assertEqual(cache.get(1, ("wss", 1)), None)
+        self.assertEqual(cache.get(1, ("wss", 0)), (JSON, "x" * 10))
+        stats = cache.stats()
+        self.assertEqual((stats["entries"], stats["bytes"],
+                          stats["evictions"]), (4, 40, 1))
+
+    def test_large_entries(self):
+        # Only kept on disk
+        cache = respcache.ResponseCache(max_bytes=40, disk_dir=self.disk_dir)
+        cache.put(1, "heatmap", (JSON, "x" * 11))
+        self.assertEqual(cache.stats()["entries"], 0)
+        self.assertEqual(cache.get(1, "heatmap"), (JSON, "x" * 11))
+        self.assertEqual(cache.stats()["diskHits"], 1)
+
+    def test_disk_shared(self):
+        one = respcache.ResponseCache(disk_dir=self.disk_dir)
+        two = respcache.ResponseCache(disk_dir=self.disk_dir)
+        one.put(1, ("db1", "wss", 1), (JSON, '{"wss": 1}'))
+        self.assertEqual(two.get(1, ("db1", "wss", 1)), (JSON, '{"wss": 1}'))
+        # Keys of another database do not match
+        self.assertEqual(two.get(1, ("db2", "wss", 1)), None)
+
+    def test_invalidate(self):
+        one = respcache.ResponseCache(disk_dir=self.disk_dir)
+        two = respcache.ResponseCache(disk_dir=self.disk_dir)
+        one.put(1, ("wss", 1), (JSON, "1"))
+        one.put(2, ("wss", 2), (JSON, "2"))
+        # Deleted by another process, which drops the shared entries
+        two.invalidate(1)
+        one.invalidate(1)
+        self.assertEqual(one.get(1, ("wss", 1)), None)
+        self.assertEqual(two.get(1, ("wss", 1)), None)
+        self.assertEqual(two.get(2, ("wss", 2)), (JSON, "2"))
+        self.assertEqual(one.stats()["bytes"], 1)
+
+class DatabaseTokenTest(unittest.TestCase):
+    def test_stored_once(self):
+        conn = FakeConnection()
+        token = respcache.database_token(conn)
+        self.assertEqual(len(token), 32)
+        self.assertEqual(respcache.database_token(conn), token)
+        self.assertEqual(conn.statements,
+                         ["CREATE", "INSERT", "SELECT"] * 2)
+        # Another database
+        self.assertNotEqual(respcache.database_token(FakeConnection()),
+                            token)
+
+    def test_read_only(self):
+        # Stored by another role, or by another backend at the same time
+        conn = FakeConnection("0123", failing=("CREATE", "INSERT"))
+        self.assertEqual(respcache.database_token(conn), "0123")
+        self.assertEqual(conn.rollbacks, 1)
+
+    def test_unavailable(self):
+        # No cache rather than failed requests
+        self.assertIsNone(respcache.database_token(
+                            FakeConnection(failing=("CREATE", "SELECT"))))
+        self.assertIsNone(respcache.database_token(
+                            FakeConnection(failing=("CREATE", ))))
+
+    def test_response_key(self):
+        key = respcache.response_key("db1", "wss_per_sym", 3, {"dso": "a"},
+                                     [("b", "2"), ("a", "1"), ("a", "0")],
+                                     JSON)
+        self.assertEqual(key, respcache.response_key(
+                                "db1", "wss_per_sym", 3, {"dso": "a"},
+                                [("a", "0"), ("b", "2"), ("a", "1")], JSON))
+        for other in (("db2", "wss_per_sym", 3, {"dso": "a"}),
+                      ("db1", "wss_per_dso", 3, {"dso": "a"}),
+                      ("db1", "wss_per_sym", 4, {"dso": "a"}),
+                      ("db1", "wss_per_sym", 3, {"dso": "b"})):
+            self.assertNotEqual(key, respcache.response_key(
+                                    *(other + ([("a", "0"), ("b", "2"),
+                                                ("a", "1")], JSON))))
+        self.assertNotEqual(key, respcache.response_key(
+                                "db1", "wss_per_sym", 3, {"dso": "a"},
+                                [("a", "0"), ("b", "2")], JSON))
+        self.assertNotEqual(key, respcache.response_key(
+                                "db1", "wss_per_sym", 3, {"dso": "a"},
+                                [("b", "2"), ("a", "1"), ("a", "0")],
+                                "application/octet-stream"))
+
+
+if __name__ == '__main__':
+    unittest.main()
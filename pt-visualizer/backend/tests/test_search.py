@@ -0,0 +1,119 @@
+'''
+// Copyright (c) 2015-2019 Intel Corporation
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//      http://www.apache.org/licenses/LICENSE-2.0
+//
+// Unless required by applicable law or agreed to in writing, software
+// distributed under the License is distributed on an "AS IS" BASIS,
+// WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+// See the License for the specific language governing permissions and
+// limitations under the License.
+'''
+import unittest
+
+from dbtest import DbTestCase
+
+import search
+
+SYMBOLS = [(1, "main"), (2, "memcpy"), (3, "overflow"), (4, "memcpy_avx")]
+# (symbol_id, ts, cpu, call)
+INS = [(1, 100, 0, 'c'), (1, 100, 1, 'c'), (1, 105, 0, 'c'),
+       (1, 109, 0, ' '), (1, 110, 0, 'c'), (1, 119, 2, 'c'),
+       (1, 120, 0, 'c'), (1, 99, 0, 'c'), (1, 121, 0, 'c'),
+       (2, 110, 0, 'c'), (3, 112, 1, ' '), (3, 118, 1, ' ')]
+
+# The query search_full ran before the ins(symbol_id, ts) index
+FULL_JOIN_QUERY = ("SELECT (ts/%s)*%s as ts, count(*) as hits, cpu "
+                   "from {schema}.ins "
+                   "full join "
+                   "(select ts from generate_series(%s,%s,%s) ts) s1 "
+                   "using (ts) "
+                   "WHERE symbol_id = %s and ts > %s and ts < %s{calls} "
+                   "group by 1,3 "
+                   "order by ts")
+
+
+class TimeSlicesTest(DbTestCase):
+    def setUp(self):
+        DbTestCase.setUp(self)
+        self.schema = self.create_schema("test_search_t")
+        self.cur.execute("CREATE TABLE " + self.schema + ".symbol ("
+                         "id integer NOT NULL, symbol varchar(256))")
+        self.cur.execute("CREATE TABLE " + self.schema + ".ins ("
+                         "symbol_id integer, ts bigint, cpu integer, "
+                         "call char(1))")
+        for row in SYMBOLS:
+            self.cur.execute("INSERT INTO " + self.schema + ".symbol "
+                             "VALUES (%s, %s)", row)
+        for row in INS:
+            self.cur.execute("INSERT INTO " + self.schema + ".ins "
+                             "VALUES (%s, %s, %s, %s)", row)
+        # build_indexes rolls back when pg_trgm is missing
+        self.conn.commit()
+
+    def time_slices(self, symbol_id, calls_only, start_time, end_time,
+                    time_slice):
+        self.cur.execute(search.time_slices_query(self.schema, calls_only),
+                         {"slice": time_slice, "symbol_id": symbol_id,
+                          "start_time": start_time, "end_time": end_time})
+        return self.cur.fetchall()
+
+    def full_join(self, symbol_id, calls_only, start_time, end_time,
+                  time_slice):
+        self.cur.execute(FULL_JOIN_QUERY.format(
+                             schema=self.schema,
+                             calls=" and call = 'c'" if calls_only else ""),
+                         (time_slice, time_slice, start_time, end_time,
+                          time_slice, symbol_id, start_time - 1,
+                          end_time + 1))
+        return self.cur.fetchall()
+
+    def test_slices(self):
+        # Both ends included, non-calls left out, per cpu
+        self.assertEqual(sorted(self.time_slices(1, True, 100, 120, 10)),
+                         [(100, 1, 1), (100, 2, 0), (110, 1, 0),
+                          (110, 1, 2), (120, 1, 0)])
+        self.assertEqual(sorted(self.time_slices(3, False, 100, 120, 10)),
+                         [(110, 2, 1)])
+        self.assertEqual(self.time_slices(2, True, 111, 120, 10), [])
+
+    def test_full_join(self):
+        # Same rows as the query it replaced, with and without the index
+        cases = [(1, True, 100, 120, 10), (1, False, 100, 120, 10),
+                 (1, True, 99, 121, 7), (1, True, 101, 119, 1),
+                 (2, True, 0, 1000, 100), (3, False, 100, 120, 10),
+                 (4, True, 100, 120, 10)]
+        for indexed in (False, True):
+            if indexed:
+                search.build_indexes(self.conn, self.schema)
+                self.assertTrue(search.has_indexes(self.cur, self.schema))
+            for case in cases:
+                self.assertEqual(sorted(self.time_slices(*case)),
+                                 sorted(self.full_join(*case)))
+
+    def test_symbols(self):
+        self.cur.execute(search.symbols_query(self.schema), ('%memcpy%',))
+        self.assertEqual(self.cur.fetchall(),
+                         [(2, "memcpy"), (4, "memcpy_avx")])
+        self.cur.execute(search.hits_query(self.schema), ((1, 2, 4),))
+        self.assertEqual(sorted(self.cur.fetchall()), [(1, 8), (2, 1)])
+
+    def test_special_symbols(self):
+        search.special_symbols.clear()
+        self.assertEqual(search.special_symbol_id(
+                            self.cur, self.schema, search.OVERFLOW_SYMBOL), 3)
+        self.assertIsNone(search.special_symbol_id(
+                            self.cur, self.schema, search.LOST_SYMBOL))
+        # Looked up once per trace
+        self.cur.execute("DELETE FROM " + self.schema + ".symbol")
+        self.assertEqual(search.special_symbol_id(
+                            self.cur, self.schema, search.OVERFLOW_SYMBOL), 3)
+        search.special_symbols.clear()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+'''
+// Copyright (c) 2015-2019 Intel Corporation
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//      http://www.apache.org/licenses/LICENSE-2.0
+//
+// Unless required by applicable law or agreed to in writing, software
+// distributed under the License is distributed on an "AS IS" BASIS,
+// WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+// See the License for the specific language governing permissions and
+// limitations under the License.
+'''
+import unittest
+
+from dbtest import DbTestCase
+
+import tracediff
+
+DSOS = [(0, "unknown"), (1, "main")]
+
+# Two static functions named 'helper', and one the second build dropped
+BASE_SYMBOLS = [(0, 0, "unknown", 0, 0),
+                (1, 1, "helper", 0x1100, 0x1110),
+                (2, 1, "helper", 0x1200, 0x1210),
+                (3, 1, "gone", 0x1300, 0x1310)]
+BASE_INSTRUCTIONS = [(1, 0x1100, 1, 0, 4), (1, 0x1104, 2, 4, 4),
+                     (2, 0x1200, 3, 0, 4), (3, 0x1300, 4, 0, 2),
+                     (0, 0x5000, 5, 0, 1)]
+
+# Moved by 0x10000, with a third 'helper' and other symbol ids
+SYMBOLS = [(0, 0, "unknown", 0, 0),
+           (5, 1, "helper", 0x11400, 0x11410),
+           (6, 1, "helper", 0x11200, 0x11210),
+           (7, 1, "helper", 0x11100, 0x11110)]
+INSTRUCTIONS = [(7, 0x11100, 10, 0, 4), (6, 0x11200, 30, 0, 4),
+                (6, 0x11204, 40, 4, 4), (5, 0x11400, 50, 0, 4),
+                (0, 0x15000, 60, 0, 1)]
+
+
+class TraceDiffTest(DbTestCase):
+    def traces(self):
+        return (self.create_trace("test_diff_base", DSOS, BASE_SYMBOLS,
+                                  BASE_INSTRUCTIONS),
+                self.create_trace("test_diff_trace", DSOS, SYMBOLS,
+                                  INSTRUCTIONS))
+
+    def test_duplicate_names(self):
+        # Same-named symbols pair up in address order, once each
+        base_schema, schema = self.traces()
+        self.cur.execute(tracediff.diff_instructions_query(base_schema,
+                                                           schema))
+        rows = [(ip, length, int(count), dso_name)
+                for ip, length, count, dso_name in self.cur.fetchall()]
+        self.assertEqual(rows[:-2],
+                         [(0x11100, 4, 9, "main"),
+                          (0x11104, 4, -2, "main"),
+                          (0x11200, 4, 27, "main"),
+                          (0x11204, 4, 40, "main"),
+                          (0x11400, 4, 50, "main"),
+                          (0x15000, 1, 60, "unknown")])
+        # The unknown instruction is never aligned, 'gone' has no symbol
+        # to be drawn in
+        self.assertEqual(sorted(rows[-2:]),
+                         [(None, 1, -5, None), (None, 2, -4, None)])
+
+    def test_diff_heatmap(self):
+        base_schema, schema = self.traces()
+        result = tracediff.diff_heatmap(self.cur, base_schema, schema, 16)
+        self.assertEqual(result["baseOnly"], {"instructions": 2, "hits": 9})
+        raw = {}
+        for ar in result["ranges"]:
+            for pixel, (normalized, count) in ar["data"].items():
+                raw[ar["startAddressAligned"] + pixel * 16] = count
+                self.assertEqual(normalized > 0, count > 0)
+        self.assertEqual(raw, {0x11100: 7, 0x11200: 67, 0x11400: 50,
+                               0x15000: 60})
+
+
+if __name__ == '__main__':
+    unittest.main()
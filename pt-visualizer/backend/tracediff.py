@@ -0,0 +1,163 @@
+'''
+// Copyright (c) 2015-2019 Intel Corporation
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//      http://www.apache.org/licenses/LICENSE-2.0
+//
+// Unless required by applicable law or agreed to in writing, software
+// distributed under the License is distributed on an "AS IS" BASIS,
+// WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+// See the License for the specific language governing permissions and
+// limitations under the License.
+'''
+# Differences between a 'base' trace and a second one, e.g. of two builds of
+# the same program. Instructions are aligned on (dso name, symbol name,
+# sym_offset) instead of their address, which moves with ASLR and from one
+# build to the next.
+#
+# The differential heatmap is laid out at the addresses of the second trace,
+# each pixel holding its exec count minus the base one. Base instructions
+# missing from the second trace are drawn at the same offset of their symbol
+# there, those of symbols it does not have at all are only counted.
+
+import heatmap
+import postprocess
+
+# Symbol the exporter gives to instructions outside of any known symbol. Their
+# sym_offset is meaningless, so they are never aligned.
+UNKNOWN_SYMBOL_ID = 0
+
+
+def named_symbols_query(schema):
+    # Symbols sharing a name in a DSO, e.g. static functions or names
+    # truncated by the exporter, are numbered in address order
+    return ("select s.id, d.name as dso_name, s.name as symbol_name, "
+            "row_number() over (partition by d.name, s.name "
+                "order by s.sym_start, s.id) as ordinal "
+            "from " + schema + ".symbols s "
+            "left join " + schema + ".dsos d on d.id = s.dso_id")
+
+
+def same_symbol(one, two):
+    # Unknown symbols and DSOs are NULL, they still match each other
+    return ("coalesce(" + one + ".dso_name, '') = "
+            "coalesce(" + two + ".dso_name, '') and "
+            "coalesce(" + one + ".symbol_name, '') = "
+            "coalesce(" + two + ".symbol_name, '')")
+
+
+def diff_instructions_query(base_schema, schema):
+    """ Heatmap input rows (ip, length, exec count delta, dso_name) in ip
+        order. Base instructions of symbols missing from 'schema', or of no
+        symbol, come last with a NULL ip.
+
+        Symbols are matched by name first, each base symbol taking the id of
+        the symbol of 'schema' with the same DSO and name, pairing symbols
+        sharing a name in address order, so that instructions can then be
+        joined on (symbol_id, sym_offset).
+    """
+    return ("with symbol_ids as (select b.id as base_id, t.id "
+                "from (" + named_symbols_query(base_schema) + ") b "
+                "join (" + named_symbols_query(schema) + ") t on " +
+                same_symbol("t", "b") + " and t.ordinal = b.ordinal "
+                "where b.id <> " + str(UNKNOWN_SYMBOL_ID) + "), "
+            "b as (select k.id as symbol_id, i.sym_offset, i.exec_count, "
+                "octet_length(i.opcode) as length "
+                "from " + base_schema + ".instructions i "
+                "left join symbol_ids k on k.base_id = i.symbol_id), "
+            "starts as (select symbol_id, min(ip - sym_offset) as start "
+                "from " + schema + ".instructions group by 1) "
+            "select coalesce(t.ip, st.start + b.sym_offset) as ip, "
+            "coalesce(octet_length(t.opcode), b.length) as length, "
+            "coalesce(t.exec_count, 0) - coalesce(b.exec_count, 0) "
+                "as exec_count, "
+            "d.name as dso_name "
+            "from " + schema + ".instructions t "
+            "full join b on b.symbol_id = t.symbol_id "
+                "and b.sym_offset = t.sym_offset "
+            "left join starts st on t.ip is null "
+                "and st.symbol_id = b.symbol_id "
+            "left join " + schema + ".symbols s "
+                "on s.id = coalesce(t.symbol_id, b.symbol_id) "
+            "left join " + schema + ".dsos d on d.id = s.dso_id "
+            "order by 1")
+
+
+def normalize_signed(ranges, raw, offsets, log_scale=True,
+                     scale_max=heatmap.NORMALIZED_MAX):
+    """ normalize_ranges with a global maximum for signed counts: pixels
+        that got hotter are in [0, scale_max], colder ones in [-scale_max, 0]
+    """
+    if len(ranges) == 0:
+        return
+    hotter = heatmap.scale_values(raw, log_scale)
+    colder = heatmap.scale_values(-raw, log_scale)
+    scale = max(hotter.max(), colder.max())
+    normalized = heatmap.normalize_values(hotter, scale, scale_max) - \
+                 heatmap.normalize_values(colder, scale, scale_max)
+    for idx, ar in enumerate(ranges):
+        ar.data_normalized = normalized[offsets[idx]:offsets[idx + 1]]
+
+
+def diff_heatmap(cur, base_schema, schema, bytes_per_sample):
+    """ Differential heatmap, in the heatmap_result layout. Only the pixels
+        whose count changed are listed.
+    """
+    cur.execute(diff_instructions_query(base_schema, schema))
+    rows = cur.fetchall()
+    placed = next((idx for idx, row in enumerate(rows) if row[0] is None),
+                  len(rows))
+    columns = heatmap.columns_from_rows(rows[:placed])
+    ranges, range_ids = heatmap.split_ranges(columns)
+    raw, offsets = heatmap.bin_ranges(ranges, range_ids, columns,
+                                      bytes_per_sample)
+    normalize_signed(ranges, raw, offsets)
+    result = heatmap.heatmap_result(bytes_per_sample, ranges)
+    removed = rows[placed:]
+    result["baseOnly"] = {"instructions": len(removed),
+                          "hits": -sum([int(row[2]) for row in removed])}
+    return result
+
+
+def wss_symbols_source(cur, schema):
+    """ The wss_symbols rollup of a trace, or the same rows computed from
+        its instructions when it was imported without one
+    """
+    if postprocess.has_table(cur, schema, postprocess.WSS_SYMBOLS):
+        return schema + "." + postprocess.WSS_SYMBOLS
+    return ("(select d.name as dso_name, s.name as symbol_name, "
+            "sum(octet_length(i.opcode)) as wss, "
+            "sum(i.exec_count) as hits "
+            "from " + schema + ".instructions i "
+            "left join " + schema + ".symbols s on s.id = i.symbol_id "
+            "left join " + schema + ".dsos d on d.id = s.dso_id "
+            "group by 1, 2)")
+
+
+def symbol_deltas(cur, base_schema, schema):
+    """ WSS and hits of every symbol in both traces, biggest hit changes
+        first
+    """
+    cur.execute("select coalesce(t.dso_name, b.dso_name), "
+                "coalesce(t.symbol_name, b.symbol_name), "
+                "coalesce(b.wss, 0), coalesce(t.wss, 0), "
+                "coalesce(b.hits, 0), coalesce(t.hits, 0) "
+                "from " + wss_symbols_source(cur, base_schema) + " b "
+                "full join " + wss_symbols_source(cur, schema) + " t on " +
+                same_symbol("t", "b") +
+                " order by abs(coalesce(t.hits, 0) - coalesce(b.hits, 0)) "
+                "desc, abs(coalesce(t.wss, 0) - coalesce(b.wss, 0)) desc")
+    symbols = [{"dso": dso_name,
+                "symbol": symbol_name,
+                "wss": [int(base_wss), int(wss)],
+                "hits": [int(base_hits), int(hits)]}
+               for dso_name, symbol_name, base_wss, wss, base_hits, hits
+               in cur.fetchall()]
+    return {"wss": [sum([sym["wss"][side] for sym in symbols])
+                    for side in (0, 1)],
+            "hits": [sum([sym["hits"][side] for sym in symbols])
+                     for side in (0, 1)],
+            "symbols": symbols}
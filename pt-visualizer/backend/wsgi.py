@@ -0,0 +1,33 @@
+'''
+// Copyright (c) 2015-2019 Intel Corporation
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//      http://www.apache.org/licenses/LICENSE-2.0
+//
+// Unless required by applicable law or agreed to in writing, software
+// distributed under the License is distributed on an "AS IS" BASIS,
+// WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+// See the License for the specific language governing permissions and
+// limitations under the License.
+'''
+# WSGI entry point of the backend for production servers, e.g.
+#
+#   $ gunicorn --chdir pt-visualizer/backend -w 8 --threads 4 wsgi:application
+#
+# (see startserv in pt-vis.sh). Static web UI files are answered by
+# WhiteNoise before they reach Flask, with caching headers and without
+# going through the request routing.
+
+import os
+import imp
+
+from whitenoise import WhiteNoise
+
+backend = imp.load_source('sat_backend', os.path.join(
+                os.path.dirname(os.path.abspath(__file__)), 'sat-backend.py'))
+app = backend.app
+
+application = WhiteNoise(app, root=app.static_folder, index_file=True)
@@ -6,10 +6,10 @@
     .directive('blazeMap', blazeMap);
 
   blazeMap.$inject = ['$http', '$compile', '$rootScope', '$routeParams',
-                      'blazeMapUtils', '$sce'];
+                      'blazeMapUtils', '$sce', 'backendJobs'];
 
   function blazeMap($http, $compile, $rootScope, $routeParams,
-                    bmUtils, sce) {
+                    bmUtils, sce, backendJobs) {
     return {
       templateUrl : 'views/blazemap.html',
       restrict: 'E',
@@ -1175,20 +1175,22 @@
         blazeMap.onRangeSelected(null);
         blazeMap.setStatusInfo('<b>Loading...</b>');
         disableInputEvents();
-        $http(
+        backendJobs.run(
+          '/api/1/jobs/heatmap/' + $routeParams.traceID + '/' + bytesPerSample,
           {
             method: 'GET',
             url: '/api/1/heatmap/' + $routeParams.traceID +
-                 '/full/' + bytesPerSample
+                 '/full/' + bytesPerSample,
+            params: { format: 'binary' },
+            responseType: 'arraybuffer'
           })
-          .success(function(respdata/*, status, headers, config*/) {
+          .then(function(respdata) {
             scope.heatmapLoading = false;
             blazeMap.setStatusInfo('');
-            blazeMap.updateData(respdata);
+            blazeMap.updateData(bmUtils.decodeBinaryHeatmap(respdata));
             enableInputEvents();
-          })
-          .error(function(data, status, headers, config) {
-            console.log('Error retrieving full heatmap: ', status);
+          }, function(response) {
+            console.log('Error retrieving full heatmap: ', response.status);
         });
       };
 
@@ -6,9 +6,10 @@
       .directive('transitionGraph', transitionGraph);
 
     transitionGraph.$inject = ['$http', '$compile', '$rootScope',
-                               '$routeParams', '$sce'];
+                               '$routeParams', '$sce', 'backendJobs'];
 
-    function transitionGraph($http, $compile, $rootScope, $routeParams, sce) {
+    function transitionGraph($http, $compile, $rootScope, $routeParams, sce,
+                             backendJobs) {
       return {
         templateUrl : 'views/transitionGraph.html',
         restrict: 'E',
@@ -164,7 +165,7 @@
               $http(
                 {
                   method: 'GET',
-                  url: '/api/1/alldsos/' + $routeParams.traceID
+                  url: '/api/1/dsomatrix/' + $routeParams.traceID
                 })
                 .success(function(respdata/*, status, headers, config*/) {
                   self.onLoadDSOsData(respdata);
@@ -553,18 +554,19 @@
             this.getTransitionGraph = function(leftDSO, rightDSO) {
               var self = this;
               scope.dsosLoading = true;
-              $http(
+              backendJobs.run(
+                '/api/1/jobs/dsotransitions/' + $routeParams.traceID +
+                '/' + leftDSO.id + '/' + rightDSO.id,
                 {
                   method: 'GET',
                   url: '/api/1/dsotransitions/' + $routeParams.traceID +
                        '/' + leftDSO.id + '/' + rightDSO.id
                 })
-                .success(function(respdata/*, status, headers, config*/) {
+                .then(function(respdata) {
                   self.onLoadTransitionGraph(respdata);
-                })
-                .error(function(data, status, headers, config) {
+                }, function(response) {
                   scope.dsosLoading = false;
-                  console.log('Error retrieving dso info: ', status);
+                  console.log('Error retrieving dso info: ', response.status);
               });
             };
 
@@ -584,10 +586,29 @@
                 }
             };
 
-            this.onLoadDSOsData = function(data) {
+            this.onLoadDSOsData = function(matrix) {
+              // Calls to and from other DSOs, shown next to the DSO names when
+              // the trace has them
+              var calls = {};
+              matrix.transitions.forEach(function(transition) {
+                if (transition[0] !== transition[1]) {
+                  calls[transition[0]] = (calls[transition[0]] || 0) +
+                                         transition[2];
+                  calls[transition[1]] = (calls[transition[1]] || 0) +
+                                         transition[2];
+                }
+              });
+              var data = matrix.dsos.map(function(dso) {
+                dso.calls = calls[dso.id] || 0;
+                dso.label = matrix.source === null ? dso.name :
+                            dso.name + ' (' + dso.calls + ' ' +
+                            matrix.source + ')';
+                return dso;
+              });
               data.unshift({
                 id: -1,
-                name: 'None'
+                name: 'None',
+                label: 'None'
               });
               scope.dsosLoading = false;
               scope.availableDSOs = data;
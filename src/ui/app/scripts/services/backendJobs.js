@@ -0,0 +1,79 @@
+/*
+// Copyright (c) 2018-2019 Intel Corporation
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//      http://www.apache.org/licenses/LICENSE-2.0
+//
+// Unless required by applicable law or agreed to in writing, software
+// distributed under the License is distributed on an "AS IS" BASIS,
+// WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+// See the License for the specific language governing permissions and
+// limitations under the License.
+*/
+
+(function () {
+
+  'use strict';
+
+  angular
+    .module('satt')
+    .factory('backendJobs', backendJobs);
+
+    backendJobs.$inject = ['$http', '$q', '$timeout'];
+
+  // Heavy requests run as background jobs of the backend (see jobs.py): the
+  // job is submitted, polled until it is finished and its result fetched.
+  // When the backend has no job workers the request is sent as is.
+  function backendJobs($http, $q, $timeout) {
+    var pollInterval = 500;
+
+    return {
+      // 'jobUrl' submits the job, 'request' is the $http config of the
+      // matching synchronous request, whose params and responseType also
+      // apply to the job. Resolves to the response data.
+      run: function(jobUrl, request) {
+        var deferred = $q.defer();
+
+        var resolve = function(response) {
+          deferred.resolve(response.data);
+        };
+
+        var reject = function(response) {
+          deferred.reject(response);
+        };
+
+        var poll = function(job) {
+          if (job.status === 'finished') {
+            $http(angular.extend({}, request, {
+              method: 'GET',
+              url: job.result
+            })).then(resolve, reject);
+            return;
+          }
+          $timeout(function() {
+            $http({ method: 'GET', url: job.poll })
+              .then(function(response) {
+                poll(response.data);
+              }, reject);
+          }, pollInterval);
+        };
+
+        $http({ method: 'POST', url: jobUrl, params: request.params })
+          .then(function(response) {
+            poll(response.data);
+          }, function(response) {
+            // 501 without Redis, 5xx when it cannot be reached
+            if (response.status >= 500) {
+              $http(request).then(resolve, reject);
+            } else {
+              reject(response);
+            }
+          });
+        return deferred.promise;
+      }
+    };
+  }
+})();
@@ -233,6 +233,43 @@
 
       clampValue: function(value, min, max) {
         return (value < min) ? min : (value > max) ? max : value;
+      },
+
+      // Decodes a heatmap sent with ?format=binary into the same object as
+      // the JSON response. Arrays are little-endian and 4-byte aligned, so
+      // they are mapped directly as typed arrays (x86 hosts are little-endian)
+      decodeBinaryHeatmap: function(buffer) {
+        var view = new DataView(buffer);
+        if (String.fromCharCode(view.getUint8(0), view.getUint8(1),
+                                view.getUint8(2), view.getUint8(3)) !==
+            'PTHM') {
+          throw new Error('Invalid binary heatmap');
+        }
+        var headerLength = view.getUint32(4, true);
+        // The header is plain ASCII, the server escapes any other character
+        var headerBytes = new Uint8Array(buffer, 8, headerLength);
+        var headerText = '';
+        for (var chr = 0; chr < headerLength; chr += 4096) {
+          headerText += String.fromCharCode.apply(null,
+                          headerBytes.subarray(chr, chr + 4096));
+        }
+        var result = JSON.parse(headerText);
+        var offset = 8 + headerLength;
+        result.ranges.forEach(function(range) {
+          var count = range.count;
+          var pixels = new Uint32Array(buffer, offset, count);
+          offset += count << 2;
+          var raw = new Uint32Array(buffer, offset, count);
+          offset += count << 2;
+          var normalized = new Uint16Array(buffer, offset, count);
+          offset += ((count << 1) + 3) & ~3;
+          range.data = {};
+          for (var idx = 0; idx < count; ++idx) {
+            range.data[pixels[idx]] = [normalized[idx], raw[idx]];
+          }
+          delete range.count;
+        });
+        return result;
       }
     };
   }
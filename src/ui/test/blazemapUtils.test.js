@@ -0,0 +1,113 @@
+/*
+// Copyright (c) 2018-2019 Intel Corporation
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//      http://www.apache.org/licenses/LICENSE-2.0
+//
+// Unless required by applicable law or agreed to in writing, software
+// distributed under the License is distributed on an "AS IS" BASIS,
+// WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+// See the License for the specific language governing permissions and
+// limitations under the License.
+*/
+
+// Tests of the blazeMapUtils service outside of the browser, run with
+//
+//   $ npm test
+//
+// The fixtures are written by the backend's heatmap tests
+// (pt-visualizer/backend/tests/test_heatmap.py), from the same trace.
+
+'use strict';
+
+var assert = require('assert');
+var fs = require('fs');
+var path = require('path');
+var vm = require('vm');
+
+function loadService(file, name) {
+  var factories = {};
+  var angular = {
+    module: function() {
+      return {
+        factory: function(factoryName, factory) {
+          factories[factoryName] = factory;
+          return this;
+        }
+      };
+    }
+  };
+  var source = fs.readFileSync(path.join(__dirname, '..', 'app', 'scripts',
+                                         file), 'utf8');
+  vm.runInNewContext(source, { angular: angular }, { filename: file });
+  return factories[name]({});
+}
+
+function fixture(name) {
+  return fs.readFileSync(path.join(__dirname, 'fixtures', name));
+}
+
+function arrayBuffer(buffer) {
+  return buffer.buffer.slice(buffer.byteOffset,
+                             buffer.byteOffset + buffer.length);
+}
+
+// Objects of the service's context compared as plain data
+function plain(value) {
+  return JSON.parse(JSON.stringify(value));
+}
+
+var bmUtils = loadService('services/blazemapUtils.js', 'blazeMapUtils');
+
+var tests = {
+  'decodes the same heatmap as the JSON response': function() {
+    var decoded = bmUtils.decodeBinaryHeatmap(
+                    arrayBuffer(fixture('heatmap.bin')));
+    assert.deepStrictEqual(plain(decoded),
+                           JSON.parse(fixture('heatmap.json')));
+  },
+
+  'decodes the escaped DSO names of the header': function() {
+    var decoded = bmUtils.decodeBinaryHeatmap(
+                    arrayBuffer(fixture('heatmap.bin')));
+    assert.deepStrictEqual(plain(decoded.ranges.map(function(range) {
+      return range.dsoName;
+    })), ['main', 'libcaf\u00e9.so', 'libc.so.6']);
+  },
+
+  'decodes a heatmap without ranges': function() {
+    var header = '{"bytesPerSample": 64, "wss": 0, "ranges": []}';
+    while (header.length % 4) {
+      header += ' ';
+    }
+    var buffer = Buffer.alloc(8 + header.length);
+    buffer.write('PTHM', 0, 'ascii');
+    buffer.writeUInt32LE(header.length, 4);
+    buffer.write(header, 8, 'ascii');
+    assert.deepStrictEqual(plain(bmUtils.decodeBinaryHeatmap(
+                                   arrayBuffer(buffer))),
+                           { bytesPerSample: 64, wss: 0, ranges: [] });
+  },
+
+  'rejects other responses': function() {
+    var buffer = Buffer.from('{"bytesPerSample": 64}', 'ascii');
+    assert.throws(function() {
+      bmUtils.decodeBinaryHeatmap(arrayBuffer(buffer));
+    }, /Invalid binary heatmap/);
+  }
+};
+
+var failed = 0;
+Object.keys(tests).forEach(function(name) {
+  try {
+    tests[name]();
+    console.log('ok - ' + name);
+  } catch (e) {
+    failed += 1;
+    console.log('not ok - ' + name + '\n' + e.stack);
+  }
+});
+process.exit(failed ? 1 : 0);
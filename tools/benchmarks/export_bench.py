@@ -0,0 +1,121 @@
+# export_bench.py: micro-benchmark of the export-to-postgresql.py row encoding
+# Copyright (c) 2014-2019, Intel Corporation.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms and conditions of the GNU General Public License,
+# version 2, as published by the Free Software Foundation.
+#
+# This program is distributed in the hope it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# Compares the former per-row struct.pack + file.write encoding with the
+# buffered pgcopy encoding, in rows per second, and checks that both write
+# the same bytes.
+#
+#	$ python export_bench.py --rows 2000000
+
+import os
+import sys
+import time
+import struct
+import argparse
+import tempfile
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.realpath(os.path.join(dir_path, '..')))
+
+import pgcopy
+
+def legacy_sample(file, sample_id, cpu, time, instr_id, tid):
+	fmt = "!hiiihiqiiii"
+	value = struct.pack(fmt, 5, 4, sample_id, 2, cpu, 8, time, 4, instr_id, 4, tid)
+	file.write(value)
+
+def legacy_symbol(file, symbol_id, dso_id, sym_start, sym_end, symbol_name):
+	n = len(symbol_name)
+	fmt = "!hiiihi" + str(n) + "s" + "iqiq"
+	value = struct.pack(fmt, 5, 4, symbol_id, 2, dso_id, n, symbol_name, 8, sym_start, 8, sym_end)
+	file.write(value)
+
+def legacy_call(file, cr_id, call_path_id, call_time, return_time, branch_count, call_id, return_id, parent_call_path_id, flags):
+	fmt = "!hiiiiiqiqiiiiiiiiii"
+	value = struct.pack(fmt, 9, 4, cr_id, 4, call_path_id, 8, call_time, 8, return_time, 4, branch_count, 4, call_id, 4, return_id, 4, parent_call_path_id, 4, flags)
+	file.write(value)
+
+sample_pack = pgcopy.SAMPLE.pack
+call_pack = pgcopy.CALL.pack
+flush_rows = pgcopy.FLUSH_ROWS
+
+def batched_sample(file, sample_id, cpu, time, instr_id, tid):
+	file.rows.append(sample_pack(5, 4, sample_id, 2, cpu, 8, time, 4, instr_id, 4, tid))
+	if len(file.rows) >= flush_rows:
+		file.flush()
+
+def batched_symbol(file, symbol_id, dso_id, sym_start, sym_end, symbol_name):
+	file.write_parts(pgcopy.SYMBOL_PREFIX.pack(5, 4, symbol_id, 2, dso_id, len(symbol_name)),
+			 symbol_name,
+			 pgcopy.SYMBOL_SUFFIX.pack(8, sym_start, 8, sym_end))
+
+def batched_call(file, cr_id, call_path_id, call_time, return_time, branch_count, call_id, return_id, parent_call_path_id, flags):
+	file.rows.append(call_pack(9, 4, cr_id, 4, call_path_id, 8, call_time, 8, return_time, 4, branch_count, 4, call_id, 4, return_id, 4, parent_call_path_id, 4, flags))
+	if len(file.rows) >= flush_rows:
+		file.flush()
+
+def sample_rows(rows):
+	for i in xrange(rows):
+		yield (i, i & 7, 1000000 + i, i >> 3, 4242)
+
+def symbol_rows(rows):
+	for i in xrange(rows):
+		yield (i, i & 15, 0x400000 + i * 64, 0x400000 + i * 64 + 63, "HPHP::symbol_%d" % i)
+
+def call_rows(rows):
+	for i in xrange(rows):
+		yield (i, i >> 2, 1000 + i, 2000 + i, i & 255, i, i + 1, i >> 3, 0)
+
+def run(writer, encode, rows):
+	out = tempfile.TemporaryFile()
+	file = writer(out)
+	start = time.time()
+	for row in rows:
+		encode(file, *row)
+	file.flush()
+	elapsed = time.time() - start
+	out.seek(0)
+	data = out.read()
+	out.close()
+	return elapsed, data
+
+class PlainWriter(object):
+	def __init__(self, file):
+		self.file = file
+
+	def write(self, data):
+		self.file.write(data)
+
+	def flush(self):
+		self.file.flush()
+
+def main():
+	parser = argparse.ArgumentParser(description="Exporter encoding benchmark")
+	parser.add_argument("--rows", type=int, default=2000000)
+	args = parser.parse_args()
+
+	tables = [
+		("samples", sample_rows, legacy_sample, batched_sample),
+		("symbols", symbol_rows, legacy_symbol, batched_symbol),
+		("calls", call_rows, legacy_call, batched_call),
+	]
+	print "%-10s %14s %14s %8s" % ("table", "before rows/s", "after rows/s", "speedup")
+	for name, rows, legacy, batched in tables:
+		before, legacy_data = run(PlainWriter, legacy, rows(args.rows))
+		after, batched_data = run(pgcopy.CopyWriter, batched, rows(args.rows))
+		if legacy_data != batched_data:
+			print "MISMATCH in encoded %s rows" % name
+			sys.exit(1)
+		print "%-10s %14.0f %14.0f %7.2fx" % (name, args.rows / before, args.rows / after, before / after)
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,109 @@
+'''
+// Copyright (c) 2015-2019 Intel Corporation
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//      http://www.apache.org/licenses/LICENSE-2.0
+//
+// Unless required by applicable law or agreed to in writing, software
+// distributed under the License is distributed on an "AS IS" BASIS,
+// WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+// See the License for the specific language governing permissions and
+// limitations under the License.
+'''
+# Compares the per-sample heatmap binning that memheatmap_full used to do
+# (kept in pt-visualizer/backend/tests/memheatmap_baseline.py) with the
+# array-backed engine in pt-visualizer/backend/heatmap.py, on a synthetic
+# ip-sorted trace.
+#
+#   $ python heatmap_bench.py --instructions 10000000 --bytes-per-sample 64
+#
+# Use --verify on small traces to check that both produce the same ranges.
+
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+dir_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.realpath(os.path.join(dir_path, '..', '..',
+                'pt-visualizer', 'backend')))
+sys.path.append(os.path.realpath(os.path.join(dir_path, '..', '..',
+                'pt-visualizer', 'backend', 'tests')))
+
+import heatmap
+import memheatmap_baseline
+
+DSOS = ["hhvm", "hhvm-jitted.so", "libc.so.6", "libstdc++.so.6",
+        "libpthread.so.0", "libz.so.1", "libpcre.so.3", "hhvm-pcre.so"]
+
+
+def make_trace(instructions, seed):
+    rnd = np.random.RandomState(seed)
+    lengths = rnd.randint(1, 16, size=instructions).astype(np.int64)
+    counts = rnd.geometric(0.01, size=instructions).astype(np.int64)
+    # Give each DSO its own region, with occasional big holes to force slices
+    dso_ids = np.sort(rnd.randint(0, len(DSOS), size=instructions))
+    gaps = rnd.randint(0, 64, size=instructions).astype(np.int64)
+    holes = rnd.random_sample(instructions) < 1e-5
+    gaps[holes] += 256 * 1024 * 1024
+    ips = np.cumsum(lengths + gaps)
+    ips += dso_ids.astype(np.int64) << 36
+    return heatmap.Columns(ips, lengths, counts,
+                           [DSOS[idx] for idx in dso_ids.tolist()])
+
+
+def comparable(result):
+    # Ranges with the same aligned start used to come in dict order
+    return (result["wss"],
+            sorted([(r["startAddressAligned"], r["dsoName"], r["startAddress"],
+                     r["endAddress"], r["wss"],
+                     sorted((k, list(v)) for k, v in r["data"].items()))
+                    for r in result["ranges"]]))
+
+
+def timed(func, *args):
+    start = time.time()
+    result = func(*args)
+    return result, time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Heatmap binning benchmark")
+    parser.add_argument("--instructions", type=int, default=10000000)
+    parser.add_argument("--bytes-per-sample", type=int, default=64)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--skip-legacy", action="store_true",
+                        help="only time the array-backed engine")
+    parser.add_argument("--verify", action="store_true",
+                        help="check that both engines return the same data")
+    args = parser.parse_args()
+
+    print "Generating %d synthetic instructions..." % args.instructions
+    columns = make_trace(args.instructions, args.seed)
+
+    result, elapsed = timed(heatmap.build_heatmap, columns,
+                            args.bytes_per_sample)
+    print "array engine:  %8.2fs  (%d ranges)" % (elapsed,
+                                                  len(result["ranges"]))
+    if args.skip_legacy:
+        return
+
+    rows = zip(columns.ips.tolist(), columns.lengths.tolist(),
+               columns.counts.tolist(), columns.dso_names)
+    legacy, legacy_elapsed = timed(memheatmap_baseline.memheatmap_full, rows,
+                                   args.bytes_per_sample)
+    print "legacy engine: %8.2fs  (%d ranges)" % (legacy_elapsed,
+                                                  len(legacy["ranges"]))
+    print "speedup:       %8.1fx" % (legacy_elapsed / max(elapsed, 1e-9))
+    if args.verify:
+        if comparable(result) != comparable(legacy):
+            print "MISMATCH between legacy and array engine results"
+            sys.exit(1)
+        print "results match"
+
+if __name__ == '__main__':
+    main()
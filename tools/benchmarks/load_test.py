@@ -0,0 +1,110 @@
+'''
+// Copyright (c) 2015-2019 Intel Corporation
+//
+// Licensed under the Apache License, Version 2.0 (the "License");
+// you may not use this file except in compliance with the License.
+// You may obtain a copy of the License at
+//
+//      http://www.apache.org/licenses/LICENSE-2.0
+//
+// Unless required by applicable law or agreed to in writing, software
+// distributed under the License is distributed on an "AS IS" BASIS,
+// WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+// See the License for the specific language governing permissions and
+// limitations under the License.
+'''
+# Load test of a running backend: sends the same request from an increasing
+# number of concurrent clients and reports throughput and latency for each
+# level, e.g. to compare the Flask debug server with the gunicorn one.
+#
+#   $ ./pt-vis.sh --serv
+#   $ python load_test.py --trace 1 --concurrency 1,2,4,8,16
+#
+# By default the full heatmap is requested with a bytes-per-sample value
+# that is not a pyramid level, so every request is computed from scratch.
+
+import sys
+import time
+import argparse
+import threading
+import urllib2
+
+
+def fetch(url):
+    start = time.time()
+    response = urllib2.urlopen(url)
+    size = len(response.read())
+    return time.time() - start, size
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def run_level(url, clients, requests_per_client):
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def client():
+        for idx in range(requests_per_client):
+            try:
+                elapsed, size = fetch(url)
+            except Exception as e:
+                with lock:
+                    errors.append(e)
+                continue
+            with lock:
+                latencies.append(elapsed)
+
+    threads = [threading.Thread(target=client) for idx in range(clients)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.time() - start, latencies, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backend load test")
+    parser.add_argument("--server", default="http://127.0.0.1:5005")
+    parser.add_argument("--trace", type=int, default=1)
+    parser.add_argument("--bytes-per-sample", type=int, default=48)
+    parser.add_argument("--path", help="request this path instead of "
+                        "the full heatmap")
+    parser.add_argument("--concurrency", default="1,2,4,8",
+                        help="comma separated client counts")
+    parser.add_argument("--requests", type=int, default=4,
+                        help="requests sent by every client")
+    args = parser.parse_args()
+
+    path = args.path or "/api/1/heatmap/%d/full/%d?format=binary" % \
+                        (args.trace, args.bytes_per_sample)
+    url = args.server + path
+    print "Requesting", url
+    # Warm up caches and connections before measuring
+    fetch(url)
+
+    print "%8s %10s %10s %10s %10s %7s" % ("clients", "req/s", "p50 s",
+                                           "p95 s", "max s", "errors")
+    baseline = None
+    for clients in [int(c) for c in args.concurrency.split(",")]:
+        elapsed, latencies, errors = run_level(url, clients, args.requests)
+        if not latencies:
+            print "%8d %10s %10s %10s %10s %7d" % (clients, "-", "-", "-",
+                                                   "-", len(errors))
+            continue
+        rate = len(latencies) / elapsed
+        if baseline is None:
+            baseline = rate
+        print "%8d %10.2f %10.3f %10.3f %10.3f %7d   (%.1fx)" % (
+                clients, rate, percentile(latencies, 0.5),
+                percentile(latencies, 0.95), max(latencies), len(errors),
+                rate / baseline)
+        if errors:
+            print >> sys.stderr, "  first error:", errors[0]
+
+if __name__ == '__main__':
+    main()
@@ -12,7 +12,6 @@
 
 import os
 import sys
-import struct
 import datetime
 import multiprocessing
 import platform
@@ -53,6 +52,25 @@ import re
 #	2015-05-29 12:49:28.655683 Adding foreign keys
 #	2015-05-29 12:49:29.365350 Done
 #
+# With the 'stream' option no intermediate files are written.  A COPY FROM STDIN session is
+# opened for every table before the first event and rows are sent to it while perf is still
+# decoding, through a small in-memory queue per table:
+#
+#	$ perf script -s ~/libexec/perf-core/scripts/python/export-to-postgresql.py pt_example branches calls stream
+#
+# The 'heatmap-only' option leaves 'samples' empty.  Every branch sample then only updates
+# the per-ip counts in 'instructions' and the 'branch_transitions' counts, which is all the
+# visualizer's heatmap, WSS and symbol views need.  It cannot be combined with 'calls' or
+# 'callchains', whose rows refer to samples.
+#
+# The 'windows=<n>' option (n up to 32768) also splits every instruction's exec count over n
+# equal time windows of the trace, stored in 'instruction_windows' and 'time_windows', so the
+# visualizer can show the heatmap of a time range without reading 'samples'.
+#
+# The 'breakdown' option also counts executions per (instruction, thread) and per
+# (instruction, cpu) in 'instruction_threads' and 'instruction_cpus', for heatmaps of
+# selected threads or cpus.
+#
 # To browse the database, psql can be used e.g.
 #
 #	$ psql pt_example
@@ -115,6 +133,41 @@ import re
 #
 #		'threads' contains a record for each thread.
 #
+#	branch_transitions
+#
+#		'branch_transitions' counts the branch samples per (from_symbol_id, to_symbol_id) pair.
+#		'dso_transitions_view' sums them per pair of DSOs, which the visualizer's transition
+#		graph lists next to the DSO names of traces exported without 'calls'.
+#
+#	call_transitions
+#
+#		'call_transitions' counts the calls per (from_dso, to_dso, from_symbol_id, to_symbol_id),
+#		from the caller's symbol to the callee's, with an index on the DSO pair.  It is only
+#		created when the 'calls' option to this script is specified.
+#
+#	wss_symbols, wss_dsos
+#
+#		'wss_symbols' holds the working set size (total opcode bytes), summed exec counts and
+#		number of instructions per (dso_name, symbol_name), and 'wss_dsos' the same per dso_name.
+#
+#	instruction_windows, time_windows
+#
+#		'instruction_windows' holds the non-zero exec counts per (instruction_id, window_id) and
+#		'time_windows' the first and last timestamp of each window.  They are only created when
+#		the 'windows=<n>' option to this script is specified.
+#
+#	instruction_threads, instruction_cpus
+#
+#		'instruction_threads' and 'instruction_cpus' hold the non-zero exec counts per
+#		(instruction_id, thread_id) and per (instruction_id, cpu_id).  They are only created
+#		when the 'breakdown' option to this script is specified.
+#
+#	instructions_flat
+#
+#		'instructions_flat' is a denormalized copy of 'instructions_view' with indexes on 'ip' and
+#		'dso_name'.  It is only created when the 'materialize' option to this script is specified,
+#		and is then used by the visualizer backend instead of 'instructions_view'.
+#
 # Views:
 #
 #	Most of the tables have views for more friendly display.  The views are:
@@ -202,25 +255,6 @@ import re
 
 from PySide.QtSql import *
 
-# Need to access PostgreSQL C library directly to use COPY FROM STDIN
-from ctypes import *
-libpq = CDLL("libpq.so.5")
-PQconnectdb = libpq.PQconnectdb
-PQconnectdb.restype = c_void_p
-PQfinish = libpq.PQfinish
-PQfinish.argtypes = [c_void_p]
-PQstatus = libpq.PQstatus
-PQstatus.argtypes = [c_void_p]
-PQexec = libpq.PQexec
-PQexec.restype = c_void_p
-PQexec.argtypes = [c_void_p, c_char_p]
-PQresultStatus = libpq.PQresultStatus
-PQresultStatus.argtypes = [c_void_p]
-PQputCopyData = libpq.PQputCopyData
-PQputCopyData.argtypes = [ c_void_p, c_void_p, c_int ]
-PQputCopyEnd = libpq.PQputCopyEnd
-PQputCopyEnd.argtypes = [ c_void_p, c_void_p ]
-
 dir_path = os.path.dirname(os.path.realpath(__file__))
 
 sys.path.append(os.environ['PERF_EXEC_PATH'] + \
@@ -228,7 +262,13 @@ sys.path.append(os.environ['PERF_EXEC_PATH'] + \
 sys.path.append(os.path.realpath(os.path.join(dir_path, '..',
 				'pt-visualizer', 'backend')))
 
+sys.path.append(dir_path)
+
 import status
+import postprocess
+import pgcopy
+import ipstore
+import pgload
 
 # These perf imports are not used at present
 #from perf_trace_context import *
@@ -238,9 +278,14 @@ perf_db_export_mode = True
 perf_db_export_calls = False
 perf_db_export_callchains = False
 perf_collapse_jit_dsos = False
+perf_db_export_materialize = False
+perf_db_export_stream = False
+perf_db_export_heatmap_only = False
+perf_db_export_windows = 0
+perf_db_export_breakdown = False
 
 def usage():
-	print >> sys.stderr, "Usage is: export-to-postgresql.py <database name> [collapse-jit-dsos]  [all/branches] [calls]"
+	print >> sys.stderr, "Usage is: export-to-postgresql.py <database name> [collapse-jit-dsos]  [all/branches] [calls] [materialize] [stream] [heatmap-only] [windows=<n>] [breakdown]"
 	raise Exception("Wrong usage")
 
 if (len(sys.argv) < 2):
@@ -267,9 +312,28 @@ for i in range(4,len(sys.argv)):
 		perf_db_export_calls = True
 	elif (sys.argv[i] == "callchains"):
 		perf_db_export_callchains = True
+	elif (sys.argv[i] == "materialize"):
+		perf_db_export_materialize = True
+	elif (sys.argv[i] == "stream"):
+		perf_db_export_stream = True
+	elif (sys.argv[i] == "heatmap-only"):
+		perf_db_export_heatmap_only = True
+	elif (sys.argv[i].startswith("windows=")):
+		try:
+			perf_db_export_windows = int(sys.argv[i][len("windows="):])
+		except ValueError:
+			usage()
+		if perf_db_export_windows < 1 or perf_db_export_windows > 32768:
+			usage()
+	elif (sys.argv[i] == "breakdown"):
+		perf_db_export_breakdown = True
 	else:
 		usage()
 
+# calls and call paths refer to the sample rows that heatmap-only leaves out
+if perf_db_export_heatmap_only and (perf_db_export_calls or perf_db_export_callchains):
+	usage()
+
 conf = status.getStatus()
 dbname = conf.getDbConfig('dbname')
 dbuser = conf.getDbConfig('user')
@@ -306,12 +370,14 @@ else:
 dbschema = "pt" + str(schema_id)
 
 output_dir_name = os.getcwd() + "/" + dbschema + "-perf-data"
-os.mkdir(output_dir_name)
+if not perf_db_export_stream:
+	os.mkdir(output_dir_name)
 
 try:
     do_query(query, 'CREATE SCHEMA ' + dbschema)
 except:
-    os.rmdir(output_dir_name)
+    if not perf_db_export_stream:
+        os.rmdir(output_dir_name)
     raise
 
 do_query(query, 'SET search_path TO ' + dbschema)
@@ -342,6 +408,28 @@ do_query(query, 'CREATE TABLE samples ('
 		'time			bigint,'
 		'instruction_id	integer,'
 		'thread_id		integer)')
+do_query(query, 'CREATE TABLE branch_transitions ('
+		'from_symbol_id	integer		NOT NULL,'
+		'to_symbol_id	integer		NOT NULL,'
+		'count		bigint)')
+if perf_db_export_windows:
+	do_query(query, 'CREATE TABLE instruction_windows ('
+		'instruction_id	integer		NOT NULL,'
+		'window_id	smallint	NOT NULL,'
+		'exec_count	integer)')
+	do_query(query, 'CREATE TABLE time_windows ('
+		'id		smallint	NOT NULL,'
+		'start_time	bigint,'
+		'end_time	bigint)')
+if perf_db_export_breakdown:
+	do_query(query, 'CREATE TABLE instruction_threads ('
+		'instruction_id	integer		NOT NULL,'
+		'thread_id	integer		NOT NULL,'
+		'exec_count	integer)')
+	do_query(query, 'CREATE TABLE instruction_cpus ('
+		'instruction_id	integer		NOT NULL,'
+		'cpu_id		smallint	NOT NULL,'
+		'exec_count	integer)')
 if perf_db_export_calls or perf_db_export_callchains:
 	do_query(query, 'CREATE TABLE call_paths ('
 		'id             integer         NOT NULL,'
@@ -378,6 +466,15 @@ do_query(query, 'CREATE VIEW samples_view AS '
 	' FROM samples'
 	' LEFT JOIN instructions '
 		'ON instructions.id = samples.instruction_id')
+do_query(query, 'CREATE VIEW dso_transitions_view AS '
+	'SELECT '
+		'f.dso_id AS from_dso_id,'
+		't.dso_id AS to_dso_id,'
+		'sum(b.count) AS count'
+	' FROM branch_transitions b'
+	' INNER JOIN symbols f ON f.id = b.from_symbol_id'
+	' INNER JOIN symbols t ON t.id = b.to_symbol_id'
+	' GROUP BY f.dso_id, t.dso_id')
 do_query(query, 'CREATE VIEW instructions_view AS '
 	'SELECT '
 		'instructions.id,'
@@ -426,12 +523,19 @@ if perf_db_export_calls:
 		' FROM calls INNER JOIN call_paths ON call_paths.id = call_path_id')
 
 
-file_header = struct.pack("!11sii", "PGCOPY\n\377\r\n\0", 0, 0)
-file_trailer = "\377\377"
+file_header = pgcopy.file_header
+file_trailer = pgcopy.file_trailer
+
+conninfo = "dbname = " + dbname + " user = " + dbuser + " password = " + dbpass
+# Tables are loaded, and then keyed and indexed, over this many connections at once
+load_workers = cpu_count
 
-def open_output_file(file_name):
-	path_name = output_dir_name + "/" + file_name
-	file = open(path_name, "w+")
+def open_output_file(file_name, table_name):
+	if perf_db_export_stream:
+		file = pgcopy.CopyWriter(pgload.CopyStream(conninfo, dbschema, table_name))
+	else:
+		path_name = output_dir_name + "/" + file_name
+		file = pgcopy.CopyWriter(open(path_name, "w+"))
 	file.write(file_header)
 	return file
 
@@ -446,50 +550,69 @@ def copy_output_file_direct(file, table_name):
 
 # Use COPY FROM STDIN because security may prevent postgres from accessing the files directly
 def copy_output_file(file, table_name):
-	conn = PQconnectdb("dbname = " + dbname + " user = " + dbuser + " password = " + dbpass)
-	if (PQstatus(conn)):
-		raise Exception("COPY FROM STDIN PQconnectdb failed")
-	sql = "SET search_path TO " + dbschema
-	res = PQexec(conn, sql)
-	if (PQresultStatus(res) != 1):
-		raise Exception("COPY FROM STDIN PQexec failed - setting schema search path")
-	file.write(file_trailer)
-	file.seek(0)
-	sql = "COPY " + table_name + " FROM STDIN (FORMAT 'binary')"
-	res = PQexec(conn, sql)
-	if (PQresultStatus(res) != 4):
-		raise Exception("COPY FROM STDIN PQexec failed")
-	data = file.read(65536)
-	while (len(data)):
-		ret = PQputCopyData(conn, data, len(data))
-		if (ret != 1):
-			raise Exception("COPY FROM STDIN PQputCopyData failed, error " + str(ret))
-		data = file.read(65536)
-	ret = PQputCopyEnd(conn, None)
-	if (ret != 1):
-		raise Exception("COPY FROM STDIN PQputCopyEnd failed, error " + str(ret))
-	PQfinish(conn)
+	conn = pgload.Connection(conninfo, dbschema)
+	try:
+		file.write(file_trailer)
+		file.seek(0)
+		conn.copy_from(file, table_name)
+	finally:
+		conn.close()
+
+def execute_parallel(statements_per_table):
+	pgload.parallel([(pgload.execute_all, conninfo, dbschema, statements)
+			 for statements in statements_per_table], load_workers)
 
 def remove_output_file(file):
 	name = file.name
 	file.close()
 	os.unlink(name)
 
-thread_file		= open_output_file("thread_table.bin")
-dso_file		= open_output_file("dso_table.bin")
-instr_file		= open_output_file("instr_table.bin")
-symbol_file		= open_output_file("symbol_table.bin")
-sample_file		= open_output_file("sample_table.bin")
+thread_file		= open_output_file("thread_table.bin",	"threads")
+dso_file		= open_output_file("dso_table.bin",	"dsos")
+instr_file		= open_output_file("instr_table.bin",	"instructions")
+symbol_file		= open_output_file("symbol_table.bin",	"symbols")
+sample_file		= open_output_file("sample_table.bin",	"samples")
+transition_file		= open_output_file("transition_table.bin",	"branch_transitions")
+if perf_db_export_windows:
+	window_file		= open_output_file("window_table.bin",	"instruction_windows")
+	time_window_file	= open_output_file("time_window_table.bin",	"time_windows")
+if perf_db_export_breakdown:
+	thread_count_file	= open_output_file("thread_count_table.bin",	"instruction_threads")
+	cpu_count_file		= open_output_file("cpu_count_table.bin",	"instruction_cpus")
 if perf_db_export_calls or perf_db_export_callchains:
-	call_path_file          = open_output_file("call_path_table.bin")
+	call_path_file          = open_output_file("call_path_table.bin",	"call_paths")
 if perf_db_export_calls:
-	 call_file               = open_output_file("call_table.bin")
-# dictionary containing instruction stats, where ip is key
-ip_dict = {}
+	 call_file               = open_output_file("call_table.bin",	"calls")
+# Bound pack/append methods of the tables written for every sample or call
+flush_rows	= pgcopy.FLUSH_ROWS
+sample_pack	= pgcopy.SAMPLE.pack
+sample_append	= sample_file.rows.append
+if perf_db_export_calls or perf_db_export_callchains:
+	call_path_pack		= pgcopy.CALL_PATH.pack
+	call_path_append	= call_path_file.rows.append
+if perf_db_export_calls:
+	call_pack		= pgcopy.CALL.pack
+	call_append		= call_file.rows.append
+# instruction stats of every distinct ip, see ipstore.py
+instructions = ipstore.InstructionStore()
+add_instruction = instructions.add
+# branch sample count per (symbol_id << 32 | to_symbol_id)
+transitions = {}
+if perf_db_export_windows:
+	window_counts = ipstore.WindowCounts(perf_db_export_windows)
+	add_window_count = window_counts.add
+if perf_db_export_breakdown:
+	thread_counts = ipstore.PairCounts()
+	add_thread_count = thread_counts.add
+	cpu_counts = ipstore.PairCounts()
+	add_cpu_count = cpu_counts.add
 dso_ids = []
 
 def trace_begin():
-	print datetime.datetime.today(), "Writing to intermediate files..."
+	if perf_db_export_stream:
+		print datetime.datetime.today(), "Streaming to database..."
+	else:
+		print datetime.datetime.today(), "Writing to intermediate files..."
 	thread_table(0, 0, 0, -1, -1)
 	dso_table(0, 0, "unknown", "unknown", "")
 	symbol_table(0, 0, 0, 0, 0, "unknown")
@@ -500,60 +623,95 @@ unhandled_count = 0
 def trace_end():
 	print datetime.datetime.today(), "Writing instructions summary to file..."
 	instruction_table()
-
-	print datetime.datetime.today(), "Copying to database..."
-	copy_output_file(thread_file,		"threads")
-	copy_output_file(dso_file,		"dsos")
-	copy_output_file(instr_file,		"instructions")
-	copy_output_file(symbol_file,		"symbols")
-	copy_output_file(sample_file,		"samples")
-	copy_output_file(thread_file,		"threads")
-	if perf_db_export_calls or perf_db_export_callchains:
-		copy_output_file(call_path_file,        "call_paths")
-	if perf_db_export_calls:
-		copy_output_file(call_file,             "calls")
- 
-	print datetime.datetime.today(), "Removing intermediate files..."
-	remove_output_file(thread_file)
-	remove_output_file(dso_file)
-	remove_output_file(instr_file)
-	remove_output_file(symbol_file)
-	remove_output_file(sample_file)
+	transition_table()
+	if perf_db_export_windows:
+		window_table()
+	if perf_db_export_breakdown:
+		breakdown_table()
+
+	tables = [
+		(thread_file,		"threads"),
+		(dso_file,		"dsos"),
+		(instr_file,		"instructions"),
+		(symbol_file,		"symbols"),
+		(sample_file,		"samples"),
+		(transition_file,	"branch_transitions"),
+	]
+	if perf_db_export_windows:
+		tables.append((window_file,	"instruction_windows"))
+		tables.append((time_window_file,	"time_windows"))
+	if perf_db_export_breakdown:
+		tables.append((thread_count_file,	"instruction_threads"))
+		tables.append((cpu_count_file,	"instruction_cpus"))
 	if perf_db_export_calls or perf_db_export_callchains:
-		remove_output_file(call_path_file)
+		tables.append((call_path_file,	"call_paths"))
 	if perf_db_export_calls:
-		remove_output_file(call_file)
- 	os.rmdir(output_dir_name)
+		tables.append((call_file,	"calls"))
+	if perf_db_export_stream:
+		print datetime.datetime.today(), "Finishing streamed copies..."
+		pgload.parallel([(close_output_file, file) for file, table_name in tables],
+				len(tables))
+	else:
+		print datetime.datetime.today(), "Copying to database..."
+		pgload.parallel([(copy_output_file, file, table_name) for file, table_name in tables],
+				load_workers)
+
+		print datetime.datetime.today(), "Removing intermediate files..."
+		for file, table_name in tables:
+			remove_output_file(file)
+		os.rmdir(output_dir_name)
+
 	print datetime.datetime.today(), "Adding primary keys"
-	do_query(query, 'ALTER TABLE threads         ADD PRIMARY KEY (tid)')
-	do_query(query, 'ALTER TABLE dsos            ADD PRIMARY KEY (id)')
-	do_query(query, 'ALTER TABLE instructions    ADD PRIMARY KEY (id)')
-	do_query(query, 'ALTER TABLE symbols         ADD PRIMARY KEY (id)')
-	do_query(query, 'ALTER TABLE samples         ADD PRIMARY KEY (id)')
+	primary_keys = [
+		['ALTER TABLE threads         ADD PRIMARY KEY (tid)'],
+		['ALTER TABLE dsos            ADD PRIMARY KEY (id)'],
+		['ALTER TABLE instructions    ADD PRIMARY KEY (id)'],
+		['ALTER TABLE symbols         ADD PRIMARY KEY (id)'],
+		['ALTER TABLE samples         ADD PRIMARY KEY (id)'],
+		['ALTER TABLE branch_transitions ADD PRIMARY KEY (from_symbol_id, to_symbol_id)'],
+	]
+	if perf_db_export_windows:
+		primary_keys.append(['ALTER TABLE instruction_windows ADD PRIMARY KEY (window_id, instruction_id)'])
+		primary_keys.append(['ALTER TABLE time_windows    ADD PRIMARY KEY (id)'])
+	if perf_db_export_breakdown:
+		primary_keys.append(['ALTER TABLE instruction_threads ADD PRIMARY KEY (thread_id, instruction_id)'])
+		primary_keys.append(['ALTER TABLE instruction_cpus ADD PRIMARY KEY (cpu_id, instruction_id)'])
 	if perf_db_export_calls or perf_db_export_callchains:
-		do_query(query, 'ALTER TABLE call_paths      ADD PRIMARY KEY (id)')
+		primary_keys.append(['ALTER TABLE call_paths      ADD PRIMARY KEY (id)'])
 	if perf_db_export_calls:
-		do_query(query, 'ALTER TABLE calls           ADD PRIMARY KEY (id)')
+		primary_keys.append(['ALTER TABLE calls           ADD PRIMARY KEY (id)'])
+	execute_parallel(primary_keys)
 
 	print datetime.datetime.today(), "Adding foreign keys"
-	do_query(query, 'ALTER TABLE symbols '
-					'ADD CONSTRAINT dsofk		FOREIGN KEY (dso_id)			REFERENCES dsos			(id)')
-	do_query(query, 'ALTER TABLE instructions '
-					'ADD CONSTRAINT symfk		FOREIGN KEY (symbol_id)			REFERENCES symbols		(id)')
-	do_query(query, 'ALTER TABLE samples '
+	# One statement list per referencing table; the references form no
+	# cycle, so the lock waits between the lists cannot deadlock
+	foreign_keys = [
+		['ALTER TABLE symbols '
+					'ADD CONSTRAINT dsofk		FOREIGN KEY (dso_id)			REFERENCES dsos			(id)'],
+		['ALTER TABLE instructions '
+					'ADD CONSTRAINT symfk		FOREIGN KEY (symbol_id)			REFERENCES symbols		(id)'],
+		['ALTER TABLE samples '
 					'ADD CONSTRAINT threadfk	FOREIGN KEY (thread_id)			REFERENCES threads		(tid),'
-					'ADD CONSTRAINT instrfk		FOREIGN KEY (instruction_id)	REFERENCES instructions	(id)')
+					'ADD CONSTRAINT instrfk		FOREIGN KEY (instruction_id)	REFERENCES instructions	(id)'],
+	]
 	if perf_db_export_calls or perf_db_export_callchains:
-		do_query(query, 'ALTER TABLE call_paths '
+		foreign_keys.append(['ALTER TABLE call_paths '
 					'ADD CONSTRAINT parentfk    FOREIGN KEY (parent_id)    REFERENCES call_paths (id),'
-					'ADD CONSTRAINT symbolfk    FOREIGN KEY (symbol_id)    REFERENCES symbols    (id)')
+					'ADD CONSTRAINT symbolfk    FOREIGN KEY (symbol_id)    REFERENCES symbols    (id)'])
 	if perf_db_export_calls:
-		do_query(query, 'ALTER TABLE calls '
+		foreign_keys.append(['ALTER TABLE calls '
 					'ADD CONSTRAINT call_pathfk FOREIGN KEY (call_path_id) REFERENCES call_paths (id),'
 					'ADD CONSTRAINT callfk      FOREIGN KEY (call_id)      REFERENCES samples    (id),'
 					'ADD CONSTRAINT returnfk    FOREIGN KEY (return_id)    REFERENCES samples    (id),'
-					'ADD CONSTRAINT parent_call_pathfk FOREIGN KEY (parent_call_path_id) REFERENCES call_paths (id)')
-		do_query(query, 'CREATE INDEX pcpid_idx ON calls (parent_call_path_id)')
+					'ADD CONSTRAINT parent_call_pathfk FOREIGN KEY (parent_call_path_id) REFERENCES call_paths (id)',
+				     'CREATE INDEX pcpid_idx ON calls (parent_call_path_id)'])
+	execute_parallel(foreign_keys)
+
+	print datetime.datetime.today(), "Running post-import stages"
+	optional_stages = []
+	if perf_db_export_materialize:
+		optional_stages.append("instructions_flat")
+	postprocess.run(conf.conn, dbschema, optional=optional_stages)
   	if (unhandled_count):
 		print datetime.datetime.today(), "Warning: ", unhandled_count, " unhandled events"
 	print datetime.datetime.today(), "Done"
@@ -572,8 +730,7 @@ def machine_table(machine_id, pid, root_dir, *x):
 	pass
 
 def thread_table(thread_id, machine_id, process_id, pid, tid, *x):
-	value = struct.pack("!hiiii", 2, 4, tid, 4, pid)
-	thread_file.write(value)
+	thread_file.write(pgcopy.THREAD.pack(2, 4, tid, 4, pid))
 
 def comm_table(comm_id, comm_str, *x):
 	pass
@@ -598,9 +755,7 @@ def dso_table(dso_id, machine_id, short_name, long_name, build_id, *x):
 		n = 255
 		short_name = short_name[:255]
 		print datetime.datetime.today(), "Warning: DSO name longer than max allowed by DB. Truncating"
-	fmt = "!hihi" + str(n) + "s"
-	value = struct.pack(fmt, 2, 2, dso_id, n, short_name)
-	dso_file.write(value)
+	dso_file.write_parts(pgcopy.DSO_PREFIX.pack(2, 2, dso_id, n), short_name)
 
 def symbol_table(symbol_id, dso_id, sym_start, sym_end, binding, symbol_name, *x):
 	n = len(symbol_name)
@@ -614,59 +769,62 @@ def symbol_table(symbol_id, dso_id, sym_start, sym_end, binding, symbol_name, *x
 				dso_id = dso_ids[1]
 			else:
 				dso_id = dso_ids[0]
-	fmt = "!hiiihi" + str(n) + "s" + "iqiq"
-	value = struct.pack(fmt, 5, 4, symbol_id, 2, dso_id, n, symbol_name, 8, sym_start, 8, sym_end)
-	symbol_file.write(value)
+	symbol_file.write_parts(pgcopy.SYMBOL_PREFIX.pack(5, 4, symbol_id, 2, dso_id, n),
+				symbol_name,
+				pgcopy.SYMBOL_SUFFIX.pack(8, sym_start, 8, sym_end))
 
 def branch_type_table(branch_type, name, *x):
 	pass
 
 def sample_table(sample_id, evsel_id, machine_id, tid, comm_id, dso_id, symbol_id, sym_offset, ip, time, cpu, to_dso_id, to_symbol_id, to_sym_offset, to_ip, period, weight, transaction, data_src, branch_type, in_tx, call_path_id, insn, *x):
-	instr_id = get_instruction_id(ip)
-	instr_dict_insert(instr_id, symbol_id, ip, insn, sym_offset)
-	fmt = "!hiiihiqiiii"
-	value = struct.pack(fmt, 5, 4, sample_id, 2, cpu, 8, time, 4, instr_id, 4, tid)
-	sample_file.write(value)
+	instr_id = add_instruction(ip, symbol_id, sym_offset, insn)
+	edge = (symbol_id << 32) | to_symbol_id
+	transitions[edge] = transitions.get(edge, 0) + 1
+	if perf_db_export_windows:
+		add_window_count(instr_id, time)
+	if perf_db_export_breakdown:
+		add_thread_count(instr_id, tid)
+		add_cpu_count(instr_id, cpu)
+	if perf_db_export_heatmap_only:
+		return
+	sample_append(sample_pack(5, 4, sample_id, 2, cpu, 8, time, 4, instr_id, 4, tid))
+	if len(sample_file.rows) >= flush_rows:
+		sample_file.flush()
 
 def call_path_table(cp_id, parent_id, symbol_id, ip, *x):
-	fmt = "!hiiiiiiiq"
-	value = struct.pack(fmt, 4, 4, cp_id, 4, parent_id, 4, symbol_id, 8, ip)
-	call_path_file.write(value)
+	call_path_append(call_path_pack(4, 4, cp_id, 4, parent_id, 4, symbol_id, 8, ip))
+	if len(call_path_file.rows) >= flush_rows:
+		call_path_file.flush()
 
 def call_return_table(cr_id, thread_id, comm_id, call_path_id, call_time, return_time, branch_count, call_id, return_id, parent_call_path_id, flags, *x):
-	fmt = "!hiiiiiqiqiiiiiiiiii"
 	if return_id != 0:
-		value = struct.pack(fmt, 9, 4, cr_id, 4, call_path_id, 8, call_time, 8, return_time, 4, branch_count, 4, call_id, 4, return_id, 4, parent_call_path_id, 4, flags)
-		call_file.write(value)
+		call_append(call_pack(9, 4, cr_id, 4, call_path_id, 8, call_time, 8, return_time, 4, branch_count, 4, call_id, 4, return_id, 4, parent_call_path_id, 4, flags))
+		if len(call_file.rows) >= flush_rows:
+			call_file.flush()
 
 def instruction_table():
-	for ip in ip_dict:
-		value = bytearray()
-		opcode_len = len(ip_dict[ip]["opcode"])
-		instr_id = ip_dict[ip]["id"]
-		symbol_id = ip_dict[ip]["symbol_id"]
-		exec_count = ip_dict[ip]["exec_count"]
-		sym_offset = ip_dict[ip]["sym_offset"]
-		value.extend(struct.pack("!hiiiiiqiiiqi", 6, 4, instr_id, 4, symbol_id, 8, ip, 4, exec_count, 8, sym_offset, opcode_len))
-		value.extend(ip_dict[ip]["opcode"])
-		instr_file.write(value)
-
-def get_instruction_id(ip):
-	if ip in ip_dict:
-		return ip_dict[ip]["id"]
-	else:
-		ip_dict[ip] = {}
-		# lock in id
-		instr_id = len(ip_dict)
-		ip_dict[ip]["id"] = instr_id
-		ip_dict[ip]["exec_count"] = -1
-		return instr_id
-
-def instr_dict_insert(instr_id, symbol_id, ip, opcode, sym_offset):
-	if ip_dict[ip]["exec_count"] > -1:
-		ip_dict[ip]["exec_count"] += 1
-	else:
-		ip_dict[ip]["exec_count"] = 1
-		ip_dict[ip]["symbol_id"] = symbol_id
-		ip_dict[ip]["opcode"] = opcode
-		ip_dict[ip]["sym_offset"] = sym_offset
+	instruction_pack = pgcopy.INSTRUCTION.pack
+	for instr_id, symbol_id, ip, exec_count, sym_offset, opcode in instructions.rows():
+		instr_file.write_parts(instruction_pack(6, 4, instr_id, 4, symbol_id, 8, ip, 4, exec_count, 8, sym_offset, len(opcode)),
+				       opcode)
+
+def transition_table():
+	transition_pack = pgcopy.TRANSITION.pack
+	for edge, count in transitions.iteritems():
+		transition_file.write(transition_pack(3, 4, edge >> 32, 4, edge & 0xffffffff, 8, count))
+
+def window_table():
+	window_pack = pgcopy.WINDOW_COUNT.pack
+	for instr_id, window, exec_count in window_counts.rows():
+		window_file.write(window_pack(3, 4, instr_id, 2, window, 4, exec_count))
+	time_window_pack = pgcopy.TIME_WINDOW.pack
+	for window, start_time, end_time in window_counts.bounds():
+		time_window_file.write(time_window_pack(3, 2, window, 8, start_time, 8, end_time))
+
+def breakdown_table():
+	thread_count_pack = pgcopy.THREAD_COUNT.pack
+	for instr_id, tid, exec_count in thread_counts.rows():
+		thread_count_file.write(thread_count_pack(3, 4, instr_id, 4, tid, 4, exec_count))
+	cpu_count_pack = pgcopy.CPU_COUNT.pack
+	for instr_id, cpu, exec_count in cpu_counts.rows():
+		cpu_count_file.write(cpu_count_pack(3, 4, instr_id, 2, cpu, 4, exec_count))
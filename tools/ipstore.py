@@ -0,0 +1,144 @@
+# ipstore.py: compact per-instruction statistics for export-to-postgresql.py
+# Copyright (c) 2014-2019, Intel Corporation.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms and conditions of the GNU General Public License,
+# version 2, as published by the Free Software Foundation.
+#
+# This program is distributed in the hope it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+
+from array import array
+
+class InstructionStore(object):
+	"""Statistics of every distinct ip seen in the samples.
+
+	The only per-ip Python objects are the entries of the ip -> index map.
+	Everything else lives in parallel typed arrays indexed by the entry's
+	position, and all opcodes are concatenated into one shared bytearray.
+	Instruction ids are positions + 1, in order of first appearance."""
+
+	__slots__ = ("index", "ips", "symbol_ids", "sym_offsets",
+		     "exec_counts", "opcode_offsets", "opcodes")
+
+	def __init__(self):
+		self.index = {}
+		self.ips = array("L")
+		self.symbol_ids = array("l")
+		self.sym_offsets = array("l")
+		self.exec_counts = array("l")
+		# opcode of entry n is opcodes[opcode_offsets[n]:opcode_offsets[n + 1]]
+		self.opcode_offsets = array("L", [0])
+		self.opcodes = bytearray()
+
+	def __len__(self):
+		return len(self.ips)
+
+	def add(self, ip, symbol_id, sym_offset, opcode):
+		"""Counts one execution of ip and returns its instruction id"""
+		pos = self.index.get(ip)
+		if pos is not None:
+			self.exec_counts[pos] += 1
+			return pos + 1
+		pos = len(self.ips)
+		self.index[ip] = pos
+		self.ips.append(ip)
+		self.symbol_ids.append(symbol_id)
+		self.sym_offsets.append(sym_offset)
+		self.exec_counts.append(1)
+		self.opcodes.extend(opcode)
+		self.opcode_offsets.append(len(self.opcodes))
+		return pos + 1
+
+	def rows(self):
+		"""Yields (id, symbol_id, ip, exec_count, sym_offset, opcode) per entry"""
+		offsets = self.opcode_offsets
+		opcodes = self.opcodes
+		for pos in xrange(len(self.ips)):
+			yield (pos + 1, self.symbol_ids[pos], self.ips[pos],
+			       self.exec_counts[pos], self.sym_offsets[pos],
+			       bytes(opcodes[offsets[pos]:offsets[pos + 1]]))
+
+class WindowCounts(object):
+	"""Sparse exec counts per (instruction id, time window) for a fixed
+	number of equal time windows.
+
+	The trace length is only known at the end, so the window width starts
+	at one time unit and doubles, merging neighbouring windows, whenever a
+	sample lands past the last window."""
+
+	__slots__ = ("windows", "start", "width", "counts")
+
+	# low bits of a counts key that hold the window
+	WINDOW_BITS = 16
+
+	def __init__(self, windows):
+		if windows < 1 or windows > 1 << (self.WINDOW_BITS - 1):
+			raise ValueError("window count out of range: " + str(windows))
+		self.windows = windows
+		self.start = None
+		self.width = 1
+		# instr_id << WINDOW_BITS | window -> count
+		self.counts = {}
+
+	def add(self, instr_id, time):
+		if self.start is None:
+			self.start = time
+		window = (time - self.start) // self.width
+		if window >= self.windows:
+			self._widen(time)
+			window = (time - self.start) // self.width
+		elif window < 0:
+			window = 0
+		key = (instr_id << self.WINDOW_BITS) | window
+		self.counts[key] = self.counts.get(key, 0) + 1
+
+	def _widen(self, time):
+		shift = 0
+		while (time - self.start) // (self.width << shift) >= self.windows:
+			shift += 1
+		self.width <<= shift
+		mask = (1 << self.WINDOW_BITS) - 1
+		merged = {}
+		for key, count in self.counts.iteritems():
+			key = (key & ~mask) | ((key & mask) >> shift)
+			merged[key] = merged.get(key, 0) + count
+		self.counts = merged
+
+	def rows(self):
+		"""Yields (instr_id, window, exec_count) per non-zero count"""
+		mask = (1 << self.WINDOW_BITS) - 1
+		for key, count in self.counts.iteritems():
+			yield (key >> self.WINDOW_BITS, key & mask, count)
+
+	def bounds(self):
+		"""Yields (window, start_time, end_time) for every window"""
+		if self.start is None:
+			return
+		for window in xrange(self.windows):
+			start_time = self.start + window * self.width
+			yield (window, start_time, start_time + self.width - 1)
+
+class PairCounts(object):
+	"""Sparse exec counts per (instruction id, 32-bit value) pair, such as
+	per thread or per cpu, each pair packed into a single int key"""
+
+	__slots__ = ("counts",)
+
+	def __init__(self):
+		# instr_id << 32 | (value & 0xffffffff) -> count
+		self.counts = {}
+
+	def add(self, instr_id, value):
+		key = (instr_id << 32) | (value & 0xffffffff)
+		self.counts[key] = self.counts.get(key, 0) + 1
+
+	def rows(self):
+		"""Yields (instr_id, value, exec_count) per non-zero count"""
+		for key, count in self.counts.iteritems():
+			value = key & 0xffffffff
+			if value & 0x80000000:
+				value -= 1 << 32
+			yield (key >> 32, value, count)
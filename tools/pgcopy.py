@@ -0,0 +1,76 @@
+# pgcopy.py: buffered PostgreSQL binary COPY encoding for export-to-postgresql.py
+# Copyright (c) 2014-2019, Intel Corporation.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms and conditions of the GNU General Public License,
+# version 2, as published by the Free Software Foundation.
+#
+# This program is distributed in the hope it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+
+import struct
+
+# Encoded rows are kept in memory and written out this many at a time
+FLUSH_ROWS = 64 * 1024
+
+file_header = struct.pack("!11sii", b"PGCOPY\n\377\r\n\0", 0, 0)
+file_trailer = b"\377\377"
+
+# Precompiled row layouts: field count, then (length, value) per field.
+# Variable length fields (names, opcodes) are appended as raw bytes between
+# a prefix and an optional suffix struct.
+THREAD		= struct.Struct("!hiiii")
+DSO_PREFIX	= struct.Struct("!hihi")
+SYMBOL_PREFIX	= struct.Struct("!hiiihi")
+SYMBOL_SUFFIX	= struct.Struct("!iqiq")
+SAMPLE		= struct.Struct("!hiiihiqiiii")
+CALL_PATH	= struct.Struct("!hiiiiiiiq")
+CALL		= struct.Struct("!hiiiiiqiqiiiiiiiiii")
+INSTRUCTION	= struct.Struct("!hiiiiiqiiiqi")
+TRANSITION	= struct.Struct("!hiiiiiq")
+WINDOW_COUNT	= struct.Struct("!hiiihii")
+TIME_WINDOW	= struct.Struct("!hihiqiq")
+THREAD_COUNT	= struct.Struct("!hiiiiii")
+CPU_COUNT	= struct.Struct("!hiiihii")
+
+class CopyWriter(object):
+	"""File-like wrapper that keeps encoded rows in a list and writes them to
+	the underlying file in one block every FLUSH_ROWS rows.
+
+	Hot paths can skip the method call by appending to 'rows' directly, as
+	long as they call flush() once len(rows) reaches 'flush_rows'."""
+
+	def __init__(self, file, flush_rows=FLUSH_ROWS):
+		self.file = file
+		self.name = file.name
+		self.flush_rows = flush_rows
+		self.rows = []
+
+	def write(self, data):
+		self.rows.append(data)
+		if len(self.rows) >= self.flush_rows:
+			self.flush()
+
+	def write_parts(self, *parts):
+		self.rows.extend(parts)
+		if len(self.rows) >= self.flush_rows:
+			self.flush()
+
+	def flush(self):
+		if self.rows:
+			self.file.write(b"".join(self.rows))
+			# keep the same list, callers may hold its bound append
+			del self.rows[:]
+
+	def seek(self, offset):
+		self.flush()
+		self.file.seek(offset)
+
+	def read(self, size):
+		return self.file.read(size)
+
+	def close(self):
+		self.flush()
+		self.file.close()
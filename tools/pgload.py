@@ -0,0 +1,200 @@
+# pgload.py: parallel and streaming COPY FROM STDIN over libpq for export-to-postgresql.py
+# Copyright (c) 2014-2019, Intel Corporation.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms and conditions of the GNU General Public License,
+# version 2, as published by the Free Software Foundation.
+#
+# This program is distributed in the hope it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# Every task gets its own libpq connection. ctypes releases the GIL around
+# libpq calls, so plain threads are enough to keep several COPY sessions (or
+# ALTER TABLE / CREATE INDEX statements) busy on the server at once.
+
+import threading
+import Queue
+
+# Need to access PostgreSQL C library directly to use COPY FROM STDIN
+from ctypes import *
+libpq = CDLL("libpq.so.5")
+PQconnectdb = libpq.PQconnectdb
+PQconnectdb.restype = c_void_p
+PQconnectdb.argtypes = [c_char_p]
+PQfinish = libpq.PQfinish
+PQfinish.argtypes = [c_void_p]
+PQstatus = libpq.PQstatus
+PQstatus.argtypes = [c_void_p]
+PQerrorMessage = libpq.PQerrorMessage
+PQerrorMessage.restype = c_char_p
+PQerrorMessage.argtypes = [c_void_p]
+PQexec = libpq.PQexec
+PQexec.restype = c_void_p
+PQexec.argtypes = [c_void_p, c_char_p]
+PQresultStatus = libpq.PQresultStatus
+PQresultStatus.argtypes = [c_void_p]
+PQgetResult = libpq.PQgetResult
+PQgetResult.restype = c_void_p
+PQgetResult.argtypes = [c_void_p]
+PQclear = libpq.PQclear
+PQclear.argtypes = [c_void_p]
+PQputCopyData = libpq.PQputCopyData
+PQputCopyData.argtypes = [ c_void_p, c_void_p, c_int ]
+PQputCopyEnd = libpq.PQputCopyEnd
+PQputCopyEnd.argtypes = [ c_void_p, c_void_p ]
+
+CONNECTION_OK = 0
+PGRES_COMMAND_OK = 1
+PGRES_COPY_IN = 4
+
+# Bytes handed to PQputCopyData at a time
+COPY_BUFFER = 1024 * 1024
+
+class Connection(object):
+	"""libpq connection with search_path set to the trace schema"""
+
+	def __init__(self, conninfo, schema):
+		self.conn = PQconnectdb(conninfo)
+		if (PQstatus(self.conn) != CONNECTION_OK):
+			error = self.error()
+			PQfinish(self.conn)
+			raise Exception("PQconnectdb failed: " + error)
+		self.execute("SET search_path TO " + schema)
+
+	def error(self):
+		return (PQerrorMessage(self.conn) or "").strip()
+
+	def execute(self, sql, expected=PGRES_COMMAND_OK):
+		res = PQexec(self.conn, sql)
+		status = PQresultStatus(res)
+		PQclear(res)
+		if (status != expected):
+			raise Exception("PQexec failed (" + sql + "): " + self.error())
+
+	def copy_start(self, table_name):
+		self.execute("COPY " + table_name + " FROM STDIN (FORMAT 'binary')", PGRES_COPY_IN)
+
+	def copy_data(self, data):
+		ret = PQputCopyData(self.conn, data, len(data))
+		if (ret != 1):
+			raise Exception("COPY FROM STDIN PQputCopyData failed, error " + str(ret) + ": " + self.error())
+
+	def copy_end(self):
+		ret = PQputCopyEnd(self.conn, None)
+		if (ret != 1):
+			raise Exception("COPY FROM STDIN PQputCopyEnd failed, error " + str(ret))
+		# The COPY only succeeded if its final result says so
+		failed = False
+		res = PQgetResult(self.conn)
+		while res:
+			if (PQresultStatus(res) != PGRES_COMMAND_OK):
+				failed = True
+			PQclear(res)
+			res = PQgetResult(self.conn)
+		if failed:
+			raise Exception("COPY FROM STDIN failed: " + self.error())
+
+	def copy_from(self, file, table_name):
+		"""Copies a complete binary COPY file, read from its current position"""
+		self.copy_start(table_name)
+		data = file.read(COPY_BUFFER)
+		while (len(data)):
+			self.copy_data(data)
+			data = file.read(COPY_BUFFER)
+		self.copy_end()
+
+	def close(self):
+		if self.conn:
+			PQfinish(self.conn)
+			self.conn = None
+
+# Blocks a CopyStream may hold before write() waits for the database
+STREAM_QUEUE = 16
+
+class CopyStream(object):
+	"""Write-only file that feeds a COPY FROM STDIN session.
+
+	The COPY is started right away. A writer thread sends the written
+	blocks to the server, so the caller only waits once STREAM_QUEUE blocks
+	are pending. close() ends the COPY and raises if it failed."""
+
+	def __init__(self, conninfo, schema, table_name, queue_size=STREAM_QUEUE):
+		self.name = table_name
+		self.conn = Connection(conninfo, schema)
+		self.conn.copy_start(table_name)
+		self.blocks = Queue.Queue(queue_size)
+		self.error = None
+		self.thread = threading.Thread(target=self._send)
+		self.thread.daemon = True
+		self.thread.start()
+
+	def _send(self):
+		while True:
+			data = self.blocks.get()
+			if data is None:
+				break
+			if self.error is not None:
+				# keep draining so that write() never blocks
+				continue
+			try:
+				self.conn.copy_data(data)
+			except Exception as e:
+				self.error = e
+		if self.error is None:
+			try:
+				self.conn.copy_end()
+			except Exception as e:
+				self.error = e
+		self.conn.close()
+
+	def write(self, data):
+		if self.error is not None:
+			raise self.error
+		self.blocks.put(data)
+
+	def close(self):
+		if self.thread is None:
+			return
+		self.blocks.put(None)
+		self.thread.join()
+		self.thread = None
+		if self.error is not None:
+			raise self.error
+
+def parallel(tasks, workers):
+	"""Runs (function, args...) tuples on up to 'workers' threads and
+	re-raises the first exception once every task has finished"""
+	pending = Queue.Queue()
+	for task in tasks:
+		pending.put(task)
+	errors = []
+
+	def worker():
+		while True:
+			try:
+				task = pending.get_nowait()
+			except Queue.Empty:
+				return
+			try:
+				task[0](*task[1:])
+			except Exception as e:
+				errors.append(e)
+
+	threads = [threading.Thread(target=worker) for i in range(max(1, min(workers, len(tasks))))]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+	if errors:
+		raise errors[0]
+
+def execute_all(conninfo, schema, statements):
+	"""Runs a list of statements in order on a connection of its own"""
+	conn = Connection(conninfo, schema)
+	try:
+		for sql in statements:
+			conn.execute(sql)
+	finally:
+		conn.close()
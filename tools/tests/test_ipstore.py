@@ -0,0 +1,113 @@
+# test_ipstore.py: tests of the per-instruction statistics of ipstore.py
+# Copyright (c) 2014-2019, Intel Corporation.
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms and conditions of the GNU General Public License,
+# version 2, as published by the Free Software Foundation.
+#
+# This program is distributed in the hope it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# Run from tools/ with:
+#
+#	$ python -m unittest discover -s tests -t .
+
+import os
+import sys
+import random
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import ipstore
+
+class InstructionStoreTest(unittest.TestCase):
+	def test_ids_in_first_appearance_order(self):
+		store = ipstore.InstructionStore()
+		self.assertEqual(store.add(0x2000, 7, 0, b"\x55"), 1)
+		self.assertEqual(store.add(0x1000, 3, 4, b"\x48\x89\xe5"), 2)
+		self.assertEqual(store.add(0x2000, 7, 0, b"\x55"), 1)
+		self.assertEqual(list(store.rows()),
+				 [(1, 7, 0x2000, 2, 0, b"\x55"),
+				  (2, 3, 0x1000, 1, 4, b"\x48\x89\xe5")])
+
+class WindowCountsTest(unittest.TestCase):
+	def check(self, windows, samples):
+		counts = ipstore.WindowCounts(windows)
+		for instr_id, time in samples:
+			counts.add(instr_id, time)
+		# Every sample in the window of its time at the final width, those
+		# before the first sample in the first window
+		expected = {}
+		start = samples[0][1]
+		for instr_id, time in samples:
+			window = max(time - start, 0) // counts.width
+			self.assertTrue(window < windows)
+			key = (instr_id, window)
+			expected[key] = expected.get(key, 0) + 1
+		self.assertEqual(dict(((instr_id, window), count) for
+				      instr_id, window, count in counts.rows()),
+				 expected)
+		return counts
+
+	def test_no_widening(self):
+		counts = self.check(4, [(1, 100), (2, 101), (1, 103), (1, 100)])
+		self.assertEqual(counts.width, 1)
+		self.assertEqual(list(counts.bounds()),
+				 [(0, 100, 100), (1, 101, 101), (2, 102, 102),
+				  (3, 103, 103)])
+
+	def test_widen(self):
+		# 1000 time units in 4 windows: 1 -> 256 in one step
+		counts = self.check(4, [(1, 0), (2, 1), (3, 3), (1, 1000)])
+		self.assertEqual(counts.width, 256)
+		self.assertEqual(sorted(counts.rows()),
+				 [(1, 0, 1), (1, 3, 1), (2, 0, 1), (3, 0, 1)])
+		self.assertEqual(list(counts.bounds())[-1], (3, 768, 1023))
+
+	def test_out_of_order_times(self):
+		# Samples of other cpus come slightly out of order, including
+		# before the first sample
+		rnd = random.Random(3)
+		for trial in range(50):
+			time = 1000
+			samples = []
+			for idx in range(rnd.randint(1, 400)):
+				time += rnd.randint(-20, 30)
+				samples.append((rnd.randint(1, 5), time))
+			self.check(rnd.choice([1, 2, 7, 64]), samples)
+
+	def test_large_instruction_ids(self):
+		counts = self.check(16, [(1 << 31, 5), ((1 << 31) + 1, 6),
+					 (1 << 31, 5 + (1 << 20))])
+		self.assertEqual(counts.width, 1 << 17)
+
+	def test_window_count_range(self):
+		self.assertRaises(ValueError, ipstore.WindowCounts, 0)
+		self.assertRaises(ValueError, ipstore.WindowCounts, 32769)
+		self.assertEqual(list(ipstore.WindowCounts(8).bounds()), [])
+
+class PairCountsTest(unittest.TestCase):
+	def test_rows(self):
+		counts = ipstore.PairCounts()
+		for instr_id, value in [(1, 0), (1, 0), (1, 3), (2, 3),
+					(1 << 31, 0x7fffffff)]:
+			counts.add(instr_id, value)
+		self.assertEqual(sorted(counts.rows()),
+				 [(1, 0, 2), (1, 3, 1), (2, 3, 1),
+				  (1 << 31, 0x7fffffff, 1)])
+
+	def test_negative_values(self):
+		# perf reports cpu -1 when the sample has no cpu
+		counts = ipstore.PairCounts()
+		counts.add(4, -1)
+		counts.add(4, -1)
+		counts.add(4, 1)
+		counts.add(5, -(1 << 31))
+		self.assertEqual(sorted(counts.rows()),
+				 [(4, -1, 2), (4, 1, 1), (5, -(1 << 31), 1)])
+
+if __name__ == '__main__':
+	unittest.main()